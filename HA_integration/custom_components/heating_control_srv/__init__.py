@@ -71,9 +71,11 @@ async def async_setup_entry(hass: HomeAssistant, config_entry: config_entries.Co
     hass.data[DOMAIN][config_entry.entry_id] = hass_data
     
     _LOGGER.info('starting Controller')
-    heating_control_server = Controller('/config/', 'heating_ctrl_')
+    # asyncio mode : the server runs in HA event loop, without any thread of its own
+    heating_control_server = Controller('/config/', 'heating_ctrl_', hass.loop)
     try:
-        heating_control_server.start()
+        # configuration files are loaded in an executor, not to block HA event loop
+        await hass.async_add_executor_job(heating_control_server.start)
     except CfgError as exc:
         _LOGGER.error("Could not start heating server : "+exc.generic_desc,DOMAIN)
         heating_control_server.stop()
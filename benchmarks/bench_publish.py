@@ -0,0 +1,110 @@
+__author__      = "Jérôme Cuq"
+
+# MQTTClient.publish() micro-benchmark : publishes/sec of the current publish path,
+# compared with the previous one (new PUBLISH properties and bytearray payload for each message).
+# Packets are written to a socket that drops them, so that only the client side is measured.
+#
+# Standalone :    python benchmarks/bench_publish.py --count 10000 --output results.json
+# pytest :        python -m pytest benchmarks/bench_publish.py   (requires pytest-benchmark)
+
+import argparse
+import json
+import logging
+
+from bench_utils import measure, write_results
+import paho.mqtt.client as mqtt
+from paho.mqtt.properties import Properties
+from paho.mqtt.packettypes import PacketTypes
+from protocols.mqttclient import MQTTClient
+
+TOPIC:str = 'heatingcontrol/serverdata/devices/living_room'
+PAYLOAD:str = json.dumps({"current_temp": 19.5, "setpoint": 20.0, "state": "true", "min_temp": 5.0, "max_temp": 35.0})
+
+
+class SinkSocket:
+    """Connected socket that accepts and drops every packet"""
+    def send(self, data) -> int:
+        return len(data)
+
+    def recv(self, size:int) -> bytes:
+        return b''
+
+    def fileno(self) -> int:
+        return -1
+
+    def close(self):
+        pass
+
+
+def create_client(version:str) -> MQTTClient:
+    client = MQTTClient('bench', '127.0.0.1', 1883, 'user', 'pwd', 'tcp', ssl=False, mqtt_version=version)
+    client.paho_client._sock = SinkSocket()
+    return client
+
+def previous_publish(client:MQTTClient, data, topic:str, retain:bool=False, qos=1) -> bool:
+    # publish path before properties caching
+    properties:Properties=Properties(PacketTypes.PUBLISH)
+    properties.MessageExpiryInterval=30 # in seconds
+    sendData = data
+    if isinstance(data,str):
+        sendData = bytearray(data, encoding="utf-8")
+    mi: mqtt.MQTTMessageInfo = client.paho_client.publish(topic, sendData, retain=retain, qos=qos, properties=properties)
+    return mi.rc == mqtt.MQTT_ERR_SUCCESS
+
+def publish_previous(client:MQTTClient, count:int):
+    return lambda: [previous_publish(client, PAYLOAD, TOPIC, True, 0) for _ in range(count)]
+
+def publish_str(client:MQTTClient, count:int):
+    return lambda: [client.publish(PAYLOAD, TOPIC, True, 0) for _ in range(count)]
+
+def publish_bytes(client:MQTTClient, count:int):
+    payload:bytes = PAYLOAD.encode('utf-8')
+    return lambda: [client.publish(payload, TOPIC, True, 0) for _ in range(count)]
+
+
+def run(count:int, rounds:int, output:str = None) -> dict:
+    parameters:dict = {'count':count, 'payload_size':len(PAYLOAD)}
+    results:dict[str,dict] = {}
+    for version in ('3', '5'):
+        client = create_client(version)
+        results['v'+version+'_previous'] = measure(publish_previous(client, count), rounds)
+        results['v'+version+'_str'] = measure(publish_str(client, count), rounds)
+        results['v'+version+'_bytes'] = measure(publish_bytes(client, count), rounds)
+    data = write_results('publish', parameters, results, output)
+    for name, stats in results.items():
+        print(f"{name:<30} {count/stats['median']:12.0f} publishes/sec")
+    return data
+
+
+################################################################################
+# pytest-benchmark entry points (only if pytest-benchmark is installed)
+################################################################################
+try:
+    import pytest
+    import pytest_benchmark
+except ImportError:
+    pytest_benchmark = None
+
+if pytest_benchmark:
+    @pytest.fixture(scope='module', params=['3', '5'], ids=lambda version: 'v'+version)
+    def client(request):
+        return create_client(request.param)
+
+    def test_publish_previous(benchmark, client:MQTTClient):
+        benchmark(publish_previous(client, 1000))
+
+    def test_publish_str(benchmark, client:MQTTClient):
+        benchmark(publish_str(client, 1000))
+
+    def test_publish_bytes(benchmark, client:MQTTClient):
+        benchmark(publish_bytes(client, 1000))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='MQTTClient.publish() micro-benchmark')
+    parser.add_argument('--count', type=int, default=10000, help='number of publishes per measure')
+    parser.add_argument('--rounds', type=int, default=5, help='number of measures of each benchmark')
+    parser.add_argument('--output', default=None, help='json file the results are written to')
+    args = parser.parse_args()
+    logging.disable(logging.CRITICAL)
+    run(args.count, args.rounds, args.output)
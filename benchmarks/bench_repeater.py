@@ -0,0 +1,148 @@
+__author__      = "Jérôme Cuq"
+
+# CommandRepeater micro-benchmark : lookup, acknowledge, rename and removal of commands among many pending ones,
+# compared with the previous storage (flat dict keyed by command+'-'+device, scanned on rename/removal).
+#
+# Standalone :    python benchmarks/bench_repeater.py --devices 5000 --commands 2 --output results.json
+# pytest :        python -m pytest benchmarks/bench_repeater.py   (requires pytest-benchmark)
+
+import argparse
+import logging
+
+from bench_utils import measure, write_results
+from command_repeater import CommandRepeater, PendingCommand
+from timer_service import TimerService
+
+# long enough so that nothing is repeated during the benchmark
+REPEAT_DELAY_SEC:int = 3600
+# number of devices acknowledged, renamed or removed per measure
+OPERATIONS:int = 100
+
+
+class PreviousRepeater:
+    """Storage of the repeater before the per-device index (repeats are not emulated)"""
+    def __init__(self):
+        self.commands:dict[str,PendingCommand] = {}
+
+    def addCommand(self, device:str, command:str, callable, *args):
+        self.commands[command+'-'+device] = PendingCommand(device, command, callable, args)
+
+    def getCommand(self, device:str, command:str) -> PendingCommand:
+        cmdId:str = command+'-'+device
+        if cmdId in self.commands:
+            return self.commands[cmdId]
+        return None
+
+    def removeCommand(self, device:str, command:str):
+        cmdId:str = command+'-'+device
+        if cmdId in self.commands:
+            self.commands.pop(cmdId)
+
+    def remove_device_commands(self, devname:str):
+        to_delete:list = [cmdId for cmdId in self.commands if self.commands[cmdId].device == devname]
+        for cmdId in to_delete:
+            self.commands.pop(cmdId)
+
+    def set_device_name(self, old_name:str, new_name:str):
+        to_rename:list = [cmdId for cmdId in self.commands if self.commands[cmdId].device == old_name]
+        for cmdId in to_rename:
+            cmd = self.commands.pop(cmdId)
+            cmd.device = new_name
+            self.commands[cmd.command+'-'+new_name] = cmd
+
+    def stop(self):
+        pass
+
+
+def get_names(nb_devices:int, nb_commands:int) -> tuple[list[str],list[str]]:
+    return ['Dev'+str(idx) for idx in range(nb_devices)], ['command'+str(idx) for idx in range(nb_commands)]
+
+def fill(repeater, devices:list[str], commands:list[str]):
+    for device in devices:
+        for command in commands:
+            repeater.addCommand(device, command, print, device, command, 20.0)
+
+def lookup(repeater, devices:list[str], commands:list[str]):
+    return lambda: [repeater.getCommand(device, command) for device in devices for command in commands]
+
+def acknowledge(repeater, devices:list[str], commands:list[str]):
+    # setpoint echo, then new setpoint
+    def run():
+        for device in devices[:OPERATIONS]:
+            repeater.removeCommand(device, commands[0])
+            repeater.addCommand(device, commands[0], print, device, commands[0], 20.0)
+    return run
+
+def rename(repeater, devices:list[str]):
+    def run():
+        for device in devices[:OPERATIONS]:
+            repeater.set_device_name(device, device+'_renamed')
+            repeater.set_device_name(device+'_renamed', device)
+    return run
+
+def remove(repeater, devices:list[str], commands:list[str]):
+    # device removal, then creation of its commands
+    def run():
+        for device in devices[:OPERATIONS]:
+            repeater.remove_device_commands(device)
+            for command in commands:
+                repeater.addCommand(device, command, print, device, command, 20.0)
+    return run
+
+
+def run(nb_devices:int, nb_commands:int, rounds:int, output:str = None) -> dict:
+    parameters:dict = {'devices':nb_devices, 'commands':nb_commands, 'pending':nb_devices*nb_commands, 'operations':OPERATIONS}
+    devices, commands = get_names(nb_devices, nb_commands)
+    results:dict[str,dict] = {}
+    timer_service = TimerService()
+    timer_service.start()
+    try:
+        for name, repeater in (('previous', PreviousRepeater()), ('current', CommandRepeater(REPEAT_DELAY_SEC, timer_service))):
+            fill(repeater, devices, commands)
+            results[name+'_lookup_all'] = measure(lookup(repeater, devices, commands), rounds)
+            results[name+'_acknowledge'] = measure(acknowledge(repeater, devices, commands), rounds)
+            results[name+'_rename'] = measure(rename(repeater, devices), rounds)
+            results[name+'_remove_device'] = measure(remove(repeater, devices, commands), rounds)
+            repeater.stop()
+    finally:
+        timer_service.stop()
+    return write_results('repeater', parameters, results, output)
+
+
+################################################################################
+# pytest-benchmark entry points (only if pytest-benchmark is installed)
+################################################################################
+try:
+    import pytest
+    import pytest_benchmark
+except ImportError:
+    pytest_benchmark = None
+
+if pytest_benchmark:
+    @pytest.fixture(scope='module', params=['previous', 'current'])
+    def repeater(request):
+        devices, commands = get_names(5000, 2)
+        result = PreviousRepeater() if request.param == 'previous' else CommandRepeater(REPEAT_DELAY_SEC)
+        fill(result, devices, commands)
+        yield result
+        result.stop()
+
+    def test_acknowledge(benchmark, repeater):
+        benchmark(acknowledge(repeater, *get_names(5000, 2)))
+
+    def test_rename(benchmark, repeater):
+        benchmark(rename(repeater, get_names(5000, 2)[0]))
+
+    def test_remove_device(benchmark, repeater):
+        benchmark(remove(repeater, *get_names(5000, 2)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='CommandRepeater micro-benchmark')
+    parser.add_argument('--devices', type=int, default=5000, help='number of devices with pending commands')
+    parser.add_argument('--commands', type=int, default=2, help='number of pending commands per device')
+    parser.add_argument('--rounds', type=int, default=5, help='number of measures of each benchmark')
+    parser.add_argument('--output', default=None, help='json file the results are written to')
+    args = parser.parse_args()
+    logging.disable(logging.CRITICAL)
+    run(args.devices, args.commands, args.rounds, args.output)
@@ -0,0 +1,199 @@
+__author__      = "Jérôme Cuq"
+
+# Scheduler micro-benchmarks on synthetic configurations.
+#
+# Standalone :    python benchmarks/bench_scheduler.py --devices 100 --schedules 20 --depth 4 --timeslots 6 --output results.json
+# pytest :        python -m pytest benchmarks/bench_scheduler.py   (requires pytest-benchmark)
+
+import argparse
+import datetime
+import itertools
+import logging
+import os
+import random
+import tempfile
+import yaml
+
+from bench_utils import measure, write_results
+from configuration import Configuration
+from device import Device
+from scheduler import Scheduler, SchedulerCallbacks
+
+CONFIG_PREFIX:str = 'bench_'
+TEMPERATURE_SETS:list[str] = ['Comfort', 'Eco', 'Night', 'Away']
+
+def create_config_data(nb_devices:int, nb_schedules:int, depth:int, nb_timeslots:int, seed:int = 0) -> dict:
+    """Build a synthetic configuration :
+       - nb_devices devices, all in global temperature sets,
+       - nb_schedules schedules, organized in inheritance chains of 'depth' schedules
+         (each schedule of a chain inherits from the previous one and overrides a part of the devices),
+       - nb_timeslots timeslots per day, different for week days, week-ends and weeks A/B.
+       The active schedule is the last schedule of the first chain (deepest inheritance).
+    """
+    rand = random.Random(seed)
+    devices:list[str] = ['Dev'+str(idx) for idx in range(nb_devices)]
+
+    def create_timeslots() -> list[dict]:
+        minutes:list[int] = sorted(rand.sample(range(1, 24*60), nb_timeslots-1)) if nb_timeslots>1 else []
+        return [{'start_time':'%02d:%02d:00' % (minute//60, minute%60), 'temperature_set':rand.choice(TEMPERATURE_SETS)}
+                for minute in [0]+minutes]
+
+    schedules:list[dict] = []
+    for idx in range(nb_schedules):
+        level:int = idx%depth
+        # a child schedule only overrides some of its parent devices
+        schedule_devices:list[str] = devices[:max(1, nb_devices>>level)]
+        items:list[dict] = []
+        for start in range(0, len(schedule_devices), 10):
+            items.append({'devices':schedule_devices[start:start+10],
+                          'timeslots_sets':[{'dates':['1', '2', '3', '4', '5'], 'timeslots_A':create_timeslots(), 'timeslots_B':create_timeslots()},
+                                            {'dates':['6', '7'], 'timeslots':create_timeslots()}]})
+        schedule:dict = {'alias':'S'+str(idx), 'schedule_items':items}
+        if level>0:
+            schedule['parent_schedule'] = 'S'+str(idx-1)
+            # local temperature set that overrides a global one for a part of the devices
+            schedule['temperature_sets'] = [{'alias':'Comfort', 'parent':'Comfort',
+                                             'devices':[{'device_name':name, 'setpoint':22.0} for name in schedule_devices[::2]]}]
+        schedules.append(schedule)
+
+    temperature_sets:list[dict] = []
+    for tset_idx, alias in enumerate(TEMPERATURE_SETS):
+        temperature_sets.append({'alias':alias,
+                                 'devices':[{'device_name':name, 'setpoint':15.0+tset_idx+(dev_idx%5)*0.5} for dev_idx, name in enumerate(devices)]})
+
+    return {'version':7,
+            'settings':{'message_repeater':{'repeat_delay_sec':120}, 'scheduler':{'init_delay_sec':20}},
+            'protocols':{'mqtt':[{'name':'mqtt_ha', 'user':'mqtt', 'pwd':'mypasswd', 'broker':'127.0.0.1', 'port':1884,
+                                  'ssl':False, 'clean_session':True, 'on_ha_status_topic':'homeassistant/status'}]},
+            'devices':[{name:{'entity':'climate_'+name.lower(),
+                              'protocol':{'name':'mqtt_ha',
+                                          'params':{'device_base_topic':'homeassistant/climate/climate_'+name.lower(),
+                                                    'on_current_temp_subtopic':'current_temperature',
+                                                    'on_max_temp_subtopic':'max_temp',
+                                                    'on_min_temp_subtopic':'min_temp',
+                                                    'on_setpoint_subtopic':'temperature',
+                                                    'on_state_subtopic':'state',
+                                                    'set_setpoint_subtopic':'new_setpoint'}}}} for name in devices],
+            'remote_control':[],
+            'scheduler':{'settings':{'manual_mode_reset_event':'setpoint_change'},
+                         'active_schedule':'S'+str(min(depth, nb_schedules)-1),
+                         'schedules':schedules,
+                         'temperature_sets':temperature_sets}}
+
+def write_config(config_dir:str, config_data:dict) -> str:
+    """Write the configuration file in config_dir, return the prefix to give to Configuration"""
+    with open(os.path.join(config_dir, CONFIG_PREFIX+'configuration.yaml'), 'w', encoding='utf-8') as config_file:
+        yaml.safe_dump(config_data, config_file, sort_keys=False)
+    return CONFIG_PREFIX
+
+
+class SchedulerBench(SchedulerCallbacks):
+    """A scheduler on a synthetic configuration, whose thread stays idle (long init delay) :
+       all benchmarks call the scheduler methods directly
+    """
+    def __init__(self, config_dir:str, nb_devices:int, nb_schedules:int, depth:int, nb_timeslots:int):
+        self.config_dir:str = config_dir
+        write_config(config_dir, create_config_data(nb_devices, nb_schedules, depth, nb_timeslots))
+        self.configuration:Configuration = self.load_config()
+        devices:dict[str,Device] = {}
+        for name, params in self.configuration.get_devices().items():
+            devices[name] = Device(name, params['entity'], "", params['protocol']['name'], params['protocol']['params'])
+        self.scheduler:Scheduler = Scheduler(self.configuration.get_scheduler(), self, devices, 3600, 'setpoint_change')
+        self.start_date:datetime.datetime = datetime.datetime(2025, 1, 20)
+        self.dates:list[datetime.datetime] = [self.start_date + datetime.timedelta(minutes=minute) for minute in range(0, 14*24*60, 37)]
+
+    def stop(self):
+        self.scheduler.stop()
+
+    # SchedulerCallbacks
+    def apply_devices_setpoints(self, setpoints: dict[str,tuple[float,bool]]):
+        pass
+
+    def scheduler_error(self):
+        pass
+
+    def load_config(self) -> Configuration:
+        return Configuration(self.config_dir, CONFIG_PREFIX, auto_save=False)
+
+    def get_setpoints(self):
+        # each call evaluates the next date of a 2 weeks sample
+        next_date = itertools.cycle(self.dates).__next__
+        return lambda: self.scheduler.get_setpoints(next_date())
+
+    def setpoints_diff(self):
+        sp1 = self.scheduler.get_setpoints(self.start_date+datetime.timedelta(hours=8))[2]
+        sp2 = self.scheduler.get_setpoints(self.start_date+datetime.timedelta(hours=20))[2]
+        return lambda: Scheduler._Scheduler__get_setpoints_diff(sp1, sp2)
+
+    def compile(self):
+        self.scheduler.compiler.reset(self.scheduler.config_scheduler)
+        self.scheduler.compiler.compile(self.scheduler.config_scheduler['active_schedule'])
+
+    def simulated_day(self):
+        # One tick per minute, as the scheduler thread would do : evaluation then diff with previous setpoints
+        current:dict = {}
+        for minute in range(24*60):
+            new = self.scheduler.get_setpoints(self.start_date + datetime.timedelta(minutes=minute))[2]
+            Scheduler._Scheduler__get_setpoints_diff(current, new)
+            current = new
+
+
+def run(nb_devices:int, nb_schedules:int, depth:int, nb_timeslots:int, rounds:int, output:str = None) -> dict:
+    parameters:dict = {'devices':nb_devices, 'schedules':nb_schedules, 'depth':depth, 'timeslots':nb_timeslots}
+    results:dict[str,dict] = {}
+    with tempfile.TemporaryDirectory() as config_dir:
+        bench = SchedulerBench(config_dir, nb_devices, nb_schedules, depth, nb_timeslots)
+        try:
+            results['config_load'] = measure(bench.load_config, rounds)
+            results['compile'] = measure(bench.compile, rounds)
+            results['get_setpoints'] = measure(bench.get_setpoints(), rounds, len(bench.dates))
+            results['setpoints_diff'] = measure(bench.setpoints_diff(), rounds, 100)
+            results['simulated_day'] = measure(bench.simulated_day, rounds)
+        finally:
+            bench.stop()
+    return write_results('scheduler', parameters, results, output)
+
+
+################################################################################
+# pytest-benchmark entry points (only if pytest-benchmark is installed)
+################################################################################
+try:
+    import pytest
+    import pytest_benchmark
+except ImportError:
+    pytest_benchmark = None
+
+if pytest_benchmark:
+    @pytest.fixture(scope='module', params=[(10, 5, 2, 4), (100, 20, 4, 8)], ids=lambda p: 'N%d-M%d-D%d-K%d' % p)
+    def bench(request, tmp_path_factory):
+        bench = SchedulerBench(str(tmp_path_factory.mktemp('config')), *request.param)
+        yield bench
+        bench.stop()
+
+    def test_config_load(benchmark, bench:SchedulerBench):
+        benchmark(bench.load_config)
+
+    def test_compile(benchmark, bench:SchedulerBench):
+        benchmark(bench.compile)
+
+    def test_get_setpoints(benchmark, bench:SchedulerBench):
+        benchmark(bench.get_setpoints())
+
+    def test_setpoints_diff(benchmark, bench:SchedulerBench):
+        benchmark(bench.setpoints_diff())
+
+    def test_simulated_day(benchmark, bench:SchedulerBench):
+        benchmark(bench.simulated_day)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Scheduler micro-benchmarks on a synthetic configuration')
+    parser.add_argument('--devices', type=int, default=50, help='number of devices (N)')
+    parser.add_argument('--schedules', type=int, default=20, help='number of schedules (M)')
+    parser.add_argument('--depth', type=int, default=4, help='schedules inheritance depth (D)')
+    parser.add_argument('--timeslots', type=int, default=6, help='number of timeslots per day (K)')
+    parser.add_argument('--rounds', type=int, default=5, help='number of measures of each benchmark')
+    parser.add_argument('--output', default=None, help='json file the results are written to')
+    args = parser.parse_args()
+    logging.disable(logging.CRITICAL)
+    run(args.devices, args.schedules, args.depth, args.timeslots, args.rounds, args.output)
@@ -0,0 +1,45 @@
+__author__      = "Jérôme Cuq"
+
+import datetime
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+
+# Benchmarks import server modules the same way tests do
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'source'))
+
+def measure(func, rounds:int, iterations:int = 1) -> dict[str,float]:
+    """Call func() iterations times per round, and return the stats of one call (in seconds)
+    """
+    durations:list[float] = []
+    for _ in range(rounds):
+        start:float = time.perf_counter()
+        for _ in range(iterations):
+            func()
+        durations.append((time.perf_counter()-start)/iterations)
+    return {'rounds':rounds,
+            'iterations':iterations,
+            'min':min(durations),
+            'max':max(durations),
+            'mean':statistics.mean(durations),
+            'median':statistics.median(durations)}
+
+def write_results(suite:str, parameters:dict, results:dict[str,dict], output:str = None) -> dict:
+    """Print the results of a benchmark suite and write them in a json file (if output is set),
+       so that they can be compared between releases
+    """
+    data:dict = {'suite':suite,
+                 'date':datetime.datetime.now().isoformat(timespec='seconds'),
+                 'python':platform.python_version(),
+                 'machine':platform.machine(),
+                 'parameters':parameters,
+                 'results':results}
+    for name, stats in results.items():
+        print(f"{name:<30} median {stats['median']*1000.:10.4f} ms   min {stats['min']*1000.:10.4f} ms   ({stats['rounds']}x{stats['iterations']})")
+    if output:
+        with open(output, 'w', encoding='utf-8') as output_file:
+            json.dump(data, output_file, indent=2)
+    return data
@@ -0,0 +1,101 @@
+__author__      = "Jérôme Cuq"
+
+import logging
+import math
+import uuid
+
+from common import toFloat
+from errors import CfgError, ECfgError
+
+
+class AckMatcher:
+    """Decides whether a value reported by a device acknowledges the value of a pending command.
+       Default matcher : any reported value acknowledges the command (the device has handled it).
+       A response carrying the correlation data of the command always acknowledges it (see CommandRepeater.acknowledge()).
+    """
+    # name of the matcher in configuration (ack_matcher.type)
+    type:str = 'any'
+
+    def matches(self, sent_value, value) -> bool:
+        return True
+
+    # return the correlation data to send with a new command, or None if the device does not send responses
+    def new_correlation(self) -> bytes:
+        return None
+
+    # Create a matcher from its configuration node {'type':str, 'tolerance':float, 'step':float}
+    # raises CfgError in case of bad value
+    def create(params:dict, node_path:str, logger:logging.Logger) -> 'AckMatcher':
+        if not isinstance(params, dict):
+            raise CfgError(ECfgError.BAD_VALUE, node_path, None, {'value':str(params)}, logger)
+        type_:str = params.get('type', AckMatcher.type)
+        if type_ == ExactAckMatcher.type:
+            return ExactAckMatcher()
+        if type_ == ToleranceAckMatcher.type:
+            return ToleranceAckMatcher(AckMatcher.__get_positive(params, 'tolerance', 0.1, node_path, logger))
+        if type_ == StepAckMatcher.type:
+            return StepAckMatcher(AckMatcher.__get_positive(params, 'step', 0.5, node_path, logger))
+        if type_ == CorrelationAckMatcher.type:
+            return CorrelationAckMatcher()
+        if type_ != AckMatcher.type:
+            raise CfgError(ECfgError.BAD_VALUE, node_path, 'type', {'value':str(type_)}, logger)
+        return AckMatcher()
+
+    def __get_positive(params:dict, key:str, default:float, node_path:str, logger:logging.Logger) -> float:
+        value:float = toFloat(params.get(key, default), logger, 'Invalid value in '+node_path+'.'+key+' : ')
+        if value is None or value <= 0.:
+            raise CfgError(ECfgError.BAD_VALUE, node_path, key, {'value':str(params.get(key, None))}, logger)
+        return value
+
+
+class ExactAckMatcher(AckMatcher):
+    """The reported value must be the value that has been sent"""
+    type:str = 'exact'
+
+    def matches(self, sent_value, value) -> bool:
+        return value == sent_value
+
+
+class ToleranceAckMatcher(AckMatcher):
+    """The reported value must be within +/- tolerance of the value that has been sent (devices that round the values)"""
+    type:str = 'tolerance'
+
+    def __init__(self, tolerance:float):
+        self.tolerance:float = tolerance
+
+    def matches(self, sent_value, value) -> bool:
+        if value is None or sent_value is None:
+            return False
+        # small margin for float representation (20.5 - 20.4 > 0.1)
+        return abs(value - sent_value) <= self.tolerance + 1e-9
+
+
+class StepAckMatcher(AckMatcher):
+    """The reported value must be the value that has been sent, rounded to the step of the device (0.5 for most TRVs)"""
+    type:str = 'step'
+
+    def __init__(self, step:float):
+        self.step:float = step
+
+    def matches(self, sent_value, value) -> bool:
+        if value is None or sent_value is None:
+            return False
+        return self.__round(value) == self.__round(sent_value)
+
+    # round half up, as devices do (python round() rounds half to even : 20.25 would give 20.0 with a 0.5 step)
+    # small margin for float representation
+    def __round(self, value:float) -> int:
+        return math.floor(value / self.step + 0.5 + 1e-9)
+
+
+class CorrelationAckMatcher(AckMatcher):
+    """Only a MQTT v5 response carrying the correlation data of the command acknowledges it
+       (reported values are ignored)
+    """
+    type:str = 'correlation'
+
+    def matches(self, sent_value, value) -> bool:
+        return False
+
+    def new_correlation(self) -> bytes:
+        return uuid.uuid4().bytes
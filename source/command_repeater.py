@@ -1,103 +1,246 @@
 __author__      = "Jérôme Cuq"
 
 from datetime import datetime, timedelta
+import heapq
+import itertools
 import logging
+import random
+import threading
+import time
 
-from thread_base import ThreadBase
+from ack_matcher import AckMatcher
+from timer_service import Timer, TimerService
 
 
 class PendingCommand:
-    def __init__(self, device:str, command:str, callable, args:list):
+    __slots__ = ('device', 'command', 'callable', 'args', 'repeatTime', 'attempts', 'deadline',
+                 'value', 'ack_matcher', 'correlation', 'date')
+
+    def __init__(self, device:str, command:str, callable, args:list, value = None, ack_matcher:AckMatcher = None, correlation:bytes = None):
         #self.cmdId:str = cmdId
         self.device = device
         self.command = command
         self.callable = callable
         self.args:list = args
+        # date of last send
         self.repeatTime:datetime = datetime.now()
+        # number of repeats so far
+        self.attempts:int = 0
+        # time.monotonic() date of next repeat
+        self.deadline:float = None
+        # value sent to the device, and how the values (or responses) reported by the device acknowledge it
+        self.value = value
+        self.ack_matcher:AckMatcher = ack_matcher
+        self.correlation:bytes = correlation
+        # time.monotonic() date of first send
+        self.date:float = time.monotonic()
 
 class CommandRepeater:
-    def __init__(self, repeatDelay_sec:int):
+    """Commands that have not been acknowledged yet are repeated, until they are removed (acknowledged) :
+       - the delay before the first repeat is repeatDelay_sec, then it grows by backoff_factor at each repeat
+         (up to max_delay_sec), with a random jitter (+/- jitter ratio) so that the repeats of many commands are spread,
+       - after max_attempts repeats, the command is abandoned and on_gave_up(command) is called.
+       A command is acknowledged when its device reports a value accepted by the AckMatcher of the command,
+       or a response with the correlation data of the command (see acknowledge()).
+       Next repeat deadlines are kept in a heap : a single timer is armed on the earliest one.
+    """
+    # timer_service : shared timer service the repeat timer is registered in (a private one is started if None)
+    def __init__(self, repeatDelay_sec:int, timer_service:TimerService = None, max_attempts:int = 10, backoff_factor:float = 2.,
+                 max_delay_sec:int = 3600, jitter:float = 0.1, on_gave_up = None):
         self.logger: logging.Logger = logging.getLogger('hcs.repeater')
         self.logger.info('Starting command repeater : repeatDelay = '+str(repeatDelay_sec)+' sec')
-        self.commands:dict[str,PendingCommand] = {}
+        self.lock: threading.Lock = threading.Lock()
+        # pending commands by device name, then by command
+        self.commands:dict[str,dict[str,PendingCommand]] = {}
+        self.count:int = 0
         self.repeatDelay:timedelta = timedelta(seconds=repeatDelay_sec)
-        self.repeat_thread: ThreadBase = ThreadBase()
-        self.repeat_thread.start(self.__repeat_thread)
+        self.max_attempts:int = max_attempts
+        self.backoff_factor:float = backoff_factor
+        self.max_delay_sec:float = max(max_delay_sec, repeatDelay_sec)
+        self.jitter:float = jitter
+        self.on_gave_up = on_gave_up
+        # items are (deadline, sequence, command) : an item is outdated if the command has been removed, replaced or rescheduled
+        self.deadlines:list[tuple[float,int,PendingCommand]] = []
+        self.sequence = itertools.count()
+        # metrics
+        self.retried:int = 0
+        self.abandoned:int = 0
+        # acknowledge latencies by device name : [count, total (sec), max (sec)]
+        self.ack_latencies:dict[str,list] = {}
+        self.own_timer_service:bool = timer_service is None
+        self.timer_service:TimerService = TimerService() if self.own_timer_service else timer_service
+        if self.own_timer_service:
+            self.timer_service.start()
+        self.repeat_timer:Timer = None
+        self.repeat_timer_deadline:float = None
 
     def stop(self):
         self.logger.info('Stopping command repeater')
-        self.repeat_thread.stop()
+        with self.lock:
+            self.timer_service.cancel(self.repeat_timer)
+            self.repeat_timer = None
+        if self.own_timer_service:
+            self.timer_service.stop()
         self.logger.info('Command repeater has stopped')
     
     # Add or replace repeat command
-    def addCommand(self, device:str, command:str, callable, *args):
-        with self.repeat_thread.lock:
-            cmdId:str = CommandRepeater.__get_cmd_id(device,command)
-            self.logger.debug("Adding command to repeater : "+cmdId)
-            self.commands[cmdId] = PendingCommand(device, command, callable, args)
+    # value, ack_matcher, correlation : see acknowledge() (any report of the device acknowledges the command by default)
+    def addCommand(self, device:str, command:str, callable, *args, value = None, ack_matcher:AckMatcher = None, correlation:bytes = None):
+        with self.lock:
+            self.logger.debug("Adding command to repeater : "+command+'-'+device)
+            cmd = PendingCommand(device, command, callable, args, value, ack_matcher or AckMatcher(), correlation)
+            device_commands:dict[str,PendingCommand] = self.commands.setdefault(device, {})
+            if not command in device_commands:
+                self.count += 1
+            device_commands[command] = cmd
+            now:float = time.monotonic()
+            self.__schedule(cmd, now)
+            self.__arm_timer(now)
 
     def getCommand(self, device:str, command:str) -> PendingCommand:
-        with self.repeat_thread.lock:
-            cmdId:str = CommandRepeater.__get_cmd_id(device,command)
-            if cmdId in self.commands:
-                return self.commands[cmdId]
-        return None
+        with self.lock:
+            return self.commands.get(device, {}).get(command, None)
 
     def removeCommand(self, device:str, command:str):
-        with self.repeat_thread.lock:
-            cmdId:str = CommandRepeater.__get_cmd_id(device,command)
-            if cmdId in self.commands:
-                self.logger.debug("Removing command for repeater : "+cmdId)
-                self.commands.pop(cmdId)
+        with self.lock:
+            self.__remove(device, command)
+
+    def acknowledge(self, device:str, command:str, value = None, correlation:bytes = None) -> bool:
+        """Remove the pending command if the value reported by the device (or the correlation data of its response) acknowledges it
+
+        :param value: value reported by the device, None for a response
+        :param correlation: correlation data of a response of the device, None for a reported value
+        :return: True if a pending command has been acknowledged
+        """
+        with self.lock:
+            cmd:PendingCommand = self.commands.get(device, {}).get(command, None)
+            if cmd is None:
+                return False
+            if correlation is not None:
+                acknowledged:bool = correlation == cmd.correlation
+            else:
+                acknowledged:bool = cmd.ack_matcher.matches(cmd.value, value)
+            if not acknowledged:
+                self.logger.debug("Command "+command+'-'+device+" is not acknowledged by reported value '"+str(value)+"' (sent '"+str(cmd.value)+"')")
+                return False
+            self.__remove(device, command)
+            latency:float = time.monotonic() - cmd.date
+            stats:list = self.ack_latencies.setdefault(device, [0, 0., 0.])
+            stats[0] += 1
+            stats[1] += latency
+            stats[2] = max(stats[2], latency)
+            return True
 
     def remove_device_commands(self, devname:str):
-        to_delete:list = []
-        with self.repeat_thread.lock:
-            for cmdId in self.commands:
-                if self.commands[cmdId].device == devname:
-                    to_delete.append(cmdId)
-            for cmdId in to_delete:
-                self.logger.debug("Removing command for repeater : "+cmdId)
-                self.commands.pop(cmdId)
+        with self.lock:
+            self.ack_latencies.pop(devname, None)
+            device_commands:dict[str,PendingCommand] = self.commands.pop(devname, None)
+            if device_commands:
+                self.logger.debug("Removing commands for repeater : device '"+devname+"'")
+                self.count -= len(device_commands)
 
     def set_device_name(self, old_name:str, new_name:str):
-        to_rename:list = []
-        with self.repeat_thread.lock:
-            for cmdId in self.commands:
-                if self.commands[cmdId].device == old_name:
-                    to_rename.append(cmdId)
-            for cmdId in to_rename:
-                self.logger.debug("Renaming command for repeater : "+cmdId)
-                cmd = self.commands.pop(cmdId)
-                cmd.device = new_name
-                new_cmdId:str = CommandRepeater.__get_cmd_id(cmd.device,cmd.command)
-                self.commands[new_cmdId] = cmd
+        with self.lock:
+            device_commands:dict[str,PendingCommand] = self.commands.pop(old_name, None)
+            if device_commands:
+                self.logger.debug("Renaming commands for repeater : device '"+old_name+"' -> '"+new_name+"'")
+                # commands pending for new_name (if any) are replaced
+                self.count -= len(self.commands.pop(new_name, {}))
+                for cmd in device_commands.values():
+                    cmd.device = new_name
+                self.commands[new_name] = device_commands
+            if old_name in self.ack_latencies:
+                self.ack_latencies[new_name] = self.ack_latencies.pop(old_name)
+
+    def get_stats(self) -> dict[str,int]:
+        """return the number of outstanding commands, and the number of repeated and abandoned commands so far
+        """
+        with self.lock:
+            return {'outstanding':self.count, 'retried':self.retried, 'abandoned':self.abandoned}
+
+    def get_ack_stats(self) -> dict[str,dict[str,float]]:
+        """return, for each device, the number of acknowledged commands and the mean and max delay (sec)
+           between the first send of a command and its acknowledge
+        """
+        with self.lock:
+            return {device:{'count':count, 'mean':total/count, 'max':max_}
+                    for device, (count, total, max_) in self.ack_latencies.items()}
 
+    # Repeat the commands whose deadline has passed (called by the repeat timer)
     def repeatCommands(self):
-        #self.logger.debug("repeatCommands()")        
         repeatList:list[PendingCommand] = []
-        with self.repeat_thread.lock:
-            now:datetime = datetime.now()
-            for cmdId in self.commands:
-                cmd:PendingCommand = self.commands[cmdId]
-                actualDuration:timedelta = now-cmd.repeatTime
-                if actualDuration>=self.repeatDelay:
+        abandonList:list[PendingCommand] = []
+        with self.lock:
+            self.repeat_timer = None
+            now:float = time.monotonic()
+            while self.deadlines and self.deadlines[0][0] <= now:
+                deadline, _, cmd = heapq.heappop(self.deadlines)
+                if not self.__is_scheduled(cmd, deadline):
+                    continue
+                if cmd.attempts >= self.max_attempts:
+                    self.__remove(cmd.device, cmd.command)
+                    self.abandoned += 1
+                    abandonList.append(cmd)
+                else:
+                    cmd.attempts += 1
+                    self.retried += 1
                     repeatList.append(cmd)
+                    self.__schedule(cmd, now)
+            self.__arm_timer(now)
 
         for cmd in repeatList:
-            self.logger.warning("Repeat command after "+str(actualDuration.seconds)+" sec -> device:'"+cmd.device+"', command:'"+cmd.command+"', args:'"+str(cmd.args)+"'")
+            actualDuration:timedelta = datetime.now()-cmd.repeatTime
+            self.logger.warning("Repeat command after "+str(actualDuration.seconds)+" sec (attempt "+str(cmd.attempts)+") -> device:'"+cmd.device+"', command:'"+cmd.command+"', args:'"+str(cmd.args)+"'")
             try:
                 cmd.callable(*cmd.args)
             except Exception as e:
                 self.logger.error("Exception during repeat call : "+str(e))
             cmd.repeatTime = datetime.now()
 
-    # Thread that trigger the repeatition of commands after delay
-    def __repeat_thread(self):
-        self.logger.info('Command repeater thread started')
-        while self.repeat_thread.wait(10):
-            self.repeatCommands()
-        self.logger.info('Command repeater thread has stopped')
+        for cmd in abandonList:
+            self.logger.warning("Command abandoned after "+str(cmd.attempts)+" repeats -> device:'"+cmd.device+"', command:'"+cmd.command+"', args:'"+str(cmd.args)+"'")
+            if self.on_gave_up:
+                try:
+                    self.on_gave_up(cmd)
+                except Exception as e:
+                    self.logger.error("Exception during gave up call : "+str(e))
+
+    ################################################################################
+    # PRIVATE METHODS
+    ################################################################################
+
+    # return True if the command is still pending, and must be repeated at given deadline
+    def __is_scheduled(self, cmd:PendingCommand, deadline:float) -> bool:
+        return cmd.deadline == deadline and self.commands.get(cmd.device, {}).get(cmd.command, None) is cmd
+
+    def __remove(self, device:str, command:str):
+        device_commands:dict[str,PendingCommand] = self.commands.get(device, None)
+        if device_commands and command in device_commands:
+            self.logger.debug("Removing command for repeater : "+command+'-'+device)
+            del device_commands[command]
+            self.count -= 1
+            if not device_commands:
+                del self.commands[device]
+
+    # Compute the next repeat deadline of a command, from its number of attempts
+    # note : the repeat timer is not armed, see __arm_timer()
+    def __schedule(self, cmd:PendingCommand, now:float):
+        delay:float = min(self.repeatDelay.total_seconds() * self.backoff_factor**cmd.attempts, self.max_delay_sec)
+        delay *= 1. + random.uniform(-self.jitter, self.jitter)
+        cmd.deadline = now + delay
+        # outdated items are dropped when there are too many of them
+        if len(self.deadlines) > 2*self.count + 64:
+            self.deadlines = [item for item in self.deadlines if self.__is_scheduled(item[2], item[0])]
+            heapq.heapify(self.deadlines)
+        heapq.heappush(self.deadlines, (cmd.deadline, next(self.sequence), cmd))
 
-    def __get_cmd_id(device:str, command:str) -> str:
-        return command + '-' + device
\ No newline at end of file
+    # Arm the repeat timer on the earliest deadline
+    def __arm_timer(self, now:float):
+        if not self.deadlines:
+            return
+        deadline:float = self.deadlines[0][0]
+        if self.repeat_timer and self.repeat_timer_deadline <= deadline:
+            return
+        self.timer_service.cancel(self.repeat_timer)
+        self.repeat_timer_deadline = deadline
+        self.repeat_timer = self.timer_service.call_later(max(0., deadline-now), self.repeatCommands)
@@ -0,0 +1,77 @@
+__author__      = "Jérôme Cuq"
+
+from dataclasses import dataclass
+
+class FrozenDict(dict):
+    """Read-only dict, used in configuration snapshots (see freeze()).
+       Being immutable, a FrozenDict is never copied : copy.copy() and copy.deepcopy() return the same object.
+    """
+    def __readonly(self, *args, **kwargs):
+        raise TypeError("FrozenDict object is read-only")
+
+    __setitem__ = __readonly
+    __delitem__ = __readonly
+    __ior__ = __readonly
+    clear = __readonly
+    pop = __readonly
+    popitem = __readonly
+    setdefault = __readonly
+    update = __readonly
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+
+@dataclass(frozen=True)
+class ConfigSnapshot:
+    """Immutable version of the configuration, shared without any copy between the
+       configuration and its consumers (scheduler, ...).
+       A new snapshot replaces the previous one in a single reference change.
+    """
+    # incremented on each configuration change
+    version: int
+    # frozen scheduler configuration (see freeze())
+    scheduler: FrozenDict
+
+
+def freeze(value, previous=None):
+    """Return an immutable version of value : dicts are converted into FrozenDict, lists into tuples.
+       'previous' is the frozen version of an older value : any unchanged sub-tree of value is not
+       copied, the corresponding sub-tree of 'previous' is returned instead (structural sharing).
+       In lists, dicts that have an 'alias' key are matched by alias, other items by position.
+    """
+    if value is previous or isinstance(value, FrozenDict):
+        return value
+    if isinstance(value, dict):
+        if not isinstance(previous, FrozenDict):
+            previous = None
+        items:dict = {}
+        unchanged:bool = previous is not None and len(previous) == len(value)
+        for key, item in value.items():
+            if previous is not None and key in previous:
+                items[key] = freeze(item, previous[key])
+                unchanged = unchanged and items[key] is previous[key]
+            else:
+                items[key] = freeze(item)
+                unchanged = False
+        return previous if unchanged else FrozenDict(items)
+    if isinstance(value, (list, tuple)):
+        if not isinstance(previous, tuple):
+            previous = ()
+        previous_aliases:dict = {item['alias']:item for item in previous if isinstance(item, FrozenDict) and 'alias' in item}
+        items:list = []
+        for idx, item in enumerate(value):
+            if isinstance(item, dict) and 'alias' in item:
+                previous_item = previous_aliases.get(item['alias'], None)
+            else:
+                previous_item = previous[idx] if idx < len(previous) else None
+            items.append(freeze(item, previous_item))
+        if len(items) == len(previous) and all(item is previous_item for item, previous_item in zip(items, previous)):
+            return previous
+        return tuple(items)
+    if previous is not None and type(previous) is type(value) and previous == value:
+        return previous
+    return value
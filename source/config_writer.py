@@ -0,0 +1,112 @@
+__author__      = "Jérôme Cuq"
+
+import asyncio
+import logging
+import threading
+import time
+
+from thread_base import ThreadBase
+from timer_service import Timer, TimerService
+
+
+class ConfigWriter:
+    """Writes the configuration file in background, once changes have settled :
+       the file is written quiet_period_sec after the last change, or max_delay_sec after the first unsaved change
+       (whichever comes first), so that a burst of changes ends in a single write.
+       The write timer only wakes up the writer thread (or, in asyncio mode, submits the write to the loop executor) :
+       timer callbacks must not block.
+       Unsaved changes are written by flush(), and by stop().
+    """
+    # write : function that writes the configuration file (called in the writer thread, or in the thread calling flush())
+    # loop : optional asyncio event loop (asyncio mode), the writes are run in its default executor
+    def __init__(self, write, timer_service:TimerService, quiet_period_sec:float = 2., max_delay_sec:float = 10.,
+                 loop:asyncio.AbstractEventLoop = None):
+        self.logger: logging.Logger = logging.getLogger('hcs.configwriter')
+        self.write = write
+        self.timer_service:TimerService = timer_service
+        self.loop:asyncio.AbstractEventLoop = loop
+        self.writer_thread:ThreadBase = ThreadBase()
+        self.quiet_period_sec:float = quiet_period_sec
+        self.max_delay_sec:float = max(max_delay_sec, quiet_period_sec)
+        self.lock: threading.Lock = threading.Lock()
+        # serializes the writes of the writer thread (or executor) and of flush()
+        self.write_lock: threading.Lock = threading.Lock()
+        # time.monotonic() date of the first unsaved change (None if there is none)
+        self.first_change_date:float = None
+        self.write_timer:Timer = None
+        self.changes:int = 0
+        self.writes:int = 0
+
+    def start(self):
+        if not self.loop:
+            self.writer_thread.start(self.__writer_thread)
+
+    def stop(self):
+        with self.lock:
+            self.timer_service.cancel(self.write_timer)
+            self.write_timer = None
+        self.writer_thread.stop()
+        self.flush()
+
+    # Called after each configuration change
+    def mark_dirty(self):
+        with self.lock:
+            now:float = time.monotonic()
+            if self.first_change_date is None:
+                self.first_change_date = now
+            self.changes += 1
+            self.__schedule(now)
+
+    def flush(self) -> bool:
+        """Write the configuration file now if there are unsaved changes
+
+        :return: True if the file has been written
+        """
+        with self.write_lock:
+            with self.lock:
+                if self.first_change_date is None:
+                    return False
+                self.first_change_date = None
+                self.timer_service.cancel(self.write_timer)
+                self.write_timer = None
+            try:
+                self.write()
+            except Exception as exc:
+                self.logger.error('Failed to write configuration file : '+str(exc))
+                # changes are still unsaved : next attempt after a quiet period
+                with self.lock:
+                    now:float = time.monotonic()
+                    if self.first_change_date is None:
+                        self.first_change_date = now
+                    self.__schedule(now)
+                return False
+            with self.lock:
+                self.writes += 1
+            return True
+
+    def get_stats(self) -> dict[str,int]:
+        """return the number of configuration changes and of file writes so far
+        """
+        with self.lock:
+            return {'changes':self.changes, 'writes':self.writes}
+
+    ################################################################################
+    # PRIVATE METHODS
+    ################################################################################
+
+    # (Re)arm the write timer, quiet_period_sec from now without exceeding max_delay_sec after the first unsaved change
+    def __schedule(self, now:float):
+        deadline:float = min(now + self.quiet_period_sec, self.first_change_date + self.max_delay_sec)
+        self.timer_service.cancel(self.write_timer)
+        self.write_timer = self.timer_service.call_later(max(0., deadline - now), self.__on_write_timer)
+
+    def __on_write_timer(self):
+        if self.loop:
+            self.loop.run_in_executor(None, self.flush)
+        else:
+            self.writer_thread.notify()
+
+    def __writer_thread(self):
+        # flush() does nothing if there is no unsaved change
+        while self.writer_thread.wait(3600.):
+            self.flush()
@@ -1,18 +1,43 @@
 __author__      = "Jérôme Cuq"
 
+import copy
 import datetime
+import functools
 import logging
+import threading
 import yaml
 import sys, os
-import copy
 
+from ack_matcher import AckMatcher, CorrelationAckMatcher
 from common import *
+from config_snapshot import ConfigSnapshot, freeze
+from config_writer import ConfigWriter
+from timer_service import TimerService
 from yaml.parser import ParserError
 from yaml.scanner import ScannerError
 from yaml_tags import YamlTagsResolver
 from errors import *
 
 WEEKDAYS:list=['1','2','3','4','5','6','7']
+# optional settings of message_repeater
+REPEATER_BACKOFF_DEFAULTS:dict = {'max_attempts':10, 'backoff_factor':2., 'max_delay_sec':3600, 'jitter':0.1}
+# optional settings of config_persistence
+PERSISTENCE_DEFAULTS:dict = {'quiet_period_sec':2., 'max_delay_sec':10.}
+
+# Configuration changes are serialized with the writes of the configuration file (that may happen in a background thread)
+def synchronized(method):
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+# yaml dumper that writes schedules start times (datetime.time) as strings
+class ConfigDumper(yaml.Dumper):
+    def represent_time(dumper:yaml.Dumper, time:datetime.time) -> yaml.Node:
+        return dumper.represent_str(time.isoformat())
+
+ConfigDumper.add_representer(datetime.time, ConfigDumper.represent_time)
 
 class Configuration:
     def __init__(self, config_path:str, config_files_prefix:str, auto_save:bool=True):
@@ -22,11 +47,23 @@ class Configuration:
         self.secrets_filename = os.path.join(config_path, config_files_prefix+'secrets.yaml')
         self.format_version = 7
         self.auto_save:bool=auto_save
+        # the configuration file is written by the writer if it is started (see start_writer()), synchronously otherwise
+        self.writer:ConfigWriter = None
+        self.lock:threading.RLock = threading.RLock()
+        # incremented on each configuration change (see get_snapshot())
+        self.version:int = 0
+        self.snapshot:ConfigSnapshot = ConfigSnapshot(-1, None)
+        # indexes of configdata nodes, kept in sync by load() and by all Set/Change/Delete methods :
+        # devices by name, schedules by alias, temperature sets by schedule alias ('' for global ones) then by alias
+        self.devices_index:dict[str,dict] = {}
+        self.schedules_index:dict[str,dict] = {}
+        self.tempsets_index:dict[str,dict[str,dict]] = {}
         self.load()
     
     ########################################################################################
     # save/load methods
     ########################################################################################
+    @synchronized
     def load(self):
         """
         :raises CfgError: in case of any error in configuration file
@@ -51,6 +88,7 @@ class Configuration:
         if not os.path.exists(filename):
             raise CfgError(ECfgError.MISSING_FILE, '', None, {'filename':filename}, self.logger)
 
+        self.version += 1
         self.logger.info("Opening configuration file '"+filename+"'")
         with open(filename, 'r', encoding='utf-8') as config_file:
             try:
@@ -63,6 +101,8 @@ class Configuration:
         if self.__set_settings_default_values():
             save = True
         self.settings = self.configdata['settings']
+        self.__index_devices()
+        self.__index_schedules()
         
         err:CfgError = self.__verify_config()
         if err: raise err
@@ -70,20 +110,53 @@ class Configuration:
         if save:
             self.__save()
 
+    # Called after each successful configuration change
     def __save(self):
+        self.version += 1
         if self.auto_save:
-            self.save()
+            if self.writer:
+                self.writer.mark_dirty()
+            else:
+                self.save()
 
+    # The file is replaced atomically : a crash during the write leaves the previous file unchanged
     def save(self):
         self.logger.info("Saving configuration file '"+self.config_filename+"'")
-        self.configdata['version'] = self.format_version
-        # Before saving, we must convert back all dates in scheduler config
-        configdata = copy.deepcopy(self.configdata)
-        schedules = configdata['scheduler']['schedules']
-        for schedule in schedules:
-            Configuration.__convert_schedule_dates_to_string(schedule)
-        with open(self.config_filename, 'w', encoding="utf-8") as config_file:
-            yaml.dump(configdata, config_file, allow_unicode=True)
+        with self.lock:
+            self.configdata['version'] = self.format_version
+            # Dates in scheduler config are converted back to strings by the dumper, no copy is needed
+            content:str = yaml.dump(self.configdata, Dumper=ConfigDumper, allow_unicode=True)
+        temp_filename:str = self.config_filename+'.tmp'
+        with open(temp_filename, 'w', encoding="utf-8") as config_file:
+            config_file.write(content)
+            config_file.flush()
+            os.fsync(config_file.fileno())
+        os.replace(temp_filename, self.config_filename)
+
+    # Write the configuration file in background, after changes have settled (see ConfigWriter)
+    # loop : optional asyncio event loop (asyncio mode)
+    def start_writer(self, timer_service:TimerService, loop = None):
+        if not self.writer:
+            settings:dict = self.get_config_persistence()
+            self.writer = ConfigWriter(self.save, timer_service, settings['quiet_period_sec'], settings['max_delay_sec'], loop)
+            self.writer.start()
+
+    # Write unsaved changes (if any), and stop the writer : next changes are saved synchronously
+    def stop_writer(self):
+        if self.writer:
+            self.writer.stop()
+            self.logger.debug('Configuration writer stats : '+str(self.writer.get_stats()))
+            self.writer = None
+
+    # return an immutable snapshot of the configuration, to be shared without any copy.
+    # A new snapshot is only built after a configuration change, and it shares all
+    # unchanged parts (schedules, temperature sets, ...) with the previous snapshot.
+    def get_snapshot(self) -> ConfigSnapshot:
+        snapshot:ConfigSnapshot = self.snapshot
+        if snapshot.version != self.version:
+            snapshot = ConfigSnapshot(self.version, freeze(self.configdata['scheduler'], snapshot.scheduler))
+            self.snapshot = snapshot
+        return snapshot
 
             
     ########################################################################################
@@ -94,9 +167,33 @@ class Configuration:
             return self.settings['auto_discovery']
         return []
 
+    # return the settings of protocols ingress queue {'max_size':int},
+    # or None if messages must be handled directly in network threads
+    def get_ingress_queue(self) -> dict:
+        return self.settings.get('ingress_queue', None)
+
+    # return True if device topics are subscribed with wildcards (see 'device_subscriptions' setting)
+    def get_wildcard_device_subscriptions(self) -> bool:
+        return self.settings.get('device_subscriptions', 'topics') == 'wildcard'
+
+    # return the delays of configuration file writes {'quiet_period_sec':float, 'max_delay_sec':float}
+    def get_config_persistence(self) -> dict:
+        persistence:dict = self.settings.get('config_persistence', None) or {}
+        return {name:persistence.get(name, default) for name, default in PERSISTENCE_DEFAULTS.items()}
+
     def get_repeater_delay(self) -> int:
         return self.settings['message_repeater']['repeat_delay_sec']
 
+    # return the retry policy of the command repeater {'max_attempts':int, 'backoff_factor':float, 'max_delay_sec':int, 'jitter':float}
+    def get_repeater_backoff(self) -> dict:
+        repeater = self.settings['message_repeater']
+        return {name:repeater.get(name, default) for name, default in REPEATER_BACKOFF_DEFAULTS.items()}
+
+    # return the default acknowledge matcher configuration of commands {'type':str, 'tolerance':float, 'step':float}
+    # (see AckMatcher.create(), a device may override it with 'ack_matcher' in its protocol params)
+    def get_ack_matcher(self) -> dict:
+        return self.settings['message_repeater'].get('ack_matcher', {'type':'any'})
+
     def get_scheduler_init_delai(self) -> int:
         return self.settings['scheduler']['init_delay_sec']
     
@@ -116,10 +213,7 @@ class Configuration:
             return {}
 
     def get_device(self, device:str):
-        config_devices:dict = self.get_devices()
-        if device in config_devices:
-            return config_devices[device]
-        return None
+        return self.devices_index.get(device, None)
     
     def get_scheduler(self):
         if 'scheduler' in self.configdata:
@@ -131,10 +225,7 @@ class Configuration:
 
     ### return None if given name is not a known schedule
     def get_schedule(self, schedule_name):
-        for schedule in self.get_schedules():
-            if schedule['alias'] == schedule_name:
-                return schedule
-        return None
+        return self.schedules_index.get(schedule_name, None)
 
     def get_remote_control(self):
         if 'remote_control' in self.configdata:
@@ -153,38 +244,41 @@ class Configuration:
         return None
 
     def get_temperature_set(self, tempset_name:str, schedule_name:str='') -> dict:
-        tempSets:list = self.get_temperature_sets(schedule_name)
-        if tempSets:
-            for tempset in tempSets:
-                if tempset['alias'] == tempset_name:
-                    return tempset
-        return None
+        return self.tempsets_index.get(schedule_name, {}).get(tempset_name, None)
 
 
     ########################################################################################
     # Set/Change/Delete methods
     ########################################################################################
+    @synchronized
     def add_device(self, device_name:str, entity:str, client_name:str, protocol_params:dict) -> CfgError:
         if device_name == None or device_name == '':
             return CfgError(ECfgError.BAD_VALUE, '/devices', None, {'value':''}, self.logger)
-        devices:dict = self.get_devices()
-        if device_name in devices:
+        if device_name in self.devices_index:
             return CfgError(ECfgError.DUPLICATE_UNIQUE_KEY, '/devices', None, {'key':device_name}, self.logger)
         if device_name=='':
             return CfgError(ECfgError.BAD_VALUE, '/devices', None, {'value':str(device_name)}, self.logger)
-        self.configdata['devices'].append({device_name: {'entity':entity,'protocol':{'name':client_name, 'params':protocol_params}}})
+        device:dict = {'entity':entity,'protocol':{'name':client_name, 'params':protocol_params}}
+        cfgErr = self.__verify_device_ack_matcher(device_name, device)
+        if cfgErr: return cfgErr
+        self.configdata['devices'].append({device_name: device})
+        self.devices_index[device_name] = device
         self.__save()
         return None
     
+    @synchronized
     def change_device_entity(self, device_name:str, entity:str, protocol_params:dict) -> CfgError:
         device:dict = self.get_device(device_name)
         if not device:
             return CfgError(ECfgError.MISSING_VALUE, '/devices', None, {'value':device_name}, self.logger)
+        cfgErr = self.__verify_device_ack_matcher(device_name, {'protocol':{'name':device['protocol']['name'], 'params':protocol_params}})
+        if cfgErr: return cfgErr
         device['entity'] = entity
         device['protocol']['params'] = protocol_params
         self.__save()
         return None
     
+    @synchronized
     def delete_device(self, device_name:str):
         if not self.get_device(device_name):
             return CfgError(ECfgError.BAD_REFERENCE, '/devices', None, {'reference':device_name}, self.logger)
@@ -205,10 +299,13 @@ class Configuration:
         for device in self.configdata['devices']:
             if device_name in device:
                 self.configdata['devices'].remove(device)
+                self.devices_index.pop(device_name)
                 self.__save()
+                break
         return None
         
 
+    @synchronized
     def change_device_name(self, old_name:str, new_name:str) -> CfgError:
         if not self.get_device(new_name):
             device:dict = self.get_device(old_name)
@@ -221,6 +318,7 @@ class Configuration:
                 if old_name in device.keys():
                     device[new_name] = device.pop(old_name)
                     break
+            self.devices_index[new_name] = self.devices_index.pop(old_name)
 
             Configuration.__rename_device_in_tempsets(self.get_temperature_sets(), old_name, new_name)
             for schedule in self.get_schedules():
@@ -236,15 +334,17 @@ class Configuration:
             return CfgError(ECfgError.DUPLICATE_UNIQUE_KEY, '/devices', None, {'key':new_name}, self.logger)
         return None
     
+    @synchronized
     def set_scheduler_manual_mode_reset_event(self, value) -> CfgError:
-        #save = self.get_scheduler_manual_mode_reset_event()
+        save = self.get_scheduler_manual_mode_reset_event()
         self.get_scheduler()['settings']['manual_mode_reset_event'] = value
         CfgError = self.__verify_scheduler_config()
         if not CfgError:
             # there is no error detected
             self.__save()
         else:
-            self.load()
+            # the change is undone in memory : the file may not contain the last accepted changes yet (see ConfigWriter)
+            self.get_scheduler()['settings']['manual_mode_reset_event'] = save
             return CfgError
     
     def __is_device_in_tempsets(tempsets:list, name:str) -> bool:
@@ -263,6 +363,7 @@ class Configuration:
                         dev['device_name'] = new_name
                         break
 
+    @synchronized
     def set_devices_order(self, device_names:list) -> CfgError:
         for name in device_names:
             device:dict = self.get_device(name)
@@ -279,31 +380,37 @@ class Configuration:
         for devname in device_names:
             new_devices.append({devname:devices[devname]})
         self.configdata['devices'] = new_devices
+        self.__index_devices()
         self.__save()
         return None
 
     # the given schedule may be a new or existing schedule
+    @synchronized
     def set_schedule(self, schedule:dict) -> CfgError:
-        cfgErr = self.__check_mandatories(schedule, ['alias', 'schedule_items'], '/scheduler/schedules', Configuration.get(schedule, 'alias', None))
-        if cfgErr: return cfgErr
-        if schedule['alias']=='':
-            return CfgError(ECfgError.BAD_VALUE, '/scheduler/schedules', None, {'value':''}, self.logger)
-        name = schedule['alias']
-        scheduleConfig = self.get_schedule(name)
-        new:bool = not scheduleConfig
-        save = scheduleConfig
-        self.__set_schedule(name, schedule, new)
-        cfgErr = self.__verify_scheduler_config()
+        cfgErr = self.__try_schedule(schedule)
         if not cfgErr:
             # there is no error detected
             self.__save()
-        else:
-            if new:
-                Configuration.__delete_schedule(self.get_schedules(), name)
-            else:
-                self.__set_schedule(name, save, False)
         return cfgErr
 
+    # Same checks as set_schedule(), but the configuration is left unchanged
+    # @return (None, checked copy of schedule with start times converted to datetime.time) or (CfgError, None)
+    @synchronized
+    def check_schedule(self, schedule:dict) -> tuple[CfgError, dict]:
+        # The snapshot must not see the schedule while it is temporarily in the configuration
+        self.get_snapshot()
+        schedule = copy.deepcopy(schedule)
+        save = self.get_schedule(Configuration.get(schedule, 'alias', None))
+        cfgErr = self.__try_schedule(schedule)
+        if cfgErr:
+            return (cfgErr, None)
+        if save:
+            self.__set_schedule(schedule['alias'], save, False)
+        else:
+            self.__delete_schedule(schedule['alias'])
+        return (None, schedule)
+
+    @synchronized
     def set_schedules_order(self, schedule_names:list) -> CfgError:
         new_schedules:list = []
         for name in schedule_names:
@@ -322,6 +429,7 @@ class Configuration:
         self.__save()
         return None
 
+    @synchronized
     def set_active_schedule(self, schedule_name) -> CfgError:
         if schedule_name=='':
             self.get_scheduler()['active_schedule'] = None
@@ -336,6 +444,7 @@ class Configuration:
         return None
 
     # Give a empty schedule_name to target global temperature sets
+    @synchronized
     def set_temperature_sets(self, temperature_sets:list[dict], schedule_name:str = '') -> CfgError:
         if schedule_name == '':
             return self._set_temperature_sets(temperature_sets, self.configdata['scheduler'])
@@ -345,6 +454,7 @@ class Configuration:
                 return self._set_temperature_sets(temperature_sets, schedule)
         return CfgError(ECfgError.BAD_REFERENCE, '/scheduler/schedules', None, {'reference':schedule_name}, self.logger)
 
+    @synchronized
     def change_schedule_name(self, old_name:str, new_name:str) -> CfgError:
         schedule = self.get_schedule(old_name)
         if not schedule:
@@ -355,6 +465,8 @@ class Configuration:
             return CfgError(ECfgError.BAD_VALUE, '/scheduler/schedules', old_name, {'value':new_name}, self.logger)
         
         schedule['alias'] = new_name
+        self.schedules_index[new_name] = self.schedules_index.pop(old_name)
+        self.tempsets_index[new_name] = self.tempsets_index.pop(old_name, {})
         if self.get_scheduler()['active_schedule'] == old_name:
             self.get_scheduler()['active_schedule'] = new_name
         for schedule in self.get_schedules():
@@ -363,6 +475,7 @@ class Configuration:
         self.__save()
         return None
     
+    @synchronized
     def change_schedule_properties(self, name:str, new_name:str, parent:str) -> CfgError:
         cfgErr = None
         if name != new_name:
@@ -385,11 +498,12 @@ class Configuration:
 
         return cfgErr
 
+    @synchronized
     def delete_schedule(self, schedule_name:str) -> CfgError:
         for schedule in self.get_schedules():
             if 'parent_schedule' in schedule and schedule['parent_schedule'] == schedule_name:
                 return CfgError(ECfgError.REFERENCED_NODE, '/scheduler/schedules', schedule_name, {}, self.logger)
-        if Configuration.__delete_schedule(self.get_schedules(), schedule_name)==False:
+        if self.__delete_schedule(schedule_name)==False:
             return CfgError(ECfgError.BAD_REFERENCE, '/scheduler/schedules', None, {'reference':schedule_name}, self.logger)
         scheduler = self.get_scheduler()
         if 'active_schedule' in scheduler and scheduler['active_schedule'] == schedule_name:
@@ -397,6 +511,7 @@ class Configuration:
         self.__save()
         return None
 
+    @synchronized
     def change_temperature_set_name(self, old_name:str, new_name:str, schedule_name:str='') -> CfgError:
         node_path = '/scheduler/temperature_sets'
         if schedule_name != '':
@@ -409,29 +524,34 @@ class Configuration:
         if new_name=='':
             return CfgError(ECfgError.BAD_VALUE, node_path, None, {'value':new_name}, self.logger)
         
-        changed:bool = False
+        # references are changed in many places : each changed node is recorded as (node, key, old value)
+        # so that only these nodes are restored in case of error
+        changes:list[tuple[dict,str,str]] = []
+        tempsets_index:dict[str,dict] = self.tempsets_index[schedule_name]
         # 1) we change the name of the temperature set
         if tempSet['alias'] == old_name:
+            changes.append((tempSet, 'alias', old_name))
             tempSet['alias'] = new_name
-            changed = True
+            tempsets_index[new_name] = tempsets_index.pop(old_name)
         # 2) We change all references to this temperature set
         if schedule_name=='':
             # The temperature is global : we need to change the references in schedules temperature sets
             for schedule_config in self.get_schedules():
-                if Configuration._change_globaltempset_ref_in_schedule(schedule_config, old_name, new_name):
-                    changed = True
+                Configuration._change_globaltempset_ref_in_schedule(schedule_config, old_name, new_name, changes)
         else:
             schedule = self.get_schedule(schedule_name)
-            if Configuration._change_localtempset_ref_in_schedule(schedule, old_name, new_name):
-                changed = True
+            Configuration._change_localtempset_ref_in_schedule(schedule, old_name, new_name, changes)
 
-        if changed==True:
+        if len(changes)>0:
             err = self.__verify_scheduler_config()
             if not err:
                 # there is no error detected
                 self.__save()
             else:
-                self.load()
+                for node, key, value in reversed(changes):
+                    node[key] = value
+                if new_name in tempsets_index:
+                    tempsets_index[old_name] = tempsets_index.pop(new_name)
                 return err
 
         return None
@@ -473,10 +593,51 @@ class Configuration:
         if 'auto_discovery' in settings:
             cfgErr = self.__check_mandatories(settings, ['auto_discovery'], '/settings')
             if cfgErr: return cfgErr
+        if 'ack_matcher' in settings['message_repeater']:
+            try:
+                AckMatcher.create(settings['message_repeater']['ack_matcher'], '/settings/message_repeater/ack_matcher', self.logger)
+            except CfgError as exc:
+                return exc
+        for name, content in self.devices_index.items():
+            cfgErr = self.__verify_device_ack_matcher(name, content)
+            if cfgErr: return cfgErr
+        if 'device_subscriptions' in settings and not settings['device_subscriptions'] in ['topics', 'wildcard']:
+            return CfgError(ECfgError.BAD_VALUE, '/settings', 'device_subscriptions', {'value':settings['device_subscriptions']}, self.logger)
 
         return None
 
     # @return None if the 'remote_control' root configuration node is good to go, or ConfigError if any error
+    # The acknowledge matcher of a device ('ack_matcher' in its protocol params, or the default one) must be valid.
+    # A 'correlation' matcher needs a response from the device : an on_setpoint_response_subtopic and a MQTT v5 client
+    def __verify_device_ack_matcher(self, name:str, device:dict) -> CfgError:
+        protocol:dict = device.get('protocol', None) or {}
+        params:dict = protocol.get('params', None) or {}
+        node_path:str = '/settings/message_repeater/ack_matcher'
+        matcher_params = self.get_ack_matcher()
+        if 'ack_matcher' in params:
+            node_path = '/devices/'+name+'/protocol/params/ack_matcher'
+            matcher_params = params['ack_matcher']
+        try:
+            matcher:AckMatcher = AckMatcher.create(matcher_params, node_path, self.logger)
+        except CfgError as exc:
+            return exc
+        if matcher.type == CorrelationAckMatcher.type:
+            if not params.get('on_setpoint_response_subtopic', None):
+                return CfgError(ECfgError.MISSING_NODES, '/devices/'+name+'/protocol', 'params', {'missing_children':['on_setpoint_response_subtopic']}, self.logger)
+            client:dict = self.__get_protocol_client(protocol.get('name', None))
+            if not client or str(client.get('mqtt_version', '3')) != '5':
+                self.logger.error("Device '"+name+"' : a 'correlation' ack_matcher requires a MQTT v5 client (protocols.mqtt.mqtt_version)")
+                return CfgError(ECfgError.BAD_VALUE, node_path, 'type', {'value':matcher.type}, self.logger)
+        return None
+
+    # return the configuration of a protocol client by name, None if there is no such client
+    def __get_protocol_client(self, client_name:str) -> dict:
+        for clients in (self.get_protocols() or {}).values():
+            for client in clients or []:
+                if isinstance(client, dict) and client.get('name', None) == client_name:
+                    return client
+        return None
+
     def __verify_remote_control_config(self) -> CfgError:
         data = self.configdata['remote_control']
         if not isinstance(data,list):
@@ -521,14 +682,14 @@ class Configuration:
         if cfgErr: return cfgErr
 
         schedules = self.get_schedules()
-        schedule_names = []
+        schedule_names:set = set()
         for schedule in schedules:
             node_path:str = '/scheduler/schedules'
             cfgErr = self.__check_mandatories(schedule, ['alias', 'schedule_items'], node_path, Configuration.get(schedule, 'alias', None))
             if cfgErr: return cfgErr
             if schedule['alias'] in schedule_names:
                 return CfgError(ECfgError.DUPLICATE_UNIQUE_KEY, node_path, schedule['alias'], {'reference':schedule['alias']}, self.logger)
-            schedule_names.append(schedule['alias'])
+            schedule_names.add(schedule['alias'])
             cfgErr = self.__verify_temperature_sets(schedule)
             if cfgErr: return cfgErr
             if len(schedule['schedule_items'])==0:
@@ -540,13 +701,13 @@ class Configuration:
                     return CfgError(ECfgError.BAD_REFERENCE, node_path+"['"+schedule['alias']+"']", 'parent_schedule', {'reference':schedule['parent_schedule']}, self.logger)
             
             idx = 0
-            devices_in_schedule:list = []
+            devices_in_schedule:set = set()
             for schedule_item in schedule['schedule_items']:
                 for device in schedule_item['devices']:
                     if device in devices_in_schedule:
                         # A device can not be present twice in the same schedule
                         return CfgError(ECfgError.DUPLICATE_UNIQUE_KEY, node_path+'/schedule_items/devices', None, {'key':device}, self.logger)
-                    devices_in_schedule.append(device)
+                    devices_in_schedule.add(device)
                 cfgErr = self.__verify_schedule_item(schedule_item, schedule, idx)
                 if cfgErr: return cfgErr
                 idx = idx+1
@@ -633,7 +794,7 @@ class Configuration:
         if schedule==None:
             parent = self.get_scheduler()
         if 'temperature_sets' in parent:
-            tempsets:list = []
+            tempsets:set = set()
             node_path = '/scheduler/temperature_sets'
             if 'alias' in parent:
                 node_path = "/scheduler/schedules['"+parent['alias']+"']/temperature_sets"
@@ -647,7 +808,7 @@ class Configuration:
                 if tempset['alias'] in tempsets:
                     return CfgError(ECfgError.DUPLICATE_UNIQUE_KEY, node_path, None, {'key':tempset['alias']}, self.logger)
                 node_path_ = node_path+"['"+tempset['alias']+"']"
-                tempsets.append(tempset['alias'])
+                tempsets.add(tempset['alias'])
                 if 'parent' in tempset and schedule != None:
                     if not self.__find_temperature_set(tempset['parent'], schedule):
                         return CfgError(ECfgError.BAD_REFERENCE, node_path_+"/parent", None, {'reference':tempset['parent']}, self.logger)
@@ -707,6 +868,7 @@ class Configuration:
         if 'temperature_sets' in parent:
             save = parent['temperature_sets']
         parent['temperature_sets'] = temperature_sets
+        self.__index_temperature_sets(parent)
         cfgErr = self.__verify_scheduler_config()
         if not cfgErr:
             # there is no error detected
@@ -716,6 +878,7 @@ class Configuration:
                 parent['temperature_sets'] = save
             else:
                 parent.pop('temperature_sets')
+            self.__index_temperature_sets(parent)
             return cfgErr
         return None
 
@@ -753,20 +916,12 @@ class Configuration:
                     time_slot['start_time'] = start_time
         return None
 
-    def __convert_schedule_dates_to_string(schedule):
-        timeslots = Configuration.get_dict_values_from_path(schedule, ['schedule_items', 'timeslots_sets', 'timeslots'])
-        timeslots.extend(Configuration.get_dict_values_from_path(schedule, ['schedule_items', 'timeslots_sets', 'timeslots_A']))
-        timeslots.extend(Configuration.get_dict_values_from_path(schedule, ['schedule_items', 'timeslots_sets', 'timeslots_B']))
-        for schedule in timeslots:
-            for time_slot in schedule:
-                if 'start_time' in time_slot:
-                    if isinstance(time_slot['start_time'], datetime.time):
-                        time_slot['start_time'] = time_slot['start_time'].isoformat()
-
-    def _change_tempset_ref_in_tempsets(tempSets:list, old_name:str, new_name:str) -> bool:
+    # changes : list of (node, key, old value) the changed nodes are appended to
+    def _change_tempset_ref_in_tempsets(tempSets:list, old_name:str, new_name:str, changes:list) -> bool:
         result:bool = False
         for tempSet in tempSets:
             if ('parent' in tempSet) and tempSet['parent']==old_name:
+                changes.append((tempSet, 'parent', old_name))
                 tempSet['parent'] = new_name
                 result = True
         return result
@@ -780,23 +935,24 @@ class Configuration:
             ts.extend(timeslotSet['timeslots_B'])
         return ts
 
-    def _change_localtempset_ref_in_schedule(schedule_config:dict, old_name:str, new_name:str) -> bool:
+    def _change_localtempset_ref_in_schedule(schedule_config:dict, old_name:str, new_name:str, changes:list) -> bool:
         result:bool = False
         for schedule_item in schedule_config['schedule_items']:
             for timeslotSet in schedule_item['timeslots_sets']:
                 ts:list = Configuration._get_all_timeslots(timeslotSet)
                 for timeslot in ts:
                     if timeslot['temperature_set'] == old_name:
+                        changes.append((timeslot, 'temperature_set', old_name))
                         timeslot['temperature_set'] = new_name
                         result = True
         return result
 
-    def _change_globaltempset_ref_in_schedule(schedule_config:dict, old_name:str, new_name:str) -> bool:
+    def _change_globaltempset_ref_in_schedule(schedule_config:dict, old_name:str, new_name:str, changes:list) -> bool:
         result:bool = False
         local_tempset_with_old_name_exists = False
         if 'temperature_sets' in schedule_config:
             tempSets:list = schedule_config['temperature_sets']
-            result = Configuration._change_tempset_ref_in_tempsets(tempSets, old_name, new_name)
+            result = Configuration._change_tempset_ref_in_tempsets(tempSets, old_name, new_name, changes)
             for tempset in tempSets:
                 if tempset['alias'] == old_name:
                     local_tempset_with_old_name_exists = True
@@ -807,6 +963,7 @@ class Configuration:
                     ts:list = Configuration._get_all_timeslots(timeslotSet)
                     for timeslot in ts:
                         if timeslot['temperature_set'] == old_name:
+                            changes.append((timeslot, 'temperature_set', old_name))
                             timeslot['temperature_set'] = new_name
                             result = True
         return result
@@ -829,6 +986,21 @@ class Configuration:
         if not repeat_delay:
             repeater['repeat_delay_sec'] = 120
             save = True
+        # optional retry policy : bad values are replaced with defaults
+        for name, minimum in (('max_attempts', 0), ('max_delay_sec', 1)):
+            if name in repeater:
+                value = toInt(repeater[name], self.logger, 'Invalid value in settings.message_repeater.'+name+' : ', None, minimum)
+                if value is None:
+                    repeater[name] = REPEATER_BACKOFF_DEFAULTS[name]
+                    save = True
+        for name, minimum, maximum in (('backoff_factor', 1., None), ('jitter', 0., 1.)):
+            if name in repeater:
+                value = toFloat(repeater[name], self.logger, 'Invalid value in settings.message_repeater.'+name+' : ')
+                if value is None or value < minimum or (maximum is not None and value > maximum):
+                    if value is not None:
+                        self.logger.error('Invalid value in settings.message_repeater.'+name+' : '+str(value)+' is out of range')
+                    repeater[name] = REPEATER_BACKOFF_DEFAULTS[name]
+                    save = True
 
         if not 'scheduler' in settings:
             settings['scheduler'] = {}
@@ -841,42 +1013,116 @@ class Configuration:
             scheduler['init_delay_sec'] = 20
             save = True
 
+        # optional node : bad delays are replaced with defaults
+        persistence = settings.get('config_persistence', None)
+        if persistence:
+            for name in PERSISTENCE_DEFAULTS:
+                if name in persistence:
+                    value = toFloat(persistence[name], self.logger, 'Invalid value in settings.config_persistence.'+name+' : ')
+                    if value is None or value < 0.:
+                        persistence[name] = PERSISTENCE_DEFAULTS[name]
+                        save = True
+
+        # optional node : the ingress queue is only used if it is declared
+        if 'ingress_queue' in settings:
+            if not settings['ingress_queue']:
+                settings['ingress_queue'] = {}
+            ingress_queue = settings['ingress_queue']
+            max_size = toInt(Configuration.get(ingress_queue, 'max_size', 1000), self.logger, 'Invalid value in settings.ingress_queue.max_size : ', None, 1)
+            if not max_size:
+                max_size = 1000
+            if ingress_queue.get('max_size', None) != max_size:
+                ingress_queue['max_size'] = max_size
+                save = True
+
         return save
 
-    def __get_schedule_index(self, schedule_name) -> int:
-        i = 0
-        for schedule in self.get_schedules():
-            if schedule['alias'] == schedule_name:
-                return i
-            i+=1
-        return -1
+    # Add or replace a schedule, then check the whole scheduler configuration
+    # @return CfgError if any error, the previous schedule being restored
+    def __try_schedule(self, schedule:dict) -> CfgError:
+        cfgErr = self.__check_mandatories(schedule, ['alias', 'schedule_items'], '/scheduler/schedules', Configuration.get(schedule, 'alias', None))
+        if cfgErr: return cfgErr
+        if schedule['alias']=='':
+            return CfgError(ECfgError.BAD_VALUE, '/scheduler/schedules', None, {'value':''}, self.logger)
+        name = schedule['alias']
+        scheduleConfig = self.get_schedule(name)
+        new:bool = not scheduleConfig
+        save = scheduleConfig
+        self.__set_schedule(name, schedule, new)
+        cfgErr = self.__verify_scheduler_config()
+        if cfgErr:
+            if new:
+                self.__delete_schedule(name)
+            else:
+                self.__set_schedule(name, save, False)
+        return cfgErr
 
     # Replace a schedule by name, without any integrity control
     # @param createIfNew Add a new schedule in case the given schedule does not exist yet
     def __set_schedule(self, name, scheduleConfig:dict, createIfNew:bool):
-        idx = self.__get_schedule_index(name)
-        if idx>=0:
-            self.get_schedules()[idx] = scheduleConfig
+        schedule:dict = self.schedules_index.get(name, None)
+        if schedule is not None:
+            schedules:list = self.get_schedules()
+            schedules[Configuration.__index_of(schedules, schedule)] = scheduleConfig
         elif createIfNew==True:
             self.get_schedules().append(scheduleConfig)
-
-    def __delete_schedule(schedules:list, schedule_name:str) -> bool:
-        idx:int = 0
-        for schedule in schedules:
-            if schedule['alias']==schedule_name:
-                schedules.pop(idx)
-                return True
-            idx += 1
-        return False
+        else:
+            return
+        self.schedules_index[name] = scheduleConfig
+        self.__index_temperature_sets(scheduleConfig)
+
+    def __delete_schedule(self, schedule_name:str) -> bool:
+        schedule:dict = self.schedules_index.pop(schedule_name, None)
+        if schedule is None:
+            return False
+        schedules:list = self.get_schedules()
+        schedules.pop(Configuration.__index_of(schedules, schedule))
+        self.tempsets_index.pop(schedule_name, None)
+        return True
     
     def __find_temperature_set(self, tempset_name, schedule:dict):
         if schedule:
-            if 'temperature_sets' in schedule:
-                for tempset in schedule['temperature_sets']:
-                    if tempset['alias']==tempset_name:
-                        return tempset
-        if 'temperature_sets' in self.get_scheduler():
-            for tempset in self.get_scheduler()['temperature_sets']:
-                if tempset['alias']==tempset_name:
-                    return tempset
-        return None
\ No newline at end of file
+            tempset:dict = self.tempsets_index.get(schedule['alias'], {}).get(tempset_name, None)
+            if tempset is not None:
+                return tempset
+        return self.tempsets_index.get('', {}).get(tempset_name, None)
+
+    # return the position of an item in a list (compared by identity, not by value)
+    def __index_of(items:list, item) -> int:
+        for idx, value in enumerate(items):
+            if value is item:
+                return idx
+        return -1
+
+    ###################################################################################
+    ###                 INDEXES
+    ###################################################################################
+    # Nodes with a missing or bad name are not indexed (they are reported by __verify_config())
+    def __index_devices(self):
+        self.devices_index = {}
+        for device in self.configdata.get('devices', None) or []:
+            if isinstance(device, dict) and len(device)==1:
+                for name, content in device.items():
+                    self.devices_index[name] = content
+
+    # Also indexes the temperature sets of all schedules
+    def __index_schedules(self):
+        self.schedules_index = {}
+        self.tempsets_index = {}
+        scheduler:dict = self.configdata.get('scheduler', None) or {}
+        self.__index_temperature_sets(scheduler)
+        for schedule in scheduler.get('schedules', None) or []:
+            if isinstance(schedule, dict) and 'alias' in schedule:
+                # the first schedule wins in case of duplicate alias
+                if self.schedules_index.setdefault(schedule['alias'], schedule) is schedule:
+                    self.__index_temperature_sets(schedule)
+
+    # parent is either a schedule, or the scheduler node for global temperature sets
+    def __index_temperature_sets(self, parent:dict):
+        tempsets_index:dict[str,dict] = {}
+        tempsets = parent.get('temperature_sets', None)
+        if isinstance(tempsets, list):
+            for tempset in tempsets:
+                if isinstance(tempset, dict) and 'alias' in tempset:
+                    tempsets_index.setdefault(tempset['alias'], tempset)
+        self.tempsets_index[parent.get('alias', '')] = tempsets_index
\ No newline at end of file
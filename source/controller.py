@@ -1,11 +1,14 @@
 __author__      = "Jérôme Cuq"
 
 VERSION = '1.3.2'
+# minimal delay between 2 setpoints sent through the same connection client
+SETPOINT_INTERVAL_SEC = 0.5
 
 ## Standalone boilerplate before relative imports 
 # For relative imports to work in Python 3.6
 from pathlib import Path
 import sys,time,copy
+from ack_matcher import AckMatcher
 from command_repeater import CommandRepeater, PendingCommand
 from errors import *
 
@@ -19,11 +22,15 @@ from protocols.protocol_handler_callbacks import ProtocolHandlerCallbacks
 from protocols.mqttclient import MQTTClient
 from device_interfaces.device_interfaces import DeviceInterfaces
 from device_interfaces.device_interface_callbacks import DeviceInterfaceCallbacks
-from scheduler import Scheduler, SchedulerCallbacks
+from scheduler import Scheduler, SchedulerCallbacks, ESchedulerChange
 from device import *
 from remote.remote_control import RemoteControl
 from remote.remote_control_callbacks import RemoteControlCallbacks
+from timer_service import TimerService, AsyncioTimerService
+from setpoint_dispatcher import SetpointDispatcher
+from schedule_evaluator import ScheduleEvaluator
 
+import asyncio
 import logging
 import logging.config
 import yaml
@@ -37,7 +44,11 @@ class Controller(
         DeviceInterfaceCallbacks,
         RemoteControlCallbacks):
     
-    def __init__(self, config_path:str = '.', config_files_prefix:str = ''):
+    # loop : optional asyncio event loop. If set (asyncio mode), the controller runs in this loop :
+    #        MQTT network I/O, scheduler evaluations, command repeats and 'is alive' pings are all
+    #        callbacks of the loop, so that no other thread accesses the controller state.
+    def __init__(self, config_path:str = '.', config_files_prefix:str = '', loop:asyncio.AbstractEventLoop = None):
+        self.loop:asyncio.AbstractEventLoop = loop
         self.config_path:str = config_path
         self.config_files_prefix:str = config_files_prefix
         self.logger:logging.Logger = None
@@ -45,6 +56,13 @@ class Controller(
         self.scheduler: Scheduler = None
         self.configuration: Configuration = None
         self.repeater: CommandRepeater = None
+        # acknowledge matcher of devices that do not override it in their protocol params
+        self.default_ack_matcher: AckMatcher = None
+        # acknowledge matcher of each device, built on its first command : key is device name, value is (device, matcher)
+        self.ack_matchers: dict[str,tuple[Device,AckMatcher]] = {}
+        self.setpoint_dispatcher: SetpointDispatcher = None
+        # timers of all components, with a single dispatcher thread
+        self.timer_service: TimerService = None
         self.protocols: Protocols = None
         # list of devices declared in configuration file
         # dictionary key is device name
@@ -62,13 +80,20 @@ class Controller(
         self.__init_logging()
         self.logger.info('Smart Heater server V'+VERSION)
         self.configuration = Configuration(self.config_path, self.config_files_prefix)
-        self.repeater = CommandRepeater(self.configuration.get_repeater_delay())
+        self.timer_service = AsyncioTimerService(self.loop) if self.loop else TimerService()
+        self.timer_service.start()
+        self.configuration.start_writer(self.timer_service, self.loop)
+        self.default_ack_matcher = AckMatcher.create(self.configuration.get_ack_matcher(), '/settings/message_repeater/ack_matcher', self.logger)
+        self.repeater = CommandRepeater(self.configuration.get_repeater_delay(), self.timer_service,
+                                        on_gave_up=self.__on_command_abandoned, **self.configuration.get_repeater_backoff())
+        self.setpoint_dispatcher = SetpointDispatcher(self.timer_service, self.__apply_device_setpoint, SETPOINT_INTERVAL_SEC)
         config_protocols = self.configuration.get_protocols()
-        self.protocols = Protocols(config_protocols, self)
+        self.protocols = Protocols(config_protocols, self, self.loop, self.configuration.get_ingress_queue())
 
         # Instanciation of devices
         config_devices = self.configuration.get_devices()
         self.devices = {}
+        self.ack_matchers = {}
         # Create devices from config_devices and device_interface
         for devname in config_devices:
             devparams = config_devices[devname]
@@ -81,10 +106,11 @@ class Controller(
             else:
                 self.logger.error("ERROR: can not configure device '"+devname+"': protocol client '"+client_name+"' is not defined")
 
-        self.device_interfaces = DeviceInterfaces(self.devices, self.configuration.get_auto_discovery(), self)
+        self.device_interfaces = DeviceInterfaces(self.devices, self.configuration.get_auto_discovery(), self,
+                                                  self.configuration.get_wildcard_device_subscriptions())
 
         config_remote = self.configuration.get_remote_control()
-        self.remote_control = RemoteControl(config_remote, self.devices, self.available_devices, VERSION, self)
+        self.remote_control = RemoteControl(config_remote, self.devices, self.available_devices, VERSION, self, self.timer_service)
         self.remote_control.start()
 
         self.protocols.connect()
@@ -95,17 +121,32 @@ class Controller(
             self.device_interfaces.on_server_alive(False)
             self.remote_control.stop()
             if self.repeater:
+                self.logger.debug('Command repeater stats : '+str(self.repeater.get_stats()))
+                for device_name, stats in self.repeater.get_ack_stats().items():
+                    self.logger.debug("Device['"+device_name+"'] acknowledge latency : "+str(stats))
                 self.repeater.stop()
                 self.repeater = None
+            if self.setpoint_dispatcher:
+                self.logger.debug('Setpoints dispatcher stats : '+str(self.setpoint_dispatcher.get_stats()))
+                self.setpoint_dispatcher.stop()
+                self.setpoint_dispatcher = None
             if self.scheduler:
                 self.scheduler.stop()
                 self.scheduler = None
             self.protocols.stop()
+            for protocol_type, metrics in self.protocols.get_ingress_metrics().items():
+                self.logger.debug("Ingress queue '"+protocol_type+"' metrics : "+str(metrics))
             self.protocols = None
+            # unsaved configuration changes are written before leaving
+            self.configuration.stop_writer()
+            self.logger.debug('Timers stats : '+str(self.timer_service.get_stats()))
+            self.timer_service.stop()
+            self.timer_service = None
 
             self.remote_control = None
             self.configuration = None
             self.devices = {}
+            self.ack_matchers = {}
             self.device_interfaces = None
             self.logger.info('Server stopped')
 
@@ -117,10 +158,13 @@ class Controller(
             cmd:PendingCommand = self.repeater.getCommand(device_name, param_name)
             if param_name == 'setpoint':
                 curSetpoint:float = device.setpoint
-                if cmd and not force_update: curSetpoint = cmd.args[2]
+                if cmd and not force_update: curSetpoint = cmd.value
                 if force_update or (curSetpoint != param_value):
-                    self.repeater.addCommand(device_name, param_name, self.device_interfaces.set_device_parameter, device, param_name, param_value)
-                    self.device_interfaces.set_device_parameter(device, param_name, param_value)
+                    ack_matcher:AckMatcher = self.__get_ack_matcher(device)
+                    correlation:bytes = ack_matcher.new_correlation()
+                    self.repeater.addCommand(device_name, param_name, self.device_interfaces.set_device_parameter, device, param_name, param_value, correlation,
+                                             value=param_value, ack_matcher=ack_matcher, correlation=correlation)
+                    self.device_interfaces.set_device_parameter(device, param_name, param_value, correlation)
                 else:
                     self.logger.debug("__set_device_parameter() : setpoint is already good !")
             else:
@@ -128,6 +172,26 @@ class Controller(
         else:
             return CfgError(ECfgError.BAD_REFERENCE, '/devices', None, {'reference':device_name}, self.logger)
         return None
+
+    # return the acknowledge matcher of a device ('ack_matcher' in its protocol params, or the default one)
+    # note : device matchers are checked by the configuration, they are only built once per device object
+    def __get_ack_matcher(self, device:Device) -> AckMatcher:
+        item:tuple[Device,AckMatcher] = self.ack_matchers.get(device.name, None)
+        if item is not None and item[0] is device:
+            return item[1]
+        ack_matcher:AckMatcher = self.default_ack_matcher
+        params = device.protocol_params.get('ack_matcher', None)
+        if params is not None:
+            try:
+                ack_matcher = AckMatcher.create(params, "/devices/"+device.name+"/protocol/params/ack_matcher", self.logger)
+            except CfgError:
+                pass
+        self.ack_matchers[device.name] = (device, ack_matcher)
+        return ack_matcher
+
+    # Called by the repeater when a command has not been acknowledged after its last repeat
+    def __on_command_abandoned(self, cmd:PendingCommand):
+        self.logger.warning("Device '"+cmd.device+"' did not acknowledge command '"+cmd.command+"' (value:"+str(cmd.value)+"), giving up after "+str(cmd.attempts)+" repeats")
     
     ################################################################################
     # Implementation of SchedulerCallbacks class
@@ -139,21 +203,33 @@ class Controller(
     #  - ALL known devices must have a defined or None setpoint
     def apply_devices_setpoints(self, setpoints: dict[str,tuple[float,bool]]):
         self.logger.info("Applying new setpoints : "+str(setpoints))
-        first = True
+        # setpoints to send, per connection client : they are paced by the dispatcher (this call does not block)
+        batches:dict[str,list[tuple[str,float]]] = {}
         for device_name in setpoints:
             if device_name in self.devices:
                 if not setpoints[device_name][0]:
+                    # a setpoint that has not been sent yet is obsolete
+                    self.setpoint_dispatcher.cancel(device_name)
                     if not setpoints[device_name][1]:
                         self.devices[device_name].scheduled_setpoint = None
                 else:    
                     new_setpoint = common.toFloat(setpoints[device_name][0], self.logger, "Invalid parameter in apply_devices_setpoints() : ")
                     if new_setpoint:
-                        if first==False: time.sleep(0.5)
-                        first = False
+                        # the scheduled setpoint is known right away (manual mode detection, device reconnection),
+                        # even if the dispatcher sends it later
                         self.devices[device_name].scheduled_setpoint = new_setpoint
-                        self.__set_device_parameter(device_name, "setpoint", new_setpoint, False)
+                        client_name:str = self.devices[device_name].protocol_client_name
+                        batches.setdefault(client_name, []).append((device_name, new_setpoint))
             else:
                 self.logger.error("Can not change setpoint for unknown device '"+device_name+"'")
+        for client_name, batch in batches.items():
+            self.setpoint_dispatcher.dispatch(client_name, batch)
+
+    # Called by the dispatcher with the latest setpoint given to apply_devices_setpoints() for this device
+    def __apply_device_setpoint(self, device_name:str, setpoint:float):
+        # The device may have been deleted in the meantime
+        if device_name in self.devices:
+            self.__set_device_parameter(device_name, "setpoint", setpoint, False)
     ################################################################################
     # END OF SchedulerCallbacks implementation
     ################################################################################
@@ -171,11 +247,12 @@ class Controller(
 
         if not self.scheduler:
             # At least one protocol is available, so we can start the scheduler
-            config_scheduler = self.configuration.get_scheduler()
+            config_scheduler = self.configuration.get_snapshot().scheduler
             self.scheduler = Scheduler(config_scheduler,
                                        self, self.devices,
                                        self.configuration.get_scheduler_init_delai(),
-                                       self.configuration.get_scheduler_manual_mode_reset_event())
+                                       self.configuration.get_scheduler_manual_mode_reset_event(),
+                                       timer_service = self.timer_service if self.loop else None)
         else:
             # We need to notify the scheduler about new accessible devices
             new_visible_devices = []
@@ -186,6 +263,12 @@ class Controller(
             if len(new_visible_devices)>0:
                 self.scheduler.on_devices_connect(new_visible_devices)
 
+    def is_droppable_message(self, protocol_type: str, client_name: str, message) -> bool:
+        # device_interfaces is only created once protocols are started
+        if self.device_interfaces:
+            return self.device_interfaces.is_droppable_message(protocol_type, client_name, message)
+        return False
+
     def on_protocol_disconnect(self, protocol_type: str, client_name: str):
         self.device_interfaces.on_client_disconnect(protocol_type, client_name)
         self.remote_control.on_client_disconnect(client_name)
@@ -204,10 +287,13 @@ class Controller(
     def on_device_state(self, device:Device, available:bool):
         if device.available != available:
             self.logger.info("Device['"+device.name+"']: availability state has changed to '"+str(available)+"'")
+            device.available = available
             if device.name in self.devices:
                 self.remote_control.on_device_state(device, available)
                 if device.available==True and device.hasScheduledSetpoint()==True:
                     self.logger.info("This device has a scheduled setpoint : "+str(device.scheduled_setpoint))
+                    # it is sent now : a setpoint still waiting in the dispatcher would be sent twice
+                    self.setpoint_dispatcher.cancel(device.name)
                     self.__set_device_parameter(device.name, "setpoint", device.scheduled_setpoint, True)
 
     def on_device_current_temperature(self, device:Device, value:float):
@@ -232,9 +318,14 @@ class Controller(
             self.scheduler.on_device_setpoint(device)
 
         if device.name in self.devices:
-            self.repeater.removeCommand(device.name, 'setpoint')
+            self.repeater.acknowledge(device.name, 'setpoint', device.setpoint)
             self.remote_control.on_device_setpoint(device)
 
+    def on_device_ack(self, device:Device, param_name:str, correlation_data:bytes):
+        self.logger.debug("Device['"+device.name+"']: received response for '"+param_name+"'")
+        if device.name in self.devices:
+            self.repeater.acknowledge(device.name, param_name, correlation=correlation_data)
+
     def on_discovered_device(self, device:Device):
         self.logger.debug("Device['"+device.name+"'] discovered !")
         if not device.entity in self.available_devices:
@@ -267,6 +358,49 @@ class Controller(
     def get_scheduler_config(self) -> dict:
         return self.configuration.get_scheduler()
 
+    def get_forecast(self, start:datetime, end:datetime) -> dict[str,list[tuple[datetime,float]]]:
+        if self.scheduler:
+            return self.scheduler.forecast(start, end)
+        return {}
+
+    def get_stats(self) -> dict:
+        stats:dict = {}
+        if self.repeater:
+            stats['repeater'] = self.repeater.get_stats()
+            stats['acknowledge'] = self.repeater.get_ack_stats()
+        return stats
+
+    def evaluate_schedules(self, remote_name:str, params:dict, context:any):
+        self.logger.info("[from '"+remote_name+"'] Received schedules to evaluate")
+        err:CfgError = None
+        stats:list = None
+        schedules = params['schedules']
+        # 'year' and 'heating_threshold' are optional
+        year:int = None
+        heating_threshold:float = None
+        if 'year' in params:
+            year = common.toInt(params['year'], self.logger, "Invalid parameter in evaluate_schedules() : ", None, 1970, 9999)
+        if 'heating_threshold' in params:
+            heating_threshold = common.toFloat(params['heating_threshold'], self.logger, "Invalid parameter in evaluate_schedules() : ")
+        if not isinstance(schedules, list) or len(schedules)==0:
+            err = CfgError(ECfgError.BAD_VALUE, 'evaluate_schedules', 'schedules', {'value':schedules}, self.logger)
+        elif 'year' in params and year is None:
+            err = CfgError(ECfgError.BAD_VALUE, 'evaluate_schedules', 'year', {'value':params['year']}, self.logger)
+        elif 'heating_threshold' in params and heating_threshold is None:
+            err = CfgError(ECfgError.BAD_VALUE, 'evaluate_schedules', 'heating_threshold', {'value':params['heating_threshold']}, self.logger)
+        else:
+            try:
+                # candidate schedules are checked against the current configuration, that is left unchanged
+                err, stats = ScheduleEvaluator(self.configuration, year).evaluate(schedules, heating_threshold)
+            except ImportError as exc:
+                # numpy is an optional dependency
+                err = CfgError(ECfgError.EXCEPTION, 'evaluate_schedules', None, {'exception':str(exc)}, self.logger)
+        if not err:
+            self.remote_control.on_server_response(remote_name, context, 'success', data=stats)
+        else:
+            self.remote_control.on_server_response(remote_name, context, 'failure', err.to_dict())
+            self.logger.error("Could not evaluate schedules")
+
     def set_devices_order(self, remote_name:str, device_names:list, context:any):
         self.logger.info("[from '"+remote_name+"'] Received a new devices order : "+str(device_names))
         err:CfgError = self.configuration.set_devices_order(device_names)
@@ -302,7 +436,7 @@ class Controller(
             self.repeater.set_device_name(old_name, new_name)
             self.device_interfaces.on_devices(self.devices)
             self.remote_control.on_devices(self.devices)
-            self.scheduler.on_devices(self.devices, self.configuration.get_scheduler())
+            self.scheduler.on_devices(self.devices, self.configuration.get_snapshot().scheduler)
             # something changed in scheduler data
             self.remote_control.on_scheduler(self.configuration.get_scheduler())
         else:
@@ -366,11 +500,12 @@ class Controller(
         if not err:
             self.remote_control.on_server_response(remote_name, context, 'success')
             self.devices.pop(name)
+            self.ack_matchers.pop(name, None)
             # We need to notify devices consumers
             self.repeater.remove_device_commands(name)
             self.device_interfaces.on_devices(self.devices)
             self.remote_control.on_devices(self.devices)
-            self.scheduler.on_devices(self.devices, self.configuration.get_scheduler())
+            self.scheduler.on_change(ESchedulerChange.DEVICE_DELETED, {'device_name':name}, self.configuration.get_snapshot().scheduler)
         else:
             self.remote_control.on_server_response(remote_name, context, 'failure', err.to_dict())
             self.logger.error("Could not delete device")
@@ -410,7 +545,7 @@ class Controller(
         if not err:
             self.remote_control.on_server_response(remote_name, context, 'success')
             # something changed in scheduler data
-            self.scheduler.set_scheduler(self.configuration.get_scheduler())
+            self.scheduler.on_change(ESchedulerChange.TEMPERATURE_SETS, {'schedule_name':schedule_name}, self.configuration.get_snapshot().scheduler)
             self.remote_control.on_scheduler(self.configuration.get_scheduler())
         else:
             self.remote_control.on_server_response(remote_name, context, 'failure', err.to_dict())
@@ -422,7 +557,7 @@ class Controller(
         if not err:
             self.remote_control.on_server_response(remote_name, context, 'success')
             # something changed in scheduler data
-            self.scheduler.set_scheduler(self.configuration.get_scheduler())
+            self.scheduler.on_change(ESchedulerChange.TEMPERATURE_SET_NAME, {'schedule_name':schedule_name}, self.configuration.get_snapshot().scheduler)
             self.remote_control.on_scheduler(self.configuration.get_scheduler())
         else:
             self.remote_control.on_server_response(remote_name, context, 'failure', err.to_dict())
@@ -434,7 +569,7 @@ class Controller(
         if not err:
             self.remote_control.on_server_response(remote_name, context, 'success')
             # something changed in scheduler data
-            self.scheduler.set_scheduler(self.configuration.get_scheduler())
+            self.scheduler.on_change(ESchedulerChange.SCHEDULE_NAME, {'old_name':old_name, 'new_name':new_name}, self.configuration.get_snapshot().scheduler)
             self.remote_control.on_scheduler(self.configuration.get_scheduler())
         else:
             self.remote_control.on_server_response(remote_name, context, 'failure', err.to_dict())
@@ -446,7 +581,7 @@ class Controller(
         if not err:
             self.remote_control.on_server_response(remote_name, context, 'success')
             # something changed in scheduler data
-            self.scheduler.set_scheduler(self.configuration.get_scheduler())
+            self.scheduler.on_change(ESchedulerChange.SCHEDULE_PROPERTIES, {'name':name, 'new_name':new_name}, self.configuration.get_snapshot().scheduler)
             self.remote_control.on_scheduler(self.configuration.get_scheduler())
         else:
             self.remote_control.on_server_response(remote_name, context, 'failure', err.to_dict())
@@ -458,7 +593,7 @@ class Controller(
         if not err:
             self.remote_control.on_server_response(remote_name, context, 'success')
             # something changed in scheduler data
-            self.scheduler.set_scheduler(self.configuration.get_scheduler())
+            self.scheduler.on_change(ESchedulerChange.SCHEDULE_DELETED, {'schedule_name':schedule_name}, self.configuration.get_snapshot().scheduler)
             self.remote_control.on_scheduler(self.configuration.get_scheduler())
         else:
             self.remote_control.on_server_response(remote_name, context, 'failure', err.to_dict())
@@ -1,6 +1,70 @@
 __author__      = "Jérôme Cuq"
 
 from datetime import datetime
+import heapq
+import itertools
+import threading
+
+
+class ManualModeHeap:
+    """Min-heap of the devices in manual mode, ordered by the date they entered manual mode.
+       As the manual mode duration is the same for all devices, the top of the heap is also the
+       device whose manual mode expires first.
+       The heap is maintained by Device.enterManualMode()/exitManualMode() (and by any change of
+       Device.manual_setpoint_date) : outdated entries are not removed, they are skipped when popped.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        # items are (manual_setpoint_date, sequence, device)
+        self.heap:list[tuple[datetime,int,'Device']] = []
+        self.sequence = itertools.count()
+
+    # A heap is shared with the devices it tracks : it must never be copied with a device
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def push(self, device:'Device'):
+        with self.lock:
+            heapq.heappush(self.heap, (device.manual_setpoint_date, next(self.sequence), device))
+
+    # return the oldest manual_setpoint_date of devices in manual mode, or None if no device is in manual mode
+    def get_first_date(self) -> datetime:
+        with self.lock:
+            self.__drop_outdated()
+            return self.heap[0][0] if self.heap else None
+
+    # Remove from the heap and return the devices that entered manual mode at or before given date
+    # note : the devices are still in manual mode, the caller must call exitManualMode() on them
+    #        (or push them again)
+    def pop_until(self, date_:datetime) -> list['Device']:
+        result:list[Device] = []
+        with self.lock:
+            self.__drop_outdated()
+            while self.heap and self.heap[0][0] <= date_:
+                result.append(heapq.heappop(self.heap)[2])
+                self.__drop_outdated()
+        return result
+
+    # return the devices currently in manual mode
+    def get_devices(self) -> list['Device']:
+        with self.lock:
+            return [item[2] for item in self.heap if self.__is_valid(item)]
+
+    ################################################################################
+    # PRIVATE METHODS
+    ################################################################################
+
+    # an entry is outdated if its device has left manual mode, has entered it again since then,
+    # or is now tracked by another heap
+    def __is_valid(self, item:tuple) -> bool:
+        return item[2].manual_setpoint_date is item[0] and item[2].manual_mode_heap is self
+
+    def __drop_outdated(self):
+        while self.heap and not self.__is_valid(self.heap[0]):
+            heapq.heappop(self.heap)
 
 
 class Device:
@@ -15,11 +79,30 @@ class Device:
         self.max_temperature:float = 35.0
         self.setpoint:float = 0.0
         self.scheduled_setpoint:float = None
+        # heap of manual mode expiries this device is tracked in (see ManualModeHeap), if any
+        self.manual_mode_heap:ManualModeHeap = None
         # manual_setpoint_date is set when current setpoint is not the scheduled setpoint
         self.manual_setpoint_date:datetime = None
         self.available:bool = False
         self.last_updated:datetime = datetime.fromisoformat("1000-01-01T01:00:00.000000+00:00")
 
+    @property
+    def manual_setpoint_date(self) -> datetime:
+        return self.__manual_setpoint_date
+
+    @manual_setpoint_date.setter
+    def manual_setpoint_date(self, date_:datetime):
+        self.__manual_setpoint_date = date_
+        if date_ is not None and self.manual_mode_heap is not None:
+            self.manual_mode_heap.push(self)
+
+    # Attach this device to a heap of manual mode expiries (the device is pushed in it if already in manual mode)
+    def setManualModeHeap(self, manual_mode_heap:ManualModeHeap):
+        if manual_mode_heap is not self.manual_mode_heap:
+            self.manual_mode_heap = manual_mode_heap
+            if manual_mode_heap is not None and self.isInManualMode():
+                manual_mode_heap.push(self)
+
     def hasScheduledSetpoint(self) -> bool:
         return self.scheduled_setpoint != None
 
@@ -30,4 +113,4 @@ class Device:
         self.manual_setpoint_date = None
 
     def isInManualMode(self) -> bool:
-        return self.manual_setpoint_date
\ No newline at end of file
+        return self.manual_setpoint_date
@@ -29,6 +29,11 @@ class DeviceInterfaceBase:
     def on_client_message(self, client_name: str, message):
         pass
 
+    # return True if the message is telemetry (i.e. a current temperature) : a newer value will follow,
+    # so it may be dropped when messages are queued. State changes and setpoints are never dropped.
+    def is_droppable_message(self, client_name: str, message) -> bool:
+        return False
+
     def on_server_alive(self, client_name: str, is_alive:bool):
         pass
 
@@ -42,5 +47,6 @@ class DeviceInterfaceBase:
     # The implementation is in charge of sending command via DeviceInterfaceCallbacks
     # param_name may be either :
     # - 'setpoint' : param_value must be a float.
-    def set_device_parameter(self, device: device.Device, param_name:str, param_value):
+    # correlation_data : if set, the device is asked to respond with this data (see DeviceInterfaceCallbacks.on_device_ack())
+    def set_device_parameter(self, device: device.Device, param_name:str, param_value, correlation_data:bytes = None):
         pass
\ No newline at end of file
@@ -20,6 +20,10 @@ class DeviceInterfaceCallbacks:
     def on_device_setpoint(self, device:Device, previousValue:float):
         pass
 
+    # Called when the device responds to a parameter change that has been sent with correlation data
+    def on_device_ack(self, device:Device, param_name:str, correlation_data:bytes):
+        pass
+
     def on_discovered_device(self, device:Device):
         pass
 
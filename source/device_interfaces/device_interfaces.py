@@ -13,7 +13,7 @@ class DeviceInterfaces:
         This class manages communication with devices.
         It instanciates one device interface class for each protocol type.
     """
-    def __init__(self, devices: dict[str,Device], auto_discovery:list[dict], callbacks:DeviceInterfaceCallbacks):
+    def __init__(self, devices: dict[str,Device], auto_discovery:list[dict], callbacks:DeviceInterfaceCallbacks, wildcard_subscriptions:bool = False):
         """ctor for this class. Raises CfgError if some protocol settings are invalid
 
         :param devices: list of actual devices
@@ -22,6 +22,8 @@ class DeviceInterfaces:
         :type auto_discovery: list[dict]
         :param callbacks: Callback to the controller
         :type callbacks: DeviceInterfaceCallbacks
+        :param wildcard_subscriptions: subscribe to one wildcard topic per device base topic prefix, instead of each device topic
+        :type wildcard_subscriptions: bool
         :raises CfgError: in case of error in auto_discovery or device.protocol_params format
         """
         self.logger: logging.Logger = logging.getLogger('hcs.devint')
@@ -31,7 +33,7 @@ class DeviceInterfaces:
         MQTT = MQTTProtocolHandler.get_config_type()
         prot_auto_discovery = self.__get_auto_discovery(auto_discovery, MQTT)
         prot_devices = self.__get_devices(devices, MQTT)
-        self.interfaces[MQTT] = MQTTDeviceInterface(prot_devices, prot_auto_discovery, callbacks)
+        self.interfaces[MQTT] = MQTTDeviceInterface(prot_devices, prot_auto_discovery, callbacks, wildcard_subscriptions)
 
     def __get_devices(self, devices: dict[str,Device], protocol:str) -> dict[str,Device]:
         prot_devices:dict[str,Device] = {}
@@ -58,6 +60,9 @@ class DeviceInterfaces:
     def on_client_message(self, protocol_type: str, client_name: str, message):
         self.interfaces[protocol_type].on_client_message(client_name, message)
 
+    def is_droppable_message(self, protocol_type: str, client_name: str, message) -> bool:
+        return self.interfaces[protocol_type].is_droppable_message(client_name, message)
+
     def on_server_alive_for_client(self, protocol_type: str, client_name: str, is_alive:bool):
         self.interfaces[protocol_type].on_server_alive_for_client(client_name, is_alive)
 
@@ -78,8 +83,9 @@ class DeviceInterfaces:
     # Ask for a device parameter change
     # param_name may be either :
     # - 'setpoint' : param_value must be a float.
-    def set_device_parameter(self, device: Device, param_name:str, param_value):
+    # correlation_data : if set, the device is asked to respond with this data (see DeviceInterfaceCallbacks.on_device_ack())
+    def set_device_parameter(self, device: Device, param_name:str, param_value, correlation_data:bytes = None):
         if param_name not in ['setpoint']:
             self.logger.error("set_device_parameter() : invalid param_name '"+param_name+"'")
         else:
-            self.interfaces[device.protocol_type].set_device_parameter(device, param_name, param_value)
\ No newline at end of file
+            self.interfaces[device.protocol_type].set_device_parameter(device, param_name, param_value, correlation_data)
\ No newline at end of file
@@ -8,8 +8,8 @@ from errors import *
 from .device_interface_callbacks import DeviceInterfaceCallbacks
 from .device_interface_base import DeviceInterfaceBase
 from protocols.mqtt_protocol_handler import MQTTProtocolHandler
+from protocols.topic_trie import TopicTrie
 from device import Device
-import re
 
 
 class EDevTopic(Enum):
@@ -24,6 +24,14 @@ class EDevTopic(Enum):
     on_max_temp_subtopic = "on_max_temp_subtopic"
     set_setpoint_subtopic = "set_setpoint_subtopic"
 
+# (optional) device parameter : MQTT v5 response topic of setpoint changes
+ON_SETPOINT_RESPONSE_SUBTOPIC:str = "on_setpoint_response_subtopic"
+
+# topics of device messages handled by MQTTDeviceInterface
+DEVICE_MESSAGE_TOPICS:set[str] = {EDevTopic.on_current_temp_subtopic.value, EDevTopic.on_setpoint_subtopic.value,
+                                  EDevTopic.on_state_subtopic.value, EDevTopic.on_min_temp_subtopic.value,
+                                  EDevTopic.on_max_temp_subtopic.value, ON_SETPOINT_RESPONSE_SUBTOPIC}
+
 class EAutoDiscoveryTopic(Enum):
     """ Enumeration of auto-discovery specific parameters topics
     """
@@ -33,7 +41,9 @@ class EAutoDiscoveryTopic(Enum):
 class MQTTDeviceInterface(DeviceInterfaceBase):
     # Implementation of DeviceInterfaceBase class
 
-    def __init__(self, devices: dict[str, Device], auto_discovery: list[dict], callbacks: DeviceInterfaceCallbacks):
+    # wildcard_subscriptions : if True, the topics of devices with the same base topic prefix
+    #                          are subscribed with a single wildcard topic, i.e. 'homeassistant/climate/+/+'
+    def __init__(self, devices: dict[str, Device], auto_discovery: list[dict], callbacks: DeviceInterfaceCallbacks, wildcard_subscriptions:bool = False):
         self.logger = logging.getLogger('hcs.mqttdev')
         self.protocol_type = MQTTProtocolHandler.get_config_type()
         self.callbacks: DeviceInterfaceCallbacks = callbacks
@@ -55,7 +65,18 @@ class MQTTDeviceInterface(DeviceInterfaceBase):
         # dictionary key is entity name
         self.available_devices: dict[str, device.Device] = {}
         self.auto_discovery: list[dict] = auto_discovery
-        self.device_topic_re: re.Pattern = re.compile('([^/]+)/([^/]+)/?')
+        self.wildcard_subscriptions: bool = wildcard_subscriptions
+        # auto-discovery topics are [device_base_topic]/entity/command[/...] :
+        # the value of each filter is (auto_discovery item, number of levels in its device_base_topic)
+        self.auto_discovery_topics: TopicTrie = TopicTrie()
+        for item in self.auto_discovery:
+            base_topic:str = item[EDevTopic.device_base_topic.value]
+            self.auto_discovery_topics.add(base_topic+'/+/+/#', (item, len(base_topic.split('/'))))
+        # key is a device message topic, value is the list of (device, topic name, notify2callback)
+        # this topic must be dispatched to (devices first, then available devices)
+        # note : the index is rebuilt (not modified) each time devices or available devices change
+        self.topics_index: dict[str, list[tuple[Device,str,bool]]] = {}
+        self.__update_topics_index()
 
     def __check_auto_discovery(self, auto_discovery: list[dict]) -> CfgError:
         mandatories:list = [t.value for t in EDevTopic] + [t.value for t in EAutoDiscoveryTopic]
@@ -86,15 +107,19 @@ class MQTTDeviceInterface(DeviceInterfaceBase):
             if item.endswith('_subtopic'):
                 map[item] = map[item].lstrip('/')
 
-    def set_device_parameter(self, device: device.Device, param_name:str, param_value):
+    def set_device_parameter(self, device: device.Device, param_name:str, param_value, correlation_data:bytes = None):
         if param_name == 'setpoint':
             topic = self.__get_mqtt_topic(
                 device.protocol_params, EDevTopic.set_setpoint_subtopic.value)
             if topic:
                 self.logger.info("["+device.protocol_client_name+"]: Setting "+param_name +
                                  " for device['"+device.name+"'] with value '"+str(param_value)+"'")
-                self.callbacks.send_message_to_device(
-                    device, {'type': 'publish', 'topic': topic, 'payload': str(param_value)})
+                message:dict = {'type': 'publish', 'topic': topic, 'payload': str(param_value)}
+                response_topic = self.__get_mqtt_topic(device.protocol_params, ON_SETPOINT_RESPONSE_SUBTOPIC)
+                if correlation_data is not None and response_topic:
+                    message['response_topic'] = response_topic
+                    message['correlation_data'] = correlation_data
+                self.callbacks.send_message_to_device(device, message)
             else:
                 self.logger.error("Missing topic '"+EDevTopic.set_setpoint_subtopic.value +
                                   "' in device '"+device.name+"' configuration")
@@ -108,50 +133,71 @@ class MQTTDeviceInterface(DeviceInterfaceBase):
         # We check the content of devices
         self.__check_devices(devices)
         self.available_devices = devices
+        self.__update_topics_index()
 
     def __subscribe_to_devices(self, new_devices: dict[str, Device] = None):
         current_subscriptions: dict[str, Device] = {}
-        if new_devices:
+        # topics already subscribed, that are still used by new devices (i.e. a renamed device), are not subscribed again
+        current_topics: set[tuple[str,str]] = None
+        if new_devices is not None:
             current_subscriptions = self.devices.copy()
+            current_topics = set(self.__get_topics(current_subscriptions.values()))
             self.devices = new_devices
+            self.__update_topics_index()
 
+        new_subscriptions: list[Device] = []
         for devname in self.devices:
             if devname in current_subscriptions:
                 # We already subscribed for changes on this device
                 current_subscriptions.pop(devname)
             else:
                 # We need to subscribe for changes on this device
-                device:Device = self.devices[devname]
-                self.__subscribe(device)
+                new_subscriptions.append(self.devices[devname])
+        self.__subscribe(new_subscriptions, 'subscribe', current_topics)
 
-        # Every device name left in current_subscriptions must be unsubcribed
-        for device in current_subscriptions.values():
-            # We need to unsubscribe for changes on this device
-            self.__subscribe(device, 'unsubscribe')
+        # Every device name left in current_subscriptions must be unsubcribed,
+        # unless its topics are still used by another device (i.e. a renamed device)
+        self.__subscribe(list(current_subscriptions.values()), 'unsubscribe', set(self.__get_topics(self.devices.values())))
 
-    def __subscribe(self, device: device.Device, operation='subscribe'):
-        """Subscribe or unsubscribe topics for given device
+    def __subscribe(self, devices: list[Device], operation='subscribe', excluded_topics:set[tuple[str,str]] = None):
+        """Subscribe or unsubscribe topics for given devices, with one message per connection client
 
-        :param device: device to (un)subscribe to
-        :type device: device.Device
+        :param devices: devices to (un)subscribe to
+        :type devices: list[Device]
         :param operation: one of ['subscribe', 'unsubscribe'], defaults to 'subscribe'
         :type operation: str, optional
+        :param excluded_topics: (client name, topic) couples that must not be (un)subscribed
+        :type excluded_topics: set[tuple[str,str]], optional
         """
-        subtopics = [(EDevTopic.on_current_temp_subtopic.value,'current temperature'),
-                     (EDevTopic.on_setpoint_subtopic.value, 'temperature setpoint'),
-                     (EDevTopic.on_state_subtopic.value, 'state'), 
-                     (EDevTopic.on_min_temp_subtopic.value, 'min temperature'),
-                     (EDevTopic.on_max_temp_subtopic.value, 'max temperature')]
-        for item in subtopics:
-            topic = self.__get_mqtt_topic(device.protocol_params, item[0])
-            name = item[1]
-            if topic:
-                self.logger.debug("["+device.protocol_client_name+"]: {operation} for device['" +
-                              device.name+"'] "+name+" with topic '"+topic+"'")
-                self.callbacks.send_message_to_device(device, {'type': operation, 'topic': topic})
+        # key is client name, value is the list of topics
+        topics:dict[str,list[str]] = {}
+        for item in self.__get_topics(devices):
+            if not excluded_topics or not item in excluded_topics:
+                topics.setdefault(item[0], []).append(item[1])
+        for client_name, client_topics in topics.items():
+            self.logger.debug("["+client_name+"]: "+operation+" for "+str(len(devices))+" devices with "+str(len(client_topics))+" topics")
+            self.callbacks.send_message_to_client(self.protocol_type, client_name, {'type': operation, 'topic': client_topics})
+
+    # return the (client name, topic) couples to subscribe to, for the messages of given devices
+    # (with wildcard subscriptions, the topics are wildcard topics shared by devices)
+    def __get_topics(self, devices) -> dict[tuple[str,str],None]:
+        # a dict is used as an ordered set
+        result:dict[tuple[str,str],None] = {}
+        for device in devices:
+            for topic in MQTTDeviceInterface.__get_device_topics(device.protocol_params):
+                if self.wildcard_subscriptions:
+                    topic = MQTTDeviceInterface.__get_wildcard_topic(device.protocol_params, topic)
+                result[(device.protocol_client_name, topic)] = None
+        return result
+
+    # return the wildcard topic of a device topic : the levels of the entity (last level of device_base_topic)
+    # and of the subtopic are replaced by '+', i.e. 'homeassistant/climate/+/+' for 'homeassistant/climate/climate_1/temperature'
+    def __get_wildcard_topic(mqtt_device_params:dict, topic:str) -> str:
+        levels:list[str] = topic.split('/')
+        prefix_length:int = len(mqtt_device_params[EDevTopic.device_base_topic.value].split('/')) - 1
+        return '/'.join(levels[:prefix_length] + ['+']*(len(levels)-prefix_length))
 
-    def __on_device_message(self, dev:Device, message, notify2callback:bool):
-        topic_name = self.__get_topic_name(dev.protocol_params, message.topic)
+    def __on_device_message(self, dev:Device, topic_name:str, message, notify2callback:bool):
         if topic_name==EDevTopic.on_current_temp_subtopic.value:
             floatData = common.toFloat(
                 message.payload, self.logger, "on_client_message(): Received invalid data on '"+topic_name+"' : ")
@@ -169,15 +215,25 @@ class MQTTDeviceInterface(DeviceInterfaceBase):
                 if notify2callback:
                     self.callbacks.on_device_setpoint(dev, prev)
 
+        elif topic_name==ON_SETPOINT_RESPONSE_SUBTOPIC:
+            # MQTT v5 response : only its correlation data matters
+            properties = getattr(message, 'properties', None)
+            correlation_data = getattr(properties, 'CorrelationData', None)
+            if correlation_data is None:
+                self.logger.warning("on_client_message(): Received response without correlation data on '"+topic_name+"'")
+            elif notify2callback:
+                self.callbacks.on_device_ack(dev, 'setpoint', correlation_data)
+
         elif topic_name==EDevTopic.on_state_subtopic.value:
             state = MQTTDeviceInterface.__str_2_device_state(message.payload)
             if state == None:
                 self.logger.warning(
                     "on_client_message(): Received invalid data on '"+topic_name+"' : "+message.payload)
+            elif notify2callback:
+                # the callback detects the availability change, then updates the device
+                self.callbacks.on_device_state(dev, state)
             else:
                 dev.available = state
-                if notify2callback:
-                    self.callbacks.on_device_state(dev, state)
         
         elif topic_name==EDevTopic.on_min_temp_subtopic.value:
             floatData = common.toFloat(
@@ -195,50 +251,53 @@ class MQTTDeviceInterface(DeviceInterfaceBase):
                 if notify2callback:
                     self.callbacks.on_device_max_temperature(dev, floatData)
     
-    def on_client_message(self, client_name: str, message):
-        dev:Device
+    def is_droppable_message(self, client_name: str, message) -> bool:
+        targets:list[tuple[Device,str,bool]] = self.topics_index.get(message.topic, None)
+        if not targets:
+            return False
+        for dev, topic_name, notify2callback in targets:
+            if topic_name != EDevTopic.on_current_temp_subtopic.value:
+                return False
+        return True
 
-        for dev in self.devices.values():
-            self.__on_device_message(dev, message, True)
-        
-        for dev in self.available_devices.values():
-            self.__on_device_message(dev, message, False)
+    def on_client_message(self, client_name: str, message):
+        for dev, topic_name, notify2callback in self.topics_index.get(message.topic, []):
+            self.__on_device_message(dev, topic_name, message, notify2callback)
 
         if len(self.auto_discovery) > 0:
             # auto discovery is enabled
-            for item in self.auto_discovery:
-                base_topic = item[EDevTopic.device_base_topic.value] + '/'
-                if message.topic.startswith(base_topic):
-                    match: re.Match = self.device_topic_re.match(message.topic[len(base_topic):])
-                    if match:
-                        entity = match.group(1)
-                        if not entity in self.available_devices:
-                            command = match.group(2)
-                            device: Device = None
-                            if not entity in self.auto_discovered:
-                                device = Device('', entity, self.protocol_type, client_name, {
-                                    EDevTopic.device_base_topic.value: base_topic + entity,
-                                    EDevTopic.on_current_temp_subtopic.value: item[EDevTopic.on_current_temp_subtopic.value],
-                                    EDevTopic.on_setpoint_subtopic.value: item[EDevTopic.on_setpoint_subtopic.value],
-                                    EDevTopic.on_state_subtopic.value: item[EDevTopic.on_state_subtopic.value],
-                                    EDevTopic.on_min_temp_subtopic.value: item[EDevTopic.on_min_temp_subtopic.value],
-                                    EDevTopic.on_max_temp_subtopic.value: item[EDevTopic.on_max_temp_subtopic.value],
-                                    EDevTopic.set_setpoint_subtopic.value: item[EDevTopic.set_setpoint_subtopic.value]
-                                })
-                                self.auto_discovered[entity] = device
-                            else:
-                                device = self.auto_discovered[entity]
+            for (item, base_levels), captures in self.auto_discovery_topics.match(message.topic):
+                # captures end with entity, command and the remaining levels
+                entity, command = captures[-3], captures[-2]
+                if entity and command:
+                    # device_base_topic may contain wildcards : we need the actual base topic
+                    base_topic = '/'.join(message.topic.split('/')[:base_levels]) + '/'
+                    if not entity in self.available_devices:
+                        device: Device = None
+                        if not entity in self.auto_discovered:
+                            device = Device('', entity, self.protocol_type, client_name, {
+                                EDevTopic.device_base_topic.value: base_topic + entity,
+                                EDevTopic.on_current_temp_subtopic.value: item[EDevTopic.on_current_temp_subtopic.value],
+                                EDevTopic.on_setpoint_subtopic.value: item[EDevTopic.on_setpoint_subtopic.value],
+                                EDevTopic.on_state_subtopic.value: item[EDevTopic.on_state_subtopic.value],
+                                EDevTopic.on_min_temp_subtopic.value: item[EDevTopic.on_min_temp_subtopic.value],
+                                EDevTopic.on_max_temp_subtopic.value: item[EDevTopic.on_max_temp_subtopic.value],
+                                EDevTopic.set_setpoint_subtopic.value: item[EDevTopic.set_setpoint_subtopic.value]
+                            })
+                            self.auto_discovered[entity] = device
+                        else:
+                            device = self.auto_discovered[entity]
                             
-                            self.__on_device_message(device, message, False)
-                            if command == item[EAutoDiscoveryTopic.friendly_name_subtopic.value]:
-                                device.name = str(message.payload).strip('"\'')               
-                            elif command == item[EAutoDiscoveryTopic.last_updated_subtopic.value]:
-                                device.last_updated = datetime.fromisoformat(str(message.payload))
-                            # we add this device only if we have a name and a last_updated date recent enough
-                            # or if it is a device present in configuration
-                            if device.name != '' and device.last_updated > (self.init_date-timedelta(hours=5)):
-                                self.callbacks.on_discovered_device(device)
-                                #self.auto_discovered.pop(entity)
+                        self.__on_device_message(device, self.__get_topic_name(device.protocol_params, message.topic), message, False)
+                        if command == item[EAutoDiscoveryTopic.friendly_name_subtopic.value]:
+                            device.name = str(message.payload).strip('"\'')               
+                        elif command == item[EAutoDiscoveryTopic.last_updated_subtopic.value]:
+                            device.last_updated = datetime.fromisoformat(str(message.payload))
+                        # we add this device only if we have a name and a last_updated date recent enough
+                        # or if it is a device present in configuration
+                        if device.name != '' and device.last_updated > (self.init_date-timedelta(hours=5)):
+                            self.callbacks.on_discovered_device(device)
+                            #self.auto_discovered.pop(entity)
 
     # def __isknown_device(self, entity:str) -> bool:
     #     for name in self.devices:
@@ -294,6 +353,25 @@ class MQTTDeviceInterface(DeviceInterfaceBase):
             return mqtt_device_params[EDevTopic.device_base_topic.value]+'/'+mqtt_device_params[topic]
         return None
 
+    # Build the index of the topics of all devices and available devices
+    def __update_topics_index(self):
+        topics_index: dict[str, list[tuple[Device,str,bool]]] = {}
+        for devices, notify2callback in ((self.devices, True), (self.available_devices, False)):
+            for dev in devices.values():
+                for topic, topic_name in MQTTDeviceInterface.__get_device_topics(dev.protocol_params).items():
+                    topics_index.setdefault(topic, []).append((dev, topic_name, notify2callback))
+        self.topics_index = topics_index
+
+    # return the topics of the messages a device handles, with their names
+    # (see __get_topic_name() : the first parameter name with a given subtopic wins)
+    def __get_device_topics(mqtt_device_params:dict) -> dict[str,str]:
+        names:dict[str,str] = {}
+        for name, sub_topic in mqtt_device_params.items():
+            if isinstance(sub_topic, str):
+                names.setdefault(sub_topic, name)
+        base_topic = mqtt_device_params[EDevTopic.device_base_topic.value]
+        return {base_topic+'/'+sub_topic:name for sub_topic, name in names.items() if name in DEVICE_MESSAGE_TOPICS}
+
     def __get_topic_name(self, mqtt_device_params:dict, mqtt_topic:str) -> str:
         base_topic = mqtt_device_params[EDevTopic.device_base_topic.value]
         if mqtt_topic.startswith(base_topic+'/'):
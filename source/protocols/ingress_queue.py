@@ -0,0 +1,126 @@
+__author__      = "Jérôme Cuq"
+
+import collections
+import logging
+import threading
+import time
+from thread_base import ThreadBase
+
+
+class IngressQueue:
+    """Bounded queue between the network threads of protocol clients and the controller logic :
+       network threads only push items, a single worker thread calls them in order
+       (the controller is not thread-safe : its callbacks must not run concurrently).
+       Each item is a call to make, either droppable (telemetry) or not (commands, connection events).
+       When the queue is full :
+       - the oldest droppable item is dropped to make room for the new one,
+       - if there is no droppable item in the queue, a new droppable item is dropped,
+         but a new command is always added (commands are never dropped).
+    """
+    def __init__(self, name:str, max_size:int):
+        """
+        :param name: name of the queue, used in logs
+        :type name: str
+        :param max_size: maximum number of droppable items in the queue
+        :type max_size: int
+        """
+        self.logger: logging.Logger = logging.getLogger('hcs.ingress')
+        self.name:str = name
+        self.max_size:int = max_size
+        self.condition:threading.Condition = threading.Condition()
+        # items are [droppable, enqueue_time, func, args] lists, func is set to None when the item is dropped
+        self.items:collections.deque[list] = collections.deque()
+        # droppable items, oldest first (may contain items already handled or dropped)
+        self.droppable_items:collections.deque[list] = collections.deque()
+        # number of items waiting in the queue (dropped items excluded)
+        self.depth:int = 0
+        self.stopping:bool = False
+        # metrics
+        self.max_depth:int = 0
+        self.processed:int = 0
+        self.dropped:int = 0
+        self.total_wait:float = 0.
+        self.max_wait:float = 0.
+        self.worker_thread:ThreadBase = ThreadBase()
+
+    def start(self):
+        self.stopping = False
+        self.worker_thread.start(self.__worker_thread)
+
+    # Items still in the queue are not handled
+    def stop(self):
+        with self.condition:
+            self.stopping = True
+            if self.depth > 0:
+                self.logger.info("Queue '"+self.name+"' : "+str(self.depth)+" items are not handled")
+            self.condition.notify_all()
+        self.worker_thread.stop()
+
+    # Add the call of func(*args) to the queue
+    def put(self, droppable:bool, func, *args):
+        item:list = [droppable, time.monotonic(), func, args]
+        with self.condition:
+            if self.depth >= self.max_size:
+                if not self.__drop_oldest() and droppable:
+                    self.dropped += 1
+                    return
+            self.items.append(item)
+            if droppable:
+                self.droppable_items.append(item)
+            self.depth += 1
+            self.max_depth = max(self.max_depth, self.depth)
+            self.condition.notify()
+
+    def get_metrics(self) -> dict:
+        """return the queue metrics : current depth, maximum depth, number of processed and dropped items,
+           mean and max wait time (sec) of processed items
+        """
+        with self.condition:
+            return {'depth':self.depth,
+                    'max_depth':self.max_depth,
+                    'processed':self.processed,
+                    'dropped':self.dropped,
+                    'mean_wait':self.total_wait/self.processed if self.processed else 0.,
+                    'max_wait':self.max_wait}
+
+    ################################################################################
+    # PRIVATE METHODS
+    ################################################################################
+
+    # Drop the oldest droppable item still in the queue
+    # return False if there is no such item
+    def __drop_oldest(self) -> bool:
+        while self.droppable_items:
+            item:list = self.droppable_items.popleft()
+            if item[2] is not None:
+                item[2] = None
+                self.depth -= 1
+                self.dropped += 1
+                return True
+        return False
+
+    def __worker_thread(self):
+        while True:
+            with self.condition:
+                while not self.stopping and self.depth == 0:
+                    self.condition.wait()
+                if self.stopping:
+                    return
+                item:list = self.items.popleft()
+                while item[2] is None:
+                    # dropped item
+                    item = self.items.popleft()
+                func = item[2]
+                # the item is no longer in the queue, it can not be dropped anymore
+                item[2] = None
+                self.depth -= 1
+                wait:float = time.monotonic() - item[1]
+                self.processed += 1
+                self.total_wait += wait
+                self.max_wait = max(self.max_wait, wait)
+                while self.droppable_items and self.droppable_items[0][2] is None:
+                    self.droppable_items.popleft()
+            try:
+                func(*item[3])
+            except Exception as exc:
+                self.logger.error("Queue '"+self.name+"' : exception while handling a message : "+str(exc))
@@ -1,24 +1,38 @@
 __author__      = "Jérôme Cuq"
 
+import common
 import logging
 import random
 
 from paho.mqtt.reasoncodes import ReasonCode
 from .protocol_handler_base import *
 from .mqttclient import MQTTClient
+from .ingress_queue import IngressQueue
+from .topic_trie import TopicTrie
+
+# Default maximum number of topics in a SUBSCRIBE/UNSUBSCRIBE packet
+SUBSCRIBE_CHUNK_SIZE:int = 100
 
 class MQTTProtocolHandler(ProtocolHandlerBase):
 
     # Implementation of ProtocolHandlerBase class
 
-    def __init__(self, clients_config: list, callbacks: ProtocolHandlerCallbacks):
+    # loop : if set, network I/O of all clients is driven by this asyncio event loop (see MQTTClient.set_event_loop())
+    # ingress_queue : if set, {'max_size':int}, received messages are queued and the callbacks
+    #                 are called in order by a worker thread instead of network threads (not used with an event loop)
+    def __init__(self, clients_config: list, callbacks: ProtocolHandlerCallbacks, loop = None, ingress_queue:dict = None):
         self.logger: logging.Logger = logging.getLogger('hcs.mqtt')
         self.callbacks: ProtocolHandlerCallbacks = callbacks
         self.is_connected: bool = False
         self.mqttclients = {}
         self.mqtt_transport = 'websockets' # or 'tcp'
         self.mqtt_clientid = "HeatingControlServer-" + str(random.randint(10000,99999))
-        self.ha_status_subscriptions:list = []
+        # HA status topics, the value of each topic is the name of the client that subscribed to it
+        self.ha_status_topics:TopicTrie = TopicTrie()
+        self.ingress_queue:IngressQueue = None
+        if ingress_queue and not loop:
+            self.ingress_queue = IngressQueue(MQTTProtocolHandler.get_config_type(), ingress_queue['max_size'])
+            self.ingress_queue.start()
         for client_config in clients_config:
             name = client_config['name']
             mqtt_user = client_config['user']
@@ -27,8 +41,13 @@ class MQTTProtocolHandler(ProtocolHandlerBase):
             mqtt_port = client_config['port']
             mqtt_ssl = client_config['ssl']
             mqtt_cleansession = client_config['clean_session']
-            mqtt_client = MQTTClient(self.mqtt_clientid, mqtt_broker, mqtt_port, mqtt_user, mqtt_pwd, self.mqtt_transport, userdata=name, clean_session=mqtt_cleansession, ssl=mqtt_ssl)
+            mqtt_version = str(client_config.get('mqtt_version', '3'))
+            client_config['subscribe_chunk_size'] = common.toInt(client_config.get('subscribe_chunk_size', SUBSCRIBE_CHUNK_SIZE), self.logger,
+                                                                 "Invalid value in protocols.mqtt['"+name+"'].subscribe_chunk_size : ", SUBSCRIBE_CHUNK_SIZE, 1)
+            mqtt_client = MQTTClient(self.mqtt_clientid, mqtt_broker, mqtt_port, mqtt_user, mqtt_pwd, self.mqtt_transport, userdata=name, clean_session=mqtt_cleansession, ssl=mqtt_ssl, mqtt_version=mqtt_version)
             mqtt_client.set_callbacks(on_connect=self.__on_connect, on_disconnect=self.__on_disconnect, on_message=self.__on_message)
+            if loop:
+                mqtt_client.set_event_loop(loop)
             self.mqttclients[name] = (mqtt_client, client_config)
 
     def stop(self):
@@ -36,6 +55,8 @@ class MQTTProtocolHandler(ProtocolHandlerBase):
             client:MQTTClient = self.mqttclients[clientname][0]
             client.delete()
             self.logger.info("Interface '"+clientname+"' : destroyed")
+        if self.ingress_queue:
+            self.ingress_queue.stop()
 
     def get_config_type() -> str:
         return 'mqtt'
@@ -58,14 +79,17 @@ class MQTTProtocolHandler(ProtocolHandlerBase):
             client = self.mqttclients[clientname][0]
             if client.is_connected():
                 client.disconnect()
-                self.ha_status_subscriptions = []
+                self.ha_status_topics.clear()
                 self.logger.info("Interface '"+clientname+"' : disconnected")
 
     # protocol_params may be either:
-    #    { 'type': 'publish', 'topic': str_value, 'payload': str_value, 'qos': int, 'retain': bool }
+    #    { 'type': 'publish', 'topic': str_value, 'payload': str_value, 'qos': int, 'retain': bool,
+    #      'response_topic': str_value, 'correlation_data': bytes }
     # or { 'type': 'subscribe', 'topic': str_value, 'qos': int }
     # or { 'type': 'unsubscribe', 'topic': str_value }
-    # Note: 'retain' and 'qos' are optional
+    # Note: 'retain', 'qos', 'response_topic' and 'correlation_data' are optional
+    # Note: the 'topic' of a subscribe/unsubscribe may also be a list of topics, sent in as few packets as possible
+    #       (see 'subscribe_chunk_size' in client configuration)
     def send_message(self, client_name: str, protocol_params:dict):
         if client_name in self.mqttclients:
             client_tuple = self.mqttclients[client_name]
@@ -77,7 +101,9 @@ class MQTTProtocolHandler(ProtocolHandlerBase):
                     self.logger.debug("Interface '"+client_name+"' : Publishing '"+str(protocol_params['payload'])+"' to '"+protocol_params['topic']+"'")
                     if 'retain' in protocol_params: retain = protocol_params['retain']
                     else: retain = False
-                    client.publish(protocol_params['payload'], protocol_params['topic'], retain, qos=qos)
+                    client.publish(protocol_params['payload'], protocol_params['topic'], retain, qos=qos,
+                                   response_topic=protocol_params.get('response_topic', None),
+                                   correlation_data=protocol_params.get('correlation_data', None))
                 elif protocol_params['type']=='subscribe':
                     self.__subscribe(client, client_name, protocol_params['topic'], qos)
                 elif protocol_params['type']=='unsubscribe':
@@ -85,16 +111,43 @@ class MQTTProtocolHandler(ProtocolHandlerBase):
             else:
                 self.logger.debug("Interface '"+client_name+"' NOT CONNECTED : publish command ignored ('"+str(protocol_params['payload'])+"' on topic '"+protocol_params['topic']+"')")
     
+    def get_ingress_metrics(self) -> dict:
+        if self.ingress_queue:
+            return self.ingress_queue.get_metrics()
+        return None
+
     # END OF ProtocolHandlerBase implementation
 
     # Private methods
-    def __subscribe(self, client:MQTTClient, client_name:str, topic:str, qos:int):
-        self.logger.debug("Interface '"+client_name+"' : Subscribing to '"+topic+"'")
-        client.subscribe(topic, qos=qos)
 
-    def __unsubscribe(self, client:MQTTClient, client_name:str, topic:str):
-        self.logger.debug("Interface '"+client_name+"' : Unsubscribing to '"+topic+"'")
-        client.unsubscribe(topic)
+    # Call func(*args) directly, or through the ingress queue if any
+    def __dispatch(self, droppable:bool, func, *args):
+        if self.ingress_queue:
+            self.ingress_queue.put(droppable, func, *args)
+        else:
+            func(*args)
+
+    def __subscribe(self, client:MQTTClient, client_name:str, topic, qos:int):
+        if isinstance(topic, list):
+            for chunk in self.__get_topic_chunks(client_name, topic):
+                self.logger.debug("Interface '"+client_name+"' : Subscribing to "+str(len(chunk))+" topics")
+                client.subscribe(chunk, qos=qos)
+        else:
+            self.logger.debug("Interface '"+client_name+"' : Subscribing to '"+topic+"'")
+            client.subscribe(topic, qos=qos)
+
+    def __unsubscribe(self, client:MQTTClient, client_name:str, topic):
+        if isinstance(topic, list):
+            for chunk in self.__get_topic_chunks(client_name, topic):
+                self.logger.debug("Interface '"+client_name+"' : Unsubscribing to "+str(len(chunk))+" topics")
+                client.unsubscribe(chunk)
+        else:
+            self.logger.debug("Interface '"+client_name+"' : Unsubscribing to '"+topic+"'")
+            client.unsubscribe(topic)
+
+    def __get_topic_chunks(self, client_name:str, topics:list[str]) -> list[list[str]]:
+        chunk_size:int = self.mqttclients[client_name][1]['subscribe_chunk_size']
+        return [topics[idx:idx+chunk_size] for idx in range(0, len(topics), chunk_size)]
 
     def __get_mqttclient_name(self, mqtt_client) -> str:
         for item in self.mqttclients.items():
@@ -110,21 +163,23 @@ class MQTTProtocolHandler(ProtocolHandlerBase):
             pass
 
         # This message may be a server status change
-        for item in self.ha_status_subscriptions:
-            if client_name==item[0] and message.topic==item[1]:
-                self.callbacks.on_server_alive_for_client(MQTTProtocolHandler.get_config_type(), client_name, message.payload=='online')
+        for value, _ in self.ha_status_topics.match(message.topic):
+            if client_name==value:
+                self.__dispatch(False, self.callbacks.on_server_alive_for_client, MQTTProtocolHandler.get_config_type(), client_name, message.payload=='online')
                 return
-        
-        self.callbacks.on_protocol_message(MQTTProtocolHandler.get_config_type(), client_name, message)
+
+        # telemetry messages may be dropped if the ingress queue is full
+        droppable:bool = self.ingress_queue is not None and self.callbacks.is_droppable_message(MQTTProtocolHandler.get_config_type(), client_name, message)
+        self.__dispatch(droppable, self.callbacks.on_protocol_message, MQTTProtocolHandler.get_config_type(), client_name, message)
 
     def __on_connect(self, client:MQTTClient, client_name:str, connect_flags, reasoncode:ReasonCode, properties):
         if reasoncode.getName() != 'Success':
             self.logger.warning("["+client_name+"]: Not connected ! Return Code :" + str(reasoncode.getName()))
-            self.callbacks.on_protocol_disconnect(MQTTProtocolHandler.get_config_type(), client_name)
+            self.__dispatch(False, self.callbacks.on_protocol_disconnect, MQTTProtocolHandler.get_config_type(), client_name)
             self.is_connected = False
         else:
             self.logger.info("["+client_name+"]: Connected !")
-            self.callbacks.on_protocol_connect(MQTTProtocolHandler.get_config_type(), client_name)
+            self.__dispatch(False, self.callbacks.on_protocol_connect, MQTTProtocolHandler.get_config_type(), client_name)
             self.is_connected = True
             # We need to get HA status to change devices availability to False if HA goes offline
             if client_name in self.mqttclients:
@@ -133,10 +188,10 @@ class MQTTProtocolHandler(ProtocolHandlerBase):
                 if 'on_ha_status_topic' in client_tuple[1]:
                     topic = client_tuple[1]['on_ha_status_topic']
                     self.__subscribe(client, client_name, topic, 1)
-                    self.ha_status_subscriptions.append((client_name,topic))
+                    self.ha_status_topics.add(topic, client_name)
 
     def __on_disconnect(self, client:MQTTClient, client_name:str, disconnect_flags, reason_code:ReasonCode, properties):
         self.logger.info("["+client_name+"]: Disconnected with code: "+str(reason_code.getName()))
         self.is_connected = False
-        self.ha_status_subscriptions = []
-        self.callbacks.on_protocol_disconnect(MQTTProtocolHandler.get_config_type(), client_name)
+        self.ha_status_topics.clear()
+        self.__dispatch(False, self.callbacks.on_protocol_disconnect, MQTTProtocolHandler.get_config_type(), client_name)
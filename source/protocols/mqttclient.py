@@ -8,6 +8,7 @@ __author__      = "Jérôme Cuq"
          https://cedalo.com/blog/understanding-mqtt-qos/
 """
 
+import asyncio
 import paho.mqtt.client as mqtt
 from paho.mqtt.properties import Properties
 from paho.mqtt.packettypes import PacketTypes
@@ -15,7 +16,17 @@ from paho.mqtt.enums import CallbackAPIVersion
 
 from thread_base import ThreadBase
 
+# Delay (sec) between 2 connection attempts, and between 2 calls to paho loop_misc() in asyncio mode
+CONNECT_RETRY_SEC:int = 5
+LOOP_MISC_SEC:float = 1.
+# Expiry interval (sec) of published messages (MQTT v5 only)
+MESSAGE_EXPIRY_SEC:int = 30
+
 class MQTTClient:
+    # PUBLISH properties are read-only once built : they are shared by all publishes
+    # key is (mqtt version, message expiry interval), see get_publish_properties()
+    publish_properties:dict[tuple[str,int],Properties] = {}
+
     # If userdata is not provided (None), it will be set to current instance of MQTTClient on any callback calling
     def __init__(self, clientid, broker, port, user, pwd, transport = "websockets", userdata = None, clean_session=True, ssl = True, mqtt_version = '3'):
         self.clientid = clientid
@@ -27,6 +38,8 @@ class MQTTClient:
         self.protocol = None
         self.paho_client:mqtt.Client = None
         self.ssl = ssl
+        # tls can only be configured once in paho client
+        self.tls_configured:bool = False
         if userdata:
             self.userdata = userdata
         else:
@@ -47,7 +60,10 @@ class MQTTClient:
                 userdata=self.userdata,
                 callback_api_version=CallbackAPIVersion.VERSION2,
                 reconnect_on_failure=True)
+        self.default_publish_properties:Properties = MQTTClient.get_publish_properties(self.version, MESSAGE_EXPIRY_SEC)
         self.connect_thread: ThreadBase = ThreadBase()
+        # asyncio mode (see set_event_loop())
+        self.loop = None
 
     def delete(self):
         self.disconnect()
@@ -67,59 +83,194 @@ class MQTTClient:
         self.paho_client.on_publish = on_publish
         self.paho_client.on_connect_fail = on_connect_fail
 
+    # asyncio mode : network I/O is driven by the given event loop, through paho socket callbacks,
+    # instead of paho network thread. All paho callbacks are then called in the event loop.
+    # Must be called before connect()
+    def set_event_loop(self, loop):
+        self.loop = loop
+        self.socket_fd:int = None
+        self.misc_timer = None
+        self.connect_timer = None
+        self.connect_stopped:bool = False
+        self.paho_client.on_socket_open = self.__on_socket_open
+        self.paho_client.on_socket_close = self.__on_socket_close
+        self.paho_client.on_socket_register_write = self.__on_socket_register_write
+        self.paho_client.on_socket_unregister_write = self.__on_socket_unregister_write
+
     def connect(self):
-        self.connect_thread.start(self.__connect_thread)
+        if self.loop:
+            self.connect_stopped = False
+            self.loop.call_soon_threadsafe(self.__connect_in_loop)
+        else:
+            self.connect_thread.start(self.__connect_thread)
 
     def disconnect(self):
-        self.connect_thread.stop()
-        self.paho_client.loop_stop()
+        if self.loop:
+            self.connect_stopped = True
+            if self.connect_timer:
+                self.connect_timer.cancel()
+        else:
+            self.connect_thread.stop()
+            self.paho_client.loop_stop()
         self.paho_client.disconnect()
 
     def is_connected(self):
         return self.paho_client.is_connected()
 
+    # topic may be a topic, or a list of topics sent in a single SUBSCRIBE packet
     def subscribe(self, topic, qos=1):
-        self.paho_client.subscribe(topic, qos)
+        if isinstance(topic, list):
+            self.paho_client.subscribe([(item, qos) for item in topic])
+        else:
+            self.paho_client.subscribe(topic, qos)
 
+    # topic may be a topic, or a list of topics sent in a single UNSUBSCRIBE packet
     def unsubscribe(self, topic, qos=1):
         self.paho_client.unsubscribe(topic)
 
-    def publish(self, data, topic:str, retain:bool=False, qos=1) -> bool:
-        properties:Properties=Properties(PacketTypes.PUBLISH)
-        properties.MessageExpiryInterval=30 # in seconds
-        sendData = data
-        if isinstance(data,str):
-            sendData = bytearray(data, encoding="utf-8")
-        mi: mqtt.MQTTMessageInfo = self.paho_client.publish(topic, sendData, retain=retain, qos=qos, properties=properties)
+    # data may be a str (encoded in utf-8) or bytes, that are sent as is
+    # (callers that publish the same payload several times should encode it once)
+    # response_topic, correlation_data : MQTT v5 request/response properties (ignored with MQTT 3.1.1)
+    def publish(self, data, topic:str, retain:bool=False, qos=1, response_topic:str=None, correlation_data:bytes=None) -> bool:
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        properties:Properties = self.default_publish_properties
+        if properties is not None and response_topic:
+            properties = Properties(PacketTypes.PUBLISH)
+            properties.MessageExpiryInterval = MESSAGE_EXPIRY_SEC
+            properties.ResponseTopic = response_topic
+            if correlation_data is not None:
+                properties.CorrelationData = correlation_data
+        mi: mqtt.MQTTMessageInfo = self.paho_client.publish(topic, data, retain=retain, qos=qos, properties=properties)
         return mi.rc == mqtt.MQTT_ERR_SUCCESS
 
-    def __connect_thread(self):
+    # return the (shared) PUBLISH properties for given mqtt version and message expiry interval (sec)
+    # None for MQTT 3.1.1, that has no properties
+    def get_publish_properties(version:str, expiry:int) -> Properties:
+        if version != '5':
+            return None
+        properties:Properties = MQTTClient.publish_properties.get((version, expiry), None)
+        if properties is None:
+            properties = Properties(PacketTypes.PUBLISH)
+            properties.MessageExpiryInterval = expiry
+            MQTTClient.publish_properties[(version, expiry)] = properties
+        return properties
+
+    def __prepare_connection(self):
         self.paho_client.username_pw_set(self.user, self.pwd)
         # code for tls secured connection
-        if self.ssl:
+        if self.ssl and not self.tls_configured:
             self.paho_client.tls_set(certfile=None, keyfile=None)
+            self.tls_configured = True
+
+    # return True if the connection request has been sent to the broker
+    def __try_connect(self) -> bool:
+        try:
+            if self.version == '5':
+                properties:Properties=Properties(PacketTypes.CONNECT)
+                properties.SessionExpiryInterval=30*60 # in seconds
+                self.paho_client.connect(self.broker,
+                            port=self.port,
+                            clean_start=mqtt.MQTT_CLEAN_START_FIRST_ONLY,
+                            properties=properties,
+                            keepalive=60)
+            if self.version == '3':
+                self.paho_client.connect(self.broker,port=self.port,keepalive=60)
+            return True
+        except TimeoutError:
+            # Need to try again
+            pass
+        except Exception as exc:
+            pass
+        return False
 
+    def __connect_thread(self):
+        self.__prepare_connection()
         isAlive:bool = True
         while isAlive:
             if not self.is_connected():
-                try:
-                    if self.version == '5':
-                        properties:Properties=Properties(PacketTypes.CONNECT)
-                        properties.SessionExpiryInterval=30*60 # in seconds
-                        self.paho_client.connect(self.broker,
-                                    port=self.port,
-                                    clean_start=mqtt.MQTT_CLEAN_START_FIRST_ONLY,
-                                    properties=properties,
-                                    keepalive=60)
-                    if self.version == '3':
-                        self.paho_client.connect(self.broker,port=self.port,keepalive=60)
-                    
+                if self.__try_connect():
                     self.paho_client.loop_start()
                     return
-                
-                except TimeoutError:
-                    # Need to try again
-                    pass
-                except Exception as exc:
-                    pass
-            isAlive = self.connect_thread.wait(5)
\ No newline at end of file
+            isAlive = self.connect_thread.wait(CONNECT_RETRY_SEC)
+
+    ################################################################################
+    # asyncio mode
+    ################################################################################
+
+    # paho connect() is a blocking call : it is done in an executor thread
+    def __connect_in_loop(self):
+        self.connect_timer = None
+        if self.connect_stopped or self.is_connected():
+            return
+        self.__prepare_connection()
+        future = self.loop.run_in_executor(None, self.__try_connect)
+        future.add_done_callback(self.__on_connect_attempt)
+
+    def __on_connect_attempt(self, future):
+        if not future.result() and not self.connect_stopped:
+            self.connect_timer = self.loop.call_later(CONNECT_RETRY_SEC, self.__connect_in_loop)
+
+    # socket callbacks may be called by paho from any thread (connect() runs in an executor thread) :
+    # event loop changes are always done in the event loop, immediately if possible
+    # (the socket is closed by paho right after on_socket_close)
+    def __call_in_loop(self, func, *args):
+        try:
+            in_loop:bool = asyncio.get_running_loop() is self.loop
+        except RuntimeError:
+            in_loop = False
+        if in_loop:
+            func(*args)
+        else:
+            self.loop.call_soon_threadsafe(func, *args)
+
+    def __on_socket_open(self, paho_client, userdata, sock):
+        self.__call_in_loop(self.__add_socket, sock)
+
+    def __on_socket_close(self, paho_client, userdata, sock):
+        self.__call_in_loop(self.__remove_socket)
+
+    def __on_socket_register_write(self, paho_client, userdata, sock):
+        self.__call_in_loop(self.__add_socket_writer, sock)
+
+    def __on_socket_unregister_write(self, paho_client, userdata, sock):
+        self.__call_in_loop(self.__remove_socket_writer, sock)
+
+    def __add_socket(self, sock):
+        self.socket_fd = sock.fileno()
+        self.loop.add_reader(self.socket_fd, self.paho_client.loop_read)
+        self.misc_timer = self.loop.call_later(LOOP_MISC_SEC, self.__loop_misc)
+
+    def __remove_socket(self):
+        if self.socket_fd is not None:
+            try:
+                self.loop.remove_reader(self.socket_fd)
+                self.loop.remove_writer(self.socket_fd)
+            except OSError:
+                # the socket has already been closed
+                pass
+            self.socket_fd = None
+        if self.misc_timer:
+            self.misc_timer.cancel()
+            self.misc_timer = None
+        # The connection has been lost : we need to connect again
+        if not self.connect_stopped and not self.connect_timer:
+            self.connect_timer = self.loop.call_later(CONNECT_RETRY_SEC, self.__connect_in_loop)
+
+    def __add_socket_writer(self, sock):
+        if self.socket_fd is not None:
+            self.loop.add_writer(self.socket_fd, self.paho_client.loop_write)
+
+    def __remove_socket_writer(self, sock):
+        if self.socket_fd is not None:
+            try:
+                self.loop.remove_writer(self.socket_fd)
+            except OSError:
+                pass
+
+    # keepalive and retries handling
+    def __loop_misc(self):
+        if self.paho_client.loop_misc() == mqtt.MQTT_ERR_SUCCESS:
+            self.misc_timer = self.loop.call_later(LOOP_MISC_SEC, self.__loop_misc)
+        else:
+            self.misc_timer = None
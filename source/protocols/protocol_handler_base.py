@@ -23,4 +23,8 @@ class ProtocolHandlerBase:
 
     # protocol_params content depends on the protocol handler implementation
     def send_message(self, client_name: str, protocol_params:dict):
-        pass
\ No newline at end of file
+        pass
+
+    # return the metrics of the ingress queue (see IngressQueue.get_metrics()), or None if messages are not queued
+    def get_ingress_metrics(self) -> dict:
+        return None
\ No newline at end of file
@@ -12,4 +12,9 @@ class ProtocolHandlerCallbacks:
         pass
 
     def on_server_alive_for_client(self, protocol_type: str, client_name: str, is_alive:bool):
-        pass
\ No newline at end of file
+        pass
+
+    # return True if the message is telemetry, that may be dropped when messages are queued
+    # (only the latest values matter). Other messages (commands, states, setpoints) are never dropped.
+    def is_droppable_message(self, protocol_type: str, client_name: str, message) -> bool:
+        return False
\ No newline at end of file
@@ -8,19 +8,30 @@ from .mqttclient import MQTTClient
 # It instanciate one protocol handler for each protocol type.
 # Each protocol handler instanciate one connexion client per name declared in confguration file.
 class Protocols:
-    def __init__(self, config_protocols, callbacks: ProtocolHandlerCallbacks):
+    # loop : asyncio event loop that drives the network I/O of protocol clients (None for threads)
+    # ingress_queue : settings of the queue between network threads and callbacks (see Configuration.get_ingress_queue())
+    def __init__(self, config_protocols, callbacks: ProtocolHandlerCallbacks, loop = None, ingress_queue:dict = None):
         self.config_protocols: dict = config_protocols
         self.logger: logging.Logger = logging.getLogger('hcs.protocols')
         self.protocol_handlers: dict = {}
         # Only MQTT protocol is known so far
         MQTT = MQTTProtocolHandler.get_config_type()
         if MQTT in config_protocols:
-            self.protocol_handlers[MQTT] = MQTTProtocolHandler(config_protocols[MQTT], callbacks)
+            self.protocol_handlers[MQTT] = MQTTProtocolHandler(config_protocols[MQTT], callbacks, loop, ingress_queue)
 
     def stop(self):
         for handler in self.protocol_handlers.values():
             handler.stop()
 
+    # return the ingress queue metrics of each protocol handler that queues its messages
+    def get_ingress_metrics(self) -> dict[str,dict]:
+        result:dict[str,dict] = {}
+        for prot_type, handler in self.protocol_handlers.items():
+            metrics = handler.get_ingress_metrics()
+            if metrics:
+                result[prot_type] = metrics
+        return result
+
     def getProtocolTypes(self) -> list[str]:
         return self.protocol_handlers.keys()
 
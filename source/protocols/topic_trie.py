@@ -0,0 +1,78 @@
+__author__      = "Jérôme Cuq"
+
+import itertools
+
+
+class TopicTrieNode:
+    __slots__ = ('children', 'values')
+
+    def __init__(self):
+        # key is a topic level (or '+', or '#')
+        self.children:dict[str,TopicTrieNode] = {}
+        # (sequence, value) of the patterns ending at this node
+        self.values:list[tuple[int,any]] = []
+
+
+class TopicTrie:
+    """Topic filters (MQTT patterns, with '+' and '#' wildcards) organized in a tree of topic levels,
+       so that the filters matching a topic are found in a single walk of its levels.
+       A value is attached to each filter, several filters (or values) may match the same topic.
+       As in MQTT, wildcards at first level do not match topics starting with '$'.
+    """
+    def __init__(self):
+        self.root:TopicTrieNode = TopicTrieNode()
+        self.sequence = itertools.count()
+
+    def add(self, pattern:str, value:any):
+        node:TopicTrieNode = self.root
+        for level in pattern.split('/'):
+            child:TopicTrieNode = node.children.get(level, None)
+            if child is None:
+                child = TopicTrieNode()
+                node.children[level] = child
+            node = child
+        node.values.append((next(self.sequence), value))
+
+    # Remove a value of a pattern, return False if not found
+    def remove(self, pattern:str, value:any) -> bool:
+        node:TopicTrieNode = self.root
+        for level in pattern.split('/'):
+            node = node.children.get(level, None)
+            if node is None:
+                return False
+        for idx, item in enumerate(node.values):
+            if item[1] == value:
+                node.values.pop(idx)
+                return True
+        return False
+
+    def clear(self):
+        self.root = TopicTrieNode()
+
+    def match(self, topic:str) -> list[tuple[any,list[str]]]:
+        """return (value, captures) for each filter matching the topic, in the order filters were added.
+           captures are the topic levels matched by the wildcards of the filter : one level for each '+',
+           then the remaining levels for '#' (joined with '/', possibly empty)
+        """
+        levels:list[str] = topic.split('/')
+        result:list[tuple[int,any,list[str]]] = []
+        # nodes to visit : (node, index of next level, captures)
+        stack:list[tuple[TopicTrieNode,int,list[str]]] = [(self.root, 0, [])]
+        while stack:
+            node, idx, captures = stack.pop()
+            wildcards:bool = idx > 0 or not topic.startswith('$')
+            if wildcards and '#' in node.children:
+                # '#' also matches the parent level
+                for sequence, value in node.children['#'].values:
+                    result.append((sequence, value, captures + ['/'.join(levels[idx:])]))
+            if idx == len(levels):
+                for sequence, value in node.values:
+                    result.append((sequence, value, captures))
+                continue
+            child:TopicTrieNode = node.children.get(levels[idx], None)
+            if child is not None:
+                stack.append((child, idx+1, captures))
+            if wildcards and '+' in node.children:
+                stack.append((node.children['+'], idx+1, captures + [levels[idx]]))
+        result.sort(key=lambda item: item[0])
+        return [(value, captures) for _, value, captures in result]
@@ -5,17 +5,37 @@ import datetime
 import common
 import json
 import logging
+import threading
+import time
 import paho.mqtt.client as mqtt
 from device import Device
 from protocols.mqttclient import MQTTClient
-from thread_base import ThreadBase
+from timer_service import Timer, TimerService
 from .remote_client_base import RemoteClientBase
 from .remote_control_callbacks import RemoteControlCallbacks
 from errors import *
 
 
+class PublishedDeviceState:
+    """What has been published of a device state, for telemetry coalescing
+    """
+    __slots__ = ('current_temperature', 'date', 'flush_date', 'flush_timer')
+
+    def __init__(self, current_temperature:float, date:float):
+        self.current_temperature:float = current_temperature
+        # time.monotonic() date of the publish
+        self.date:float = date
+        # time.monotonic() date of the pending publish, if any
+        self.flush_date:float = None
+        self.flush_timer:Timer = None
+
+
 class MQTTRemoteClient(RemoteClientBase):
-    def __init__(self, remote_name, config_remote_client, client: object, devices: dict[str, Device], available_devices: dict[str, Device], server_version:str, callbacks: RemoteControlCallbacks):
+    # Maximum duration of a forecast window asked by a remote client
+    MAX_FORECAST_DURATION:datetime.timedelta = datetime.timedelta(days=31)
+
+    def __init__(self, remote_name, config_remote_client, client: object, devices: dict[str, Device], available_devices: dict[str, Device], server_version:str, callbacks: RemoteControlCallbacks,
+                 timer_service:TimerService = None):
         self.logger = logging.getLogger('hcs.mqttremoteclient')
         self.config_remote_client = config_remote_client
         # list of devices declared in configuration file
@@ -54,13 +74,45 @@ class MQTTRemoteClient(RemoteClientBase):
         self.is_alive_period = common.toInt(params['is_alive_period'], self.logger, default=-1)
         if self.is_alive_period == -1:
             raise CfgError(ECfgError.BAD_VALUE, '/remote_control/protocol/params', 'is_alive_period', {'value': params['is_alive_period']}, self.logger)
-        self.is_alive_thread: ThreadBase = ThreadBase()
+        # shared timer service the is alive ping is registered in (a private one is started if None)
+        self.own_timer_service:bool = timer_service is None
+        self.timer_service:TimerService = TimerService() if self.own_timer_service else timer_service
+        self.is_alive_timer:Timer = None
+
+        # (OPTIONAL) coalescing of device state publishes caused by current temperature changes
+        self.coalescing:bool = 'telemetry_coalescing' in params
+        if self.coalescing:
+            coalescing:dict = params['telemetry_coalescing'] if params['telemetry_coalescing'] else {}
+            values:dict[str,float] = {}
+            for key, default in (('min_interval_sec', 10.), ('max_staleness_sec', 300.), ('deadband', 0.)):
+                values[key] = common.toFloat(coalescing.get(key, default), self.logger, default=-1.)
+                if values[key] < 0.:
+                    raise CfgError(ECfgError.BAD_VALUE, '/remote_control/protocol/params/telemetry_coalescing', key, {'value': coalescing.get(key)}, self.logger)
+            self.min_interval_sec:float = values['min_interval_sec']
+            self.max_staleness_sec:float = max(values['max_staleness_sec'], self.min_interval_sec)
+            self.deadband:float = values['deadband']
+        self.lock = threading.Lock()
+        # key is device name
+        self.published_states:dict[str,PublishedDeviceState] = {}
 
     def start(self):
-        self.is_alive_thread.start(self.__is_alive_thread)
+        if self.own_timer_service:
+            self.timer_service.start()
+        if not self.is_alive_timer:
+            self.logger.info('mqtt "server is alive" ping started')
+            self.is_alive_timer = self.timer_service.call_periodic(self.is_alive_period, self.on_server_alive, True)
 
     def stop(self):
-        self.is_alive_thread.stop()
+        if self.is_alive_timer:
+            self.is_alive_timer.cancel()
+            self.is_alive_timer = None
+            self.logger.info('mqtt "server is alive" ping has stopped')
+        with self.lock:
+            for state in self.published_states.values():
+                self.timer_service.cancel(state.flush_timer)
+            self.published_states.clear()
+        if self.own_timer_service:
+            self.timer_service.stop()
 
     def get_name(self) -> str:
         return self.remote_name
@@ -239,6 +291,15 @@ class MQTTRemoteClient(RemoteClientBase):
                         elif command == 'set_schedules_order' and not (err:=self.__check_type(command, params, list)):
                             self.callbacks.set_schedules_order(self.remote_name, params, context)
                         
+                        elif command == 'get_forecast' and not (err:=self.__check_dico(command, params, ['start', 'end'])):
+                            err = self.__send_forecast(command, params['start'], params['end'], context)
+
+                        elif command == 'get_stats' and not (err:=self.__check_type(command, params, dict)):
+                            self.on_server_response(context, 'success', data=self.callbacks.get_stats())
+
+                        elif command == 'evaluate_schedules' and not (err:=self.__check_dico(command, params, ['schedules'])):
+                            self.callbacks.evaluate_schedules(self.remote_name, params, context)
+                        
                         else:
                             if not err:
                                 err = CfgError(ECfgError.BAD_VALUE, message.topic, None, {"value":'command: '+command}, self.logger)
@@ -262,7 +323,14 @@ class MQTTRemoteClient(RemoteClientBase):
              "state": str(device.available).lower(),
              "min_temp": device.min_temperature,
              "max_temp": device.max_temperature,
-             }, default=str)
+             }, default=str).encode('utf-8')
+        if self.coalescing:
+            # this publish contains any pending change
+            with self.lock:
+                state:PublishedDeviceState = self.published_states.get(device.name, None)
+                if state:
+                    self.timer_service.cancel(state.flush_timer)
+                self.published_states[device.name] = PublishedDeviceState(device.current_temperature, time.monotonic())
         self.client.publish(data_json, topic, retain=True, qos=1)
 
     def __remove_device_topic(self, mqttid:str):
@@ -275,8 +343,39 @@ class MQTTRemoteClient(RemoteClientBase):
     def on_device_state(self, device:Device, available: bool):
         self.send_device_data(device)
 
+    # With telemetry coalescing, a current temperature change is published :
+    # - at least min_interval_sec after previous publish of the device state,
+    # - at most max_staleness_sec after previous publish, if the change is within the deadband
+    # Changes received in the meantime are merged in a single publish
     def on_device_current_temperature(self, device:Device, value: float):
-        self.send_device_data(device)
+        if not self.coalescing:
+            self.send_device_data(device)
+            return
+        publish:bool = False
+        now:float = time.monotonic()
+        with self.lock:
+            state:PublishedDeviceState = self.published_states.get(device.name, None)
+            if state is None:
+                publish = True
+            elif value != state.current_temperature:
+                if abs(value - state.current_temperature) > self.deadband:
+                    flush_date:float = state.date + self.min_interval_sec
+                else:
+                    flush_date:float = state.date + self.max_staleness_sec
+                if flush_date <= now:
+                    publish = True
+                elif state.flush_date is None or flush_date < state.flush_date:
+                    self.timer_service.cancel(state.flush_timer)
+                    state.flush_date = flush_date
+                    state.flush_timer = self.timer_service.call_later(flush_date-now, self.__flush_device_data, device.name)
+        if publish:
+            self.send_device_data(device)
+
+    def __flush_device_data(self, device_name:str):
+        # the device may have been deleted in the meantime
+        device:Device = self.devices.get(device_name, None)
+        if device:
+            self.send_device_data(device)
 
     def on_device_min_temperature(self, device:Device, value:float):
         self.send_device_data(device)
@@ -287,20 +386,35 @@ class MQTTRemoteClient(RemoteClientBase):
     def on_device_setpoint(self, device:Device):
         self.send_device_data(device)
 
-    def on_server_response(self, context:any, status: str, error: dict = None):
+    def on_server_response(self, context:any, status: str, error: dict = None, data: any = None):
         topic = self.send_command_response_topic
+        response:dict = {'cmd':context, 'status': status}
         if error:
-            data_json = json.dumps({'cmd':context, 'status': status, 'error': error}, default=str)
-        else:
-            data_json = json.dumps({'cmd':context, 'status': status}, default=str)
+            response['error'] = error
+        if data is not None:
+            response['data'] = data
+        data_json = json.dumps(response, default=str)
         self.client.publish(data_json, topic, retain=False, qos=1)
 
-    # Thread that sends is alive ping
-    def __is_alive_thread(self):
-        self.logger.info('mqtt "server is alive" thread started')
-        while self.is_alive_thread.wait(self.is_alive_period):
-            self.on_server_alive(True)
-        self.logger.info('mqtt "server is alive" thread has stopped')
+    # Send the setpoints forecast of all devices between 'start' and 'end' dates (ISO 8601 strings)
+    # return None if no error
+    def __send_forecast(self, command:str, start:str, end:str, context:any) -> CfgError:
+        dates:list[datetime.datetime] = []
+        for value in (start, end):
+            try:
+                date_ = datetime.datetime.fromisoformat(str(value))
+            except ValueError:
+                return CfgError(ECfgError.BAD_VALUE, command, None, {"value":str(value)}, self.logger)
+            if date_.tzinfo:
+                # Scheduler works with local naive dates
+                date_ = date_.astimezone().replace(tzinfo=None)
+            dates.append(date_)
+        if dates[1] <= dates[0] or dates[1]-dates[0] > MQTTRemoteClient.MAX_FORECAST_DURATION:
+            return CfgError(ECfgError.BAD_VALUE, command, None, {"value":str(start)+' -> '+str(end)}, self.logger)
+        forecast = self.callbacks.get_forecast(dates[0], dates[1])
+        data:dict = {name: [[date_.isoformat(), setpoint] for date_, setpoint in changes] for name, changes in forecast.items()}
+        self.on_server_response(context, 'success', data=data)
+        return None
 
     # Check that all keys in 'entries' are present in 'data'
     # return None if no error
@@ -5,6 +5,7 @@ from .remote_control_callbacks import RemoteControlCallbacks
 from .mqtt_remote_client import MQTTRemoteClient
 from .remote_client_base import RemoteClientBase
 from protocols.mqtt_protocol_handler import MQTTProtocolHandler
+from timer_service import TimerService
 
 import logging
 
@@ -12,7 +13,7 @@ import logging
 class RemoteControl:
     def __init__(self,
         config_remote_control, devices: dict[str,Device], available_devices: dict[str, Device],
-        server_version:str, callbacks:RemoteControlCallbacks):
+        server_version:str, callbacks:RemoteControlCallbacks, timer_service:TimerService = None):
         """
         :param config_remote_control: _description_
         :type config_remote_control: _type_
@@ -20,6 +21,8 @@ class RemoteControl:
         :type devices: dict[str,Device]
         :param callbacks: _description_
         :type callbacks: RemoteControlCallbacks
+        :param timer_service: shared timer service for periodic tasks of remote clients
+        :type timer_service: TimerService
         :raises CfgError: in case of error in protocol settings
         """
         self.logger: logging.Logger = logging.getLogger('hcs.remotecontrol')
@@ -33,7 +36,7 @@ class RemoteControl:
             # Only MQTT protocol is known so far
             if protocol_type == MQTTProtocolHandler.get_config_type():
                 remote = MQTTRemoteClient(remote_name, config_remote, callbacks.get_client_by_name(client_name),
-                                          devices, available_devices, server_version, callbacks)
+                                          devices, available_devices, server_version, callbacks, timer_service)
             else:
                 self.logger.error("Invalid configuration for remote_control '"+protocol_type+"': unknown protocol type '"+protocol_type+"'")
                 return
@@ -114,7 +117,7 @@ class RemoteControl:
         for remote in self.remotes.values():
             remote.on_available_devices(devices)
 
-    def on_server_response(self, remote_name:str, context:any, status:str, error:dict=None):
+    def on_server_response(self, remote_name:str, context:any, status:str, error:dict=None, data:any=None):
         self.logger.info("Sending server response to remote '"+remote_name+"' : status="+status+", cmd="+context+(", error="+str(error) if error else ""));
         if remote_name in self.remotes:
-            self.remotes[remote_name].on_server_response(context, status, error)
\ No newline at end of file
+            self.remotes[remote_name].on_server_response(context, status, error, data)
\ No newline at end of file
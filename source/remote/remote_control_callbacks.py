@@ -1,5 +1,6 @@
 __author__      = "Jérôme Cuq"
 
+import datetime
 from device import Device
 
 class RemoteControlCallbacks:
@@ -16,6 +17,21 @@ class RemoteControlCallbacks:
     def get_scheduler_config(self) -> dict:
         pass
 
+    # return dict of [device_name, list of (date, setpoint)] : see Scheduler.forecast()
+    def get_forecast(self, start:datetime.datetime, end:datetime.datetime) -> dict[str,list[tuple[datetime.datetime,float]]]:
+        pass
+
+    # return the runtime statistics of the server : {'repeater': {'outstanding':int, 'retried':int, 'abandoned':int},
+    #                                               'acknowledge': {device_name: {'count':int, 'mean':float, 'max':float}}}
+    # (see CommandRepeater.get_stats() and CommandRepeater.get_ack_stats())
+    def get_stats(self) -> dict:
+        pass
+
+    # params : {'schedules':list[dict], 'year':int (optional), 'heating_threshold':float (optional)}
+    # the response data is the yearly stats of each candidate schedule : see ScheduleEvaluator.evaluate()
+    def evaluate_schedules(self, remote_name:str, params:dict, context:any):
+        pass
+
     def set_devices_order(self, remote_name:str, device_names:list, context:any):
         pass
 
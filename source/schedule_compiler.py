@@ -0,0 +1,168 @@
+__author__      = "Jérôme Cuq"
+
+import datetime
+from config_snapshot import FrozenDict
+from schedule_timeline import *
+
+class ScheduleCompiler:
+    """Builds the ScheduleTimeline of any schedule of a scheduler configuration.
+       Temperature sets are resolved once per schedule (with inheritance applied) and kept
+       in a table until reset() is called, so the configuration must not change in between.
+    """
+    def __init__(self, config_scheduler:dict):
+        self.reset(config_scheduler)
+
+    # Must be called each time the scheduler configuration changes
+    def reset(self, config_scheduler:dict):
+        self.config_scheduler:dict = config_scheduler
+        # key is (schedule_alias, tempset_alias, device_name)
+        self.tempsets_table:dict[tuple[str,str,str],float] = {}
+        # aliases of schedules already resolved in tempsets_table
+        self.tempsets_table_schedules:set[str] = set()
+
+    # Must be called when only some schedules of the configuration have changed (or have been renamed) :
+    # the temperature sets of other schedules stay resolved
+    # note : a change in global temperature sets requires a call to reset()
+    def invalidate(self, config_scheduler:dict, schedule_aliases:set[str]):
+        self.config_scheduler = config_scheduler
+        self.tempsets_table_schedules -= schedule_aliases
+        for key in [key for key in self.tempsets_table if key[0] in schedule_aliases]:
+            self.tempsets_table.pop(key)
+
+    # Must be called each time the scheduler configuration changes, when the new configuration
+    # is frozen (see config_snapshot.freeze()) : only the schedules that are not shared with
+    # the previous configuration are invalidated
+    def set_config(self, config_scheduler:FrozenDict):
+        previous:dict = self.config_scheduler
+        if not isinstance(previous, FrozenDict) or previous.get('temperature_sets', None) is not config_scheduler.get('temperature_sets', None):
+            self.reset(config_scheduler)
+        else:
+            previous_schedules:dict[str,dict] = {schedule['alias']:schedule for schedule in previous['schedules']}
+            schedules:dict[str,dict] = {schedule['alias']:schedule for schedule in config_scheduler['schedules']}
+            changed:set[str] = set(alias for alias in previous_schedules if schedules.get(alias, None) is not previous_schedules[alias])
+            changed |= set(alias for alias in schedules if previous_schedules.get(alias, None) is not schedules[alias])
+            self.invalidate(config_scheduler, changed)
+
+    def get_schedule(self, alias:str) -> dict:
+        if 'schedules' in self.config_scheduler:
+            all_schedules = self.config_scheduler['schedules']
+            for schedule in all_schedules:
+                if schedule['alias'] == alias:
+                    return schedule
+        return None
+
+    # return the aliases of the given schedule and of all schedules it inherits from (closest first)
+    def get_schedules_tree_aliases(self, alias:str) -> list[str]:
+        result:list[str] = []
+        schedule:dict = self.get_schedule(alias) if alias else None
+        while schedule and not schedule['alias'] in result:
+            result.append(schedule['alias'])
+            schedule = self.get_schedule(schedule['parent_schedule']) if 'parent_schedule' in schedule else None
+        return result
+
+    # Build the timeline of given schedule :
+    # for each device, the inheritance tree of the schedule is flattened into
+    # sorted breakpoints over a whole week A and a whole week B
+    # If device_names is given, only these devices are compiled
+    def compile(self, schedule_alias:str, device_names:set[str] = None) -> ScheduleTimeline:
+        if not schedule_alias:
+            return ScheduleTimeline(None, {})
+
+        # layers[device_name][week_idx][weekday] is the list of (offset, value) lists to merge,
+        # one per schedule in the inheritance tree, closest schedule first
+        layers:dict[str,list[list[list]]] = {}
+        for alias in self.get_schedules_tree_aliases(schedule_alias):
+            schedule:dict = self.get_schedule(alias)
+            for schedule_item in schedule['schedule_items']:
+                for week_idx in (WEEK_A, WEEK_B):
+                    for weekday in range(7):
+                        timeslots = ScheduleCompiler.__find_day_timeslots(schedule_item['timeslots_sets'], weekday, week_idx)
+                        segments = ScheduleTimeline.get_day_segments(timeslots)
+                        for device_name in schedule_item['devices']:
+                            if device_names is not None and not device_name in device_names:
+                                continue
+                            layer:list = [(offset, self.__get_timeslot_value(schedule, device_name, timeslot)) for offset, timeslot in segments]
+                            if len(layer)==0:
+                                layer = [(0, None)]
+                            if not device_name in layers:
+                                layers[device_name] = [[[] for _ in range(7)] for _ in (WEEK_A, WEEK_B)]
+                            layers[device_name][week_idx][weekday].append(layer)
+
+        devices:dict[str,DeviceTimeline] = {}
+        for device_name, device_layers in layers.items():
+            weeks:list = []
+            for week_idx in (WEEK_A, WEEK_B):
+                offsets:list[int] = []
+                values:list[tuple[float,datetime.time]] = []
+                for weekday in range(7):
+                    for offset, value in ScheduleTimeline.merge_layers(device_layers[week_idx][weekday]):
+                        if len(values)==0 or values[-1] != value:
+                            offsets.append(weekday*DAY_US + offset)
+                            values.append(value)
+                weeks.append((offsets, values))
+            devices[device_name] = DeviceTimeline(tuple(weeks))
+        return ScheduleTimeline(schedule_alias, devices)
+
+    ################################################################################
+    # PRIVATE STATIC METHODS
+    ################################################################################
+
+    # return the setpoints of all devices in the temperature set 'tempset_alias', with inheritance applied.
+    # temp_sets is the ordered list of temperature sets to search in (local sets first, then global sets) :
+    # for each device, the first setpoint found wins, a set being followed by the set it inherits from ('parent').
+    # 'visited' contains the ids of the sets being resolved, to avoid infinite recursion
+    def __flatten_tempset(temp_sets:list[dict], tempset_alias:str, visited:set = set()) -> dict[str,float]:
+        result:dict[str,float] = {}
+        for temp_set in temp_sets:
+            if temp_set['alias'] == tempset_alias and not id(temp_set) in visited:
+                for device_temp in temp_set['devices']:
+                    result.setdefault(device_temp['device_name'], device_temp['setpoint'])
+                # we need to add the setpoints of the set that this set inherits from
+                if ('parent' in temp_set) and temp_set['parent']:
+                    parent_setpoints = ScheduleCompiler.__flatten_tempset(temp_sets, temp_set['parent'], visited | {id(temp_set)})
+                    for device_name, setpoint in parent_setpoints.items():
+                        result.setdefault(device_name, setpoint)
+        return result
+
+    # return the timeslots that apply to the given week day (0=monday) and week (WEEK_A or WEEK_B),
+    # or None if no timeslots set applies to this day
+    def __find_day_timeslots(timeslots_sets:list[dict], weekday:int, week_idx:int) -> list[dict]:
+        target_weekday = str(weekday+1)
+        for timeslots_set in timeslots_sets:
+            if target_weekday in timeslots_set['dates']:
+                # if a week filter (A/B) has been set, we need to use the timeslots of target week
+                week_key = 'timeslots'
+                if 'timeslots_A' in timeslots_set:
+                    week_key = 'timeslots_A' if week_idx==WEEK_A else 'timeslots_B'
+                return timeslots_set[week_key]
+        return None
+
+    ################################################################################
+    # PRIVATE METHODS
+    ################################################################################
+
+    # return (setpoint, timeslot_start_time) for a device in a timeslot of given schedule,
+    # or None if the temperature set of the timeslot has no setpoint for this device
+    def __get_timeslot_value(self, schedule, device_name, timeslot) -> tuple[float,datetime.time]:
+        setpoint:float = self.__get_setpoint(schedule, device_name, timeslot)
+        if setpoint != None:
+            return (setpoint, timeslot['start_time'])
+        return None
+
+    # Add to tempsets_table the setpoints of all temperature sets that are visible from given schedule
+    def __resolve_schedule_tempsets(self, schedule:dict):
+        temp_sets:list[dict] = []
+        if 'temperature_sets' in schedule:
+            temp_sets.extend(schedule['temperature_sets'])
+        if 'temperature_sets' in self.config_scheduler:
+            temp_sets.extend(self.config_scheduler['temperature_sets'])
+        for tempset_alias in set(temp_set['alias'] for temp_set in temp_sets):
+            for device_name, setpoint in ScheduleCompiler.__flatten_tempset(temp_sets, tempset_alias).items():
+                self.tempsets_table[(schedule['alias'], tempset_alias, device_name)] = setpoint
+        self.tempsets_table_schedules.add(schedule['alias'])
+
+    def __get_setpoint(self, schedule, device_name, timeslot) -> float:
+        if not schedule['alias'] in self.tempsets_table_schedules:
+            self.__resolve_schedule_tempsets(schedule)
+        # We must get the setpoint for this device in temperature sets
+        return self.tempsets_table.get((schedule['alias'], timeslot['temperature_set'], device_name), None)
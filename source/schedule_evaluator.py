@@ -0,0 +1,154 @@
+__author__      = "Jérôme Cuq"
+
+import datetime
+from configuration import Configuration
+from errors import CfgError
+from schedule_compiler import ScheduleCompiler
+from schedule_timeline import *
+
+# numpy is an optional dependency : it is only needed by the schedule evaluator
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+MINUTE_US:int = 60*1000000
+DAY_MINUTES:int = 24*60
+WEEK_MINUTES:int = 7*DAY_MINUTES
+
+class ScheduleEvaluator:
+    """What-if evaluation of candidate schedules over a whole year, before they are pushed with set_schedule.
+       Setpoints are sampled once per minute, from the compiled timeline of each candidate schedule,
+       instead of calling Scheduler.get_setpoints() for each minute of the year :
+       - the setpoints of all devices are computed once for each minute of a week A and a week B,
+       - vectorized week A/B and week day masks map each minute of the year to a minute of week A or B,
+         so that yearly stats are weighted sums over the 2 weeks.
+       Candidate schedules are checked by Configuration.check_schedule(), as set_schedule() would do.
+       note : this class requires numpy
+    """
+    def __init__(self, configuration:Configuration, year:int = None):
+        """
+        :param configuration: configuration the candidate schedules are evaluated in
+                              (parent schedules and temperature sets are searched in its scheduler configuration)
+        :type configuration: Configuration
+        :param year: year to evaluate, current year if None
+        :type year: int
+        """
+        if np is None:
+            raise ImportError("ScheduleEvaluator requires numpy (pip install numpy)")
+        self.configuration:Configuration = configuration
+        self.year:int = year if year else datetime.date.today().year
+        # For each minute of the year : index of the minute in week A + week B samples
+        self.sample_indexes = ScheduleEvaluator.__get_year_samples(self.year)
+        # For each minute of week A + week B : number of occurrences in the year
+        self.sample_weights = np.bincount(self.sample_indexes, minlength=2*WEEK_MINUTES)
+        # Offset in week (us) of each minute of a week
+        self.week_offsets = np.arange(WEEK_MINUTES, dtype=np.int64)*MINUTE_US
+
+    def evaluate(self, schedules:list[dict], heating_threshold:float = None) -> tuple[CfgError, list[dict[str,dict[str,float]]]]:
+        """Compute the yearly stats of each device in each candidate schedule.
+
+        :param schedules: candidate schedules, in configuration format (see Configuration.set_schedule()).
+                          Each candidate is evaluated on its own, as if it replaced (or was added to)
+                          the schedule with the same alias in the scheduler configuration.
+        :type schedules: list[dict]
+        :param heating_threshold: if set, only the minutes with a setpoint above this value are counted in heating hours,
+                                  otherwise all minutes with a scheduled setpoint are counted
+        :type heating_threshold: float
+        :return: (None, stats) where stats is, for each candidate schedule (same order), a dict of stats per device name :
+                 {'heating_hours':float, 'mean_setpoint':float, 'min_setpoint':float, 'max_setpoint':float}
+                 setpoint stats are None for a device that has no scheduled setpoint in the whole year.
+                 (CfgError, None) if a candidate schedule is invalid
+        :rtype: tuple[CfgError, list[dict[str,dict[str,float]]]]
+        """
+        timelines:list[ScheduleTimeline] = []
+        for schedule in schedules:
+            cfgErr, timeline = self.__compile(schedule)
+            if cfgErr:
+                return (cfgErr, None)
+            timelines.append(timeline)
+        result:list[dict[str,dict[str,float]]] = []
+        for timeline in timelines:
+            device_names, samples = self.__get_week_samples(timeline)
+            # samples that never occur in the year (week A or B may be missing) must be ignored
+            scheduled = ~np.isnan(samples) & (self.sample_weights > 0)
+            counts = np.where(scheduled, self.sample_weights, 0).sum(axis=1)
+            sums = (np.where(scheduled, samples, 0.)*self.sample_weights).sum(axis=1)
+            mins = np.where(scheduled, samples, np.inf).min(axis=1, initial=np.inf)
+            maxs = np.where(scheduled, samples, -np.inf).max(axis=1, initial=-np.inf)
+            if heating_threshold is None:
+                heating_minutes = counts
+            else:
+                heating_minutes = np.where(scheduled & (samples > heating_threshold), self.sample_weights, 0).sum(axis=1)
+            stats:dict[str,dict[str,float]] = {}
+            for idx, name in enumerate(device_names):
+                has_setpoint:bool = counts[idx] > 0
+                stats[name] = {'heating_hours': float(heating_minutes[idx])/60.,
+                               'mean_setpoint': float(sums[idx]/counts[idx]) if has_setpoint else None,
+                               'min_setpoint': float(mins[idx]) if has_setpoint else None,
+                               'max_setpoint': float(maxs[idx]) if has_setpoint else None}
+            result.append(stats)
+        return (None, result)
+
+    def get_setpoints_array(self, schedule:dict) -> tuple[CfgError, list[str], 'np.ndarray']:
+        """return (None, device_names, setpoints) where setpoints is a (devices x minutes of year) array,
+           setpoints[i][m] being the setpoint of device_names[i] at minute m (NaN if no setpoint is scheduled),
+           or (CfgError, None, None) if the schedule is invalid
+        """
+        cfgErr, timeline = self.__compile(schedule)
+        if cfgErr:
+            return (cfgErr, None, None)
+        device_names, samples = self.__get_week_samples(timeline)
+        return (None, device_names, samples[:, self.sample_indexes])
+
+    ################################################################################
+    # PRIVATE STATIC METHODS
+    ################################################################################
+
+    # return, for each minute of the year, its index in week A + week B samples :
+    # week_idx*WEEK_MINUTES + minute in week, with week_idx = WEEK_A for even ISO week numbers
+    # and WEEK_B for odd ones (see get_week_index())
+    def __get_year_samples(year:int) -> 'np.ndarray':
+        first_day:int = datetime.date(year, 1, 1).toordinal()
+        days = np.arange(first_day, datetime.date(year+1, 1, 1).toordinal(), dtype=np.int64)
+        # date.fromordinal(1) is a monday
+        weekdays = (days-1)%7
+        # ISO week number is given by the position of the thursday of the week in its own year
+        thursdays = days - weekdays + 3
+        year_starts = np.where(thursdays < first_day, datetime.date(year-1, 1, 1).toordinal(),
+                               np.where(thursdays >= datetime.date(year+1, 1, 1).toordinal(),
+                                        datetime.date(year+1, 1, 1).toordinal(), first_day))
+        week_numbers = (thursdays-year_starts)//7 + 1
+        week_indexes = np.where(week_numbers%2==0, WEEK_A, WEEK_B)
+
+        day_samples = week_indexes*WEEK_MINUTES + weekdays*DAY_MINUTES
+        return (np.repeat(day_samples, DAY_MINUTES) + np.tile(np.arange(DAY_MINUTES, dtype=np.int64), len(days)))
+
+    ################################################################################
+    # PRIVATE METHODS
+    ################################################################################
+
+    # return (device_names, samples) where samples is a (devices x 2*WEEK_MINUTES) array :
+    # the setpoint of each device for each minute of week A then week B (NaN if no setpoint is scheduled)
+    def __get_week_samples(self, timeline:ScheduleTimeline) -> tuple[list[str], 'np.ndarray']:
+        device_names:list[str] = list(timeline.devices)
+        samples = np.empty((len(device_names), 2*WEEK_MINUTES), dtype=np.float64)
+        for idx, name in enumerate(device_names):
+            for week_idx in (WEEK_A, WEEK_B):
+                offsets, values = timeline.devices[name].weeks[week_idx]
+                # one setpoint per breakpoint, then the breakpoint that applies to each minute
+                setpoints = np.array([value[0] if value else np.nan for value in values], dtype=np.float64)
+                positions = np.searchsorted(np.array(offsets, dtype=np.int64), self.week_offsets, side='right')-1
+                samples[idx, week_idx*WEEK_MINUTES:(week_idx+1)*WEEK_MINUTES] = setpoints[positions]
+        return (device_names, samples)
+
+    # return (None, timeline) of given schedule, as if it was in scheduler configuration, or (CfgError, None) if it is invalid
+    def __compile(self, schedule:dict) -> tuple[CfgError, ScheduleTimeline]:
+        # start times are converted to datetime.time in the checked copy
+        cfgErr, schedule = self.configuration.check_schedule(schedule)
+        if cfgErr:
+            return (cfgErr, None)
+        config_scheduler:dict = dict(self.configuration.get_snapshot().scheduler)
+        config_scheduler['schedules'] = [item for item in config_scheduler.get('schedules', []) if item['alias'] != schedule['alias']]
+        config_scheduler['schedules'].append(schedule)
+        return (None, ScheduleCompiler(config_scheduler).compile(schedule['alias']))
@@ -0,0 +1,177 @@
+__author__      = "Jérôme Cuq"
+
+import bisect
+import datetime
+
+# All offsets in a timeline are expressed in microseconds since monday 00:00:00.
+# Timeslot start times may carry seconds (and even microseconds), so minutes are not precise enough.
+DAY_US:int = 24*3600*1000000
+WEEK_US:int = 7*DAY_US
+
+# Index of the week in a timeline :
+# - WEEK_A for even ISO week numbers (uses 'timeslots_A' in timeslots sets)
+# - WEEK_B for odd ISO week numbers (uses 'timeslots_B' in timeslots sets)
+WEEK_A:int = 0
+WEEK_B:int = 1
+
+def get_week_index(date_:datetime.datetime) -> int:
+    return WEEK_A if date_.isocalendar()[1]%2==0 else WEEK_B
+
+def get_time_offset(time_:datetime.time) -> int:
+    return ((time_.hour*60 + time_.minute)*60 + time_.second)*1000000 + time_.microsecond
+
+def get_week_offset(date_:datetime.datetime) -> int:
+    return date_.weekday()*DAY_US + get_time_offset(date_.time())
+
+
+class DeviceTimeline:
+    """Sorted breakpoints of one device over a whole week A and a whole week B.
+       For each week, values[i] applies from offsets[i] (included) to offsets[i+1] (excluded).
+       A value is either None (no scheduled setpoint) or a tuple (setpoint, timeslot_start_time).
+       The first offset of each week is always 0.
+    """
+    def __init__(self, weeks:tuple[tuple[list[int],list[tuple[float,datetime.time]]], ...]):
+        self.weeks = weeks
+
+    def get_value(self, week_idx:int, week_offset:int) -> tuple[float,datetime.time]:
+        offsets, values = self.weeks[week_idx]
+        return values[bisect.bisect_right(offsets, week_offset)-1]
+
+
+class ScheduleTimeline:
+    """Compiled representation of a schedule and its whole inheritance tree.
+       It is built once (see Scheduler) and never modified afterwards, so it can be shared between threads.
+    """
+    def __init__(self, active_schedule:str, devices:dict[str,DeviceTimeline]):
+        self.active_schedule:str = active_schedule
+        # dict key is device name
+        self.devices:dict[str,DeviceTimeline] = devices
+        # For each week, sorted offsets of all devices breakpoints
+        self.transitions:tuple[list[int],list[int]] = tuple(
+            sorted(set(offset for device_timeline in devices.values() for offset in device_timeline.weeks[week_idx][0]))
+            for week_idx in (WEEK_A, WEEK_B))
+
+    def get_setpoint(self, device_name:str, date_:datetime.datetime) -> tuple[float,datetime.time]:
+        """return the (setpoint, timeslot_start_time) of a device at given date, or None if no setpoint applies
+        """
+        if device_name in self.devices:
+            return self.devices[device_name].get_value(get_week_index(date_), get_week_offset(date_))
+        return None
+
+    def get_setpoints(self, date_:datetime.datetime) -> dict[str,tuple[float,datetime.time]]:
+        """return a dict of (setpoint, timeslot_start_time) at given date
+           note : only devices that have an actual setpoint are present in the result
+        """
+        week_idx:int = get_week_index(date_)
+        week_offset:int = get_week_offset(date_)
+        result:dict[str,tuple[float,datetime.time]] = {}
+        for name, device_timeline in self.devices.items():
+            value = device_timeline.get_value(week_idx, week_offset)
+            if value:
+                result[name] = value
+        return result
+
+    def get_next_transition(self, date_:datetime.datetime) -> datetime.datetime:
+        """return the date of the first breakpoint of any device strictly after given date
+           note : the end of the week is always considered as a breakpoint
+        """
+        week_offset:int = get_week_offset(date_)
+        transitions:list[int] = self.transitions[get_week_index(date_)]
+        pos:int = bisect.bisect_right(transitions, week_offset)
+        next_offset:int = transitions[pos] if pos<len(transitions) else WEEK_US
+        return date_ + datetime.timedelta(microseconds=next_offset-week_offset)
+
+    def get_device_transitions(self, device_name:str, start:datetime.datetime, end:datetime.datetime) -> tuple[bool,bool]:
+        """return (timeslot_changed, setpoint_changed) for a device between start (excluded) and end (included) :
+           - timeslot_changed is True if the device went through at least one breakpoint (timeslot change),
+           - setpoint_changed is True if at least one of these breakpoints brought a new (not None) setpoint.
+           note : (False, False) is returned if end is not after start
+        """
+        timeslot_changed:bool = False
+        setpoint_changed:bool = False
+        if end <= start or not device_name in self.devices:
+            return (timeslot_changed, setpoint_changed)
+        device_timeline:DeviceTimeline = self.devices[device_name]
+        previous = device_timeline.get_value(get_week_index(start), get_week_offset(start))
+        # Iterate week by week, from the monday of start date, for week A/B alternates.
+        # After 2 weeks, all breakpoints of the device have been visited.
+        week_start:datetime.datetime = datetime.datetime.combine(start.date()-datetime.timedelta(days=start.weekday()), datetime.time())
+        last_week:datetime.datetime = week_start + datetime.timedelta(days=14)
+        while week_start <= end and week_start <= last_week:
+            offsets, values = device_timeline.weeks[get_week_index(week_start)]
+            first:int = bisect.bisect_right(offsets, (start-week_start)//datetime.timedelta(microseconds=1))
+            last:int = bisect.bisect_right(offsets, (end-week_start)//datetime.timedelta(microseconds=1))
+            for value in values[first:last]:
+                # the first breakpoint of a week may carry the same value as the end of previous week
+                if value != previous:
+                    timeslot_changed = True
+                    if value and (not previous or value[0] != previous[0]):
+                        setpoint_changed = True
+                    previous = value
+            week_start += datetime.timedelta(days=7)
+        return (timeslot_changed, setpoint_changed)
+
+    def get_forecast(self, start:datetime.datetime, end:datetime.datetime) -> dict[str,list[tuple[datetime.datetime,float]]]:
+        """return, for each device, the list of (date, setpoint) change points between start (included) and end (excluded)
+           The first item of each list is always the setpoint at start date.
+           setpoint is None when no setpoint is scheduled for the device.
+        """
+        result:dict[str,list[tuple[datetime.datetime,float]]] = {name:[] for name in self.devices}
+        # Iterate week by week, from the monday of start date, for week A/B alternates
+        week_start:datetime.datetime = datetime.datetime.combine(start.date()-datetime.timedelta(days=start.weekday()), datetime.time())
+        while week_start < end:
+            week_idx:int = get_week_index(week_start)
+            for name, device_timeline in self.devices.items():
+                changes:list[tuple[datetime.datetime,float]] = result[name]
+                offsets, values = device_timeline.weeks[week_idx]
+                for offset, value in zip(offsets, values):
+                    date_:datetime.datetime = week_start + datetime.timedelta(microseconds=offset)
+                    if date_ >= end:
+                        break
+                    setpoint:float = value[0] if value else None
+                    if date_ <= start:
+                        # Breakpoints before start date : only the last one gives the setpoint at start date
+                        changes[:] = [(start, setpoint)]
+                    elif changes[-1][1] != setpoint:
+                        changes.append((date_, setpoint))
+            week_start += datetime.timedelta(days=7)
+        return result
+
+    ################################################################################
+    # STATIC METHODS USED TO BUILD A TIMELINE
+    ################################################################################
+
+    def get_day_segments(timeslots:list[dict]) -> list[tuple[int,dict]]:
+        """Convert a list of timeslots into a sorted list of (start_offset_in_day, timeslot).
+           A timeslot applies until the start time of the next timeslot in list, the first
+           timeslot applies from midnight and the last one until the end of the day.
+        """
+        result:list[tuple[int,dict]] = []
+        if timeslots:
+            segment_start:int = 0
+            for idx in range(1, len(timeslots)):
+                next_start:int = get_time_offset(timeslots[idx]['start_time'])
+                if next_start > segment_start:
+                    result.append((segment_start, timeslots[idx-1]))
+                    segment_start = next_start
+            result.append((segment_start, timeslots[-1]))
+        return result
+
+    def merge_layers(layers:list[list[tuple[int,tuple]]]) -> list[tuple[int,tuple]]:
+        """Merge several lists of sorted (offset, value) items into a single one.
+           At any offset, the value of the first layer that has a non None value wins.
+           Consecutive identical values are merged.
+        """
+        offsets:list[int] = sorted(set(item[0] for layer in layers for item in layer))
+        layer_offsets:list[list[int]] = [[item[0] for item in layer] for layer in layers]
+        result:list[tuple[int,tuple]] = []
+        for offset in offsets:
+            value = None
+            for idx in range(len(layers)):
+                pos:int = bisect.bisect_right(layer_offsets[idx], offset)-1
+                if pos>=0 and layers[idx][pos][1] != None:
+                    value = layers[idx][pos][1]
+                    break
+            if len(result)==0 or result[-1][1] != value:
+                result.append((offset, value))
+        return result
@@ -1,66 +1,144 @@
 __author__      = "Jérôme Cuq"
 
-import copy
 import logging
 import datetime
-from device import Device
+import threading
+from enum import Enum
+from config_snapshot import FrozenDict, freeze
+from device import Device, ManualModeHeap
+from schedule_compiler import ScheduleCompiler
+from schedule_timeline import *
 from thread_base import ThreadBase
+from timer_service import Timer
 
 class SchedulerCallbacks:
     # setpoints :
     #  - Each key is a device name, each value a couple (setpoint, isManual) for value
     #  - a (None, False) value means that the device has no scheduled setpoint
     #  - a (None, True) means that the device is in manual mode (out of schedule)
-    #  - ALL known devices must have a defined or None setpoint
+    #  - ALL known devices have a defined or None setpoint, except after a configuration change
+    #    (see Scheduler.on_change()) : then only the devices whose setpoint moved are present
     def apply_devices_setpoints(self, setpoints: dict[str,tuple[float,bool]]):
         pass
 
+# Typed notification of a scheduler configuration change (see Scheduler.on_change())
+class ESchedulerChange(Enum):
+    # The temperature sets of a schedule (or the global ones) have changed
+    # params : {'schedule_name':str} ('' for global temperature sets)
+    TEMPERATURE_SETS = 1
+
+    # A temperature set has been renamed, with all its references
+    # params : {'schedule_name':str} ('' for a global temperature set)
+    TEMPERATURE_SET_NAME = 2
+
+    # A schedule has been renamed, with all its references
+    # params : {'old_name':str, 'new_name':str}
+    SCHEDULE_NAME = 3
+
+    # The properties of a schedule (name, parent) have changed
+    # params : {'name':str, 'new_name':str}
+    SCHEDULE_PROPERTIES = 4
+
+    # A schedule has been deleted
+    # params : {'schedule_name':str}
+    SCHEDULE_DELETED = 5
+
+    # A device has been deleted (it can not be referenced in scheduler configuration)
+    # params : {'device_name':str}
+    DEVICE_DELETED = 6
+
 class Scheduler:
+    # Maximum sleep time of the scheduler thread between two evaluations of setpoints (sec).
+    # It bounds the effect of a system clock change (DST, NTP) on the next wake up date.
+    MAX_WAIT_SEC:float = 3600.
+
     # manual_mode_reset_event : 'timeslot_change', 'setpoint_change' or an int
+    # config_scheduler may be a frozen configuration (see Configuration.get_snapshot()), it is then shared without any copy
+    # timer_service : if set (TimerService or AsyncioTimerService), the setpoints are evaluated in timers
+    #                 of this service instead of a scheduler thread
     def __init__(self,
                  config_scheduler:dict,
                  callbacks:SchedulerCallbacks,
                  devices:dict[str,Device],
                  init_delay_sec:int,
                  manual_mode_reset_event,
-                 thread_wait_time:float = None):
+                 thread_wait_time:float = None,
+                 timer_service = None):
         
         self.logger = logging.getLogger('hcs.scheduler')
         self.logger.info('Starting scheduler')
-        self.config_scheduler = copy.deepcopy(config_scheduler)
+        # immutable configuration : a change is a swap of this reference (see __set_config)
+        self.config_scheduler:FrozenDict = freeze(config_scheduler)
         self.callbacks = callbacks
         self.devices:dict[str,Device] = devices
+        # devices in manual mode, oldest manual setpoint first (maintained by the devices themselves)
+        self.manual_modes:ManualModeHeap = ManualModeHeap()
+        self.__attach_devices()
         # dict key is device name
         self.current_setpoints: dict[str,tuple[float, datetime.datetime]] = {}
-        self.active_schedule_changed = False
         self.init_delay:int = init_delay_sec
         self.manual_mode_reset_event = manual_mode_reset_event
         # for testing purpose : a test date replaces the actual date
         self.test_date = None
+        # set once the scheduler thread has started to evaluate setpoints (after init delay)
+        self.setpoints_initialized:bool = False
+        # date of the last setpoints evaluation of the scheduler thread :
+        # timeline transitions are searched from this date to detect manual mode reset events
+        self.last_evaluation_date:datetime.datetime = None
+        # builds timelines, with temperature sets inheritance resolved once per configuration change
+        self.compiler:ScheduleCompiler = ScheduleCompiler(self.config_scheduler)
+        # compiled version of the active schedule (see __compile_timeline)
+        self.timeline:ScheduleTimeline = self.__compile_timeline()
 
         # thread_wait_time is used for testing purpose
         self.thread_wait_time = thread_wait_time
+        # its lock protects the scheduler state, even if the thread is not started (timer mode)
         self.active_schedule_thread: ThreadBase = ThreadBase()
-        self.active_schedule_thread.start(self.__follow_active_schedule_thread)
+        self.timer_service = timer_service
+        if self.timer_service:
+            # timer mode : next evaluation of setpoints
+            self.tick_lock = threading.Lock()
+            self.tick_timer:Timer = None
+            self.stopped:bool = False
+            self.logger.info('Scheduler timer pausing for '+str(self.init_delay)+' sec (init delay)')
+            self.tick_timer = self.timer_service.call_later(self.init_delay, self.__on_init_delay)
+        else:
+            self.active_schedule_thread.start(self.__follow_active_schedule_thread)
 
     def stop(self):
-        self.active_schedule_thread.stop()
+        if self.timer_service:
+            with self.tick_lock:
+                self.stopped = True
+                self.tick_timer.cancel()
+            self.logger.info('Scheduler timer has stopped')
+        else:
+            self.active_schedule_thread.stop()
         
     def set_schedule(self, schedule:dict):
         alias = schedule['alias']
+        schedules:list = list(self.config_scheduler['schedules'])
         schedule_idx = self.__get_idx_in_schedules(alias)
         if schedule_idx>-1:
             # It is an existing schedule
-            self.config_scheduler['schedules'][schedule_idx] = copy.deepcopy(schedule)
+            schedules[schedule_idx] = schedule
         else:
             # It is a new schedule
-            self.config_scheduler['schedules'].append( copy.deepcopy(schedule) )
+            schedules.append(schedule)
+        self.__set_config(dict(self.config_scheduler, schedules=schedules))
         
         if alias == self.config_scheduler['active_schedule']:
             self.on_active_schedule_changed(alias)
+        else:
+            in_active_tree:bool = alias in self.compiler.get_schedules_tree_aliases(self.config_scheduler['active_schedule'])
+            self.timeline = self.__compile_timeline()
+            if in_active_tree:
+                # notify the thread that active schedule content has changed
+                self.__wake_up()
 
     def set_manual_mode_reset_event(self, manual_mode_reset_event):
         self.manual_mode_reset_event = manual_mode_reset_event
+        # manual mode expiry dates may have changed
+        self.__wake_up()
     
     def __get_idx_in_schedules(self, schedule_alias:str):
         idx = 0
@@ -70,19 +148,22 @@ class Scheduler:
         return -1
 
     def on_active_schedule_changed(self, active_schedule):
-        self.config_scheduler['active_schedule'] = active_schedule
+        if active_schedule != self.config_scheduler['active_schedule']:
+            self.__set_config(dict(self.config_scheduler, active_schedule=active_schedule))
+        self.timeline = self.__compile_timeline()
         # reset manual mode for all devices
         for devname in self.__get_devices_in_manual_mode():
             self.logger.info("Device['"+devname+"'] is going out of manual setpoint mode")
             self.devices[devname].exitManualMode()
-        with self.active_schedule_thread.lock:
-            # notify the thread that active schedule has changed
-            self.active_schedule_changed = True
+        # notify the thread that active schedule has changed
+        self.__wake_up()
 
     def on_devices(self, devices:dict[str,Device], scheduler:dict):
         with self.active_schedule_thread.lock:
             self.devices = devices
-            self.config_scheduler = copy.deepcopy(scheduler)
+            self.__attach_devices()
+            self.__set_config(scheduler)
+            self.timeline = self.__compile_timeline()
             # Update the current setpoints so that the schedule thread
             # does not believe that setpoints have changed
             result = self.get_setpoints(self.__get_current_date())
@@ -100,27 +181,104 @@ class Scheduler:
                 self.current_setpoints = result[2]
             # now we remove device_name to force the refresh
             self.current_setpoints.pop(device_name)
-            self.active_schedule_changed = True
+            self.__wake_up()
 
     def set_scheduler(self, scheduler:dict):
         active_changed = self.config_scheduler['active_schedule'] != scheduler['active_schedule']
-        self.config_scheduler = copy.deepcopy(scheduler)
+        self.__set_config(scheduler)
         if active_changed:
             self.on_active_schedule_changed(self.config_scheduler['active_schedule'])
         else:
-            with self.active_schedule_thread.lock:
-                # notify the thread that active schedule content may has changed
-                self.active_schedule_changed = True
+            self.timeline = self.__compile_timeline()
+            # notify the thread that active schedule content may has changed
+            self.__wake_up()
+
+    # Called by the controller on a scheduler configuration change, 'scheduler' being the new configuration.
+    # Only the parts of the configuration impacted by the change are copied, and only the devices
+    # whose scheduled setpoint may have moved are evaluated again : apply_devices_setpoints() is
+    # then called for the devices whose setpoint actually moved.
+    def on_change(self, change:ESchedulerChange, params:dict, scheduler:dict):
+        new_setpoints:dict[str,tuple[float,bool]] = {}
+        active_changed:bool = False
+        with self.active_schedule_thread.lock:
+            if change == ESchedulerChange.DEVICE_DELETED:
+                # self.devices may not be the controller dictionary anymore (devices order change)
+                device:Device = self.devices.pop(params['device_name'], None)
+                if device:
+                    device.setManualModeHeap(None)
+                self.__attach_devices()
+                self.current_setpoints.pop(params['device_name'], None)
+                return
+
+            # 1) Which parts of the configuration have changed
+            renamed:dict[str,str] = {}
+            dirty:set[str] = set()
+            global_tempsets:bool = False
+            if change in (ESchedulerChange.TEMPERATURE_SETS, ESchedulerChange.TEMPERATURE_SET_NAME):
+                if params['schedule_name'] == '':
+                    global_tempsets = True
+                    if change == ESchedulerChange.TEMPERATURE_SET_NAME:
+                        # references to a global temperature set may be in any schedule
+                        dirty = set(schedule['alias'] for schedule in scheduler['schedules'])
+                else:
+                    dirty.add(params['schedule_name'])
+            elif change == ESchedulerChange.SCHEDULE_NAME:
+                renamed[params['old_name']] = params['new_name']
+            elif change == ESchedulerChange.SCHEDULE_PROPERTIES:
+                renamed[params['name']] = params['new_name']
+                dirty.add(params['new_name'])
+            if renamed:
+                # children schedules reference their parent by its new name
+                dirty |= set(renamed.values())
+                dirty |= set(schedule['alias'] for schedule in scheduler['schedules']
+                             if schedule.get('parent_schedule', None) in renamed.values())
+
+            old_active:str = self.config_scheduler['active_schedule']
+            old_tree:list[str] = [renamed.get(alias, alias) for alias in self.compiler.get_schedules_tree_aliases(old_active)]
+            old_schedules:dict[str,dict] = {schedule['alias']:schedule for schedule in self.config_scheduler['schedules']}
+
+            # 2) Update the configuration : unchanged parts are shared with current configuration
+            self.__set_config(scheduler)
+            new_active:str = self.config_scheduler['active_schedule']
+            active_changed = new_active != renamed.get(old_active, old_active)
+
+            if not active_changed:
+                # 3) Which devices may have a new setpoint
+                affected:set[str] = None
+                new_tree:list[str] = self.compiler.get_schedules_tree_aliases(new_active)
+                if not global_tempsets and old_tree == new_tree:
+                    old_names:dict[str,str] = {new_name:old_name for old_name, new_name in renamed.items()}
+                    affected = set()
+                    for alias in dirty.intersection(new_tree):
+                        affected |= Scheduler.__get_schedule_devices(self.compiler.get_schedule(alias))
+                        affected |= Scheduler.__get_schedule_devices(old_schedules.get(old_names.get(alias, alias), None))
+                self.timeline = self.__update_timeline(affected)
+                new_setpoints = self.__update_current_setpoints(affected)
+
+        if active_changed:
+            self.on_active_schedule_changed(new_active)
+        else:
+            if new_setpoints:
+                self.logger.debug("New setpoints to apply after a configuration change : "+str(new_setpoints))
+                self.callbacks.apply_devices_setpoints(new_setpoints)
+            # next timeslot boundary may have changed, and devices in manual mode are handled by the thread
+            self.__wake_up()
 
     # for testing purpose : a test date replaces the actual date
     def set_test_date(self, test_date:datetime = None):
         self.test_date = test_date
+        self.__wake_up()
 
     def on_device_setpoint(self, device:Device):
         # manual mode handling
         if device.hasScheduledSetpoint() and device.setpoint != device.scheduled_setpoint:
             self.logger.info("Device['"+device.name+"'] is going to manual setpoint mode")
+            # devices added after the last call to on_devices() are not tracked yet
+            device.setManualModeHeap(self.manual_modes)
             device.enterManualMode()
+        if device.isInManualMode():
+            # the manual mode may end now (setpoint is back to scheduled value) or at a new expiry date
+            self.__wake_up()
 
     # Called by the controller when new devices are connected
     # This method must notify the setpoint of only new devices present in current schedule
@@ -140,108 +298,31 @@ class Scheduler:
     # note : in case of no active schedule, the method returns (True, None, {})
     # note : only devices that have actual setpoints are present in the result
     def get_setpoints(self, date_:datetime.datetime) -> tuple[bool, str, dict[str,tuple[float,datetime.datetime]]]:
-        if 'active_schedule' in self.config_scheduler:
-            active_alias:str = self.config_scheduler['active_schedule']
-            if active_alias:
-                # We look for schedule matching active alias and all its inheritance tree
-                schedules = []
-                schedule:dict = self.__get_schedule(active_alias)
-                schedules.append(schedule)
-                while 'parent_schedule' in schedule:
-                    schedule = schedule['parent_schedule']
-                    schedules.append( self.__get_schedule(schedule) )
-
-                # Now we browse the collected schedules to get all setpoints.
-                # For each device, we look for the first setpoint in the inheritance tree
-                setpoints = {}
-                for schedule in schedules:
-                    alias = schedule['alias']
-                    # We look for the time slot that applies to schedule at given time
-                    timeslots = self.__find_timeslots(schedule, date_)
-                    index = 0
-                    for schedule_item in schedule['schedule_items']:
-                        # get active timeslot for current schedule item
-                        timeslot = timeslots[index]
-                        if timeslot:
-                            for device_name in schedule_item['devices']:
-                                setpoint:float = self.__get_setpoint(schedule, device_name, timeslot)
-                                if setpoint != None and not device_name in setpoints:
-                                    setpoints[device_name] = (setpoint, timeslot['start_time'])
-                        index = index+1
-            
-                return (True, active_alias, setpoints)
-    
+        # The timeline may be replaced at any time by another thread : we work on a local reference
+        timeline:ScheduleTimeline = self.timeline
+        if timeline.active_schedule:
+            return (True, timeline.active_schedule, timeline.get_setpoints(date_))
         return (True, None, {})
 
+    # get the scheduled setpoints of devices between 'start' (included) and 'end' (excluded) dates
+    # return dict of [device_name, list of (date, setpoint)] where each item is a setpoint change
+    # note : the first item of each list is the setpoint at 'start' date (None if no setpoint is scheduled)
+    # note : manual mode of devices is not taken into account
+    def forecast(self, start:datetime.datetime, end:datetime.datetime) -> dict[str,list[tuple[datetime.datetime,float]]]:
+        return self.timeline.get_forecast(start, end)
 
     ################################################################################
     # PRIVATE STATIC METHODS
     ################################################################################
 
-    def __get_setpoint_from_tempset(device_name, temp_sets, tempset_alias) -> float:
-        for temp_set in temp_sets:
-            if temp_set['alias'] == tempset_alias:
-                for device_temp in temp_set['devices']:
-                    if device_temp['device_name']==device_name:
-                        # found !
-                        return device_temp['setpoint']
-                # device not found in this temperature set
-                # we need to test the set that this set inherits from
-                if ('inherits' in temp_set) and temp_set['inherits']:
-                    res:float = Scheduler.__get_setpoint_from_tempset(device_name, temp_sets, temp_set['inherits'])
-                    if res: return res
-        return None
-
-    # return a list of timeslots. Each item of the list is the timeslot that applies to the corresponding schedule_item.
-    # None is put to the result list for each schedule item with no applying timeslot, 
-    def __find_timeslots(self, schedule, date_:datetime.datetime) -> list[dict]:
-        result:list[dict] = []
-        for schedule_item in schedule['schedule_items']:
-            timeslots_sets = schedule_item['timeslots_sets']
-            timeslot = Scheduler.__find_timeslot(timeslots_sets, date_)
-            # timeslot can be None
-            result.append(timeslot)
+    # return the devices referenced in the schedule items of given schedule
+    def __get_schedule_devices(schedule:dict) -> set[str]:
+        result:set[str] = set()
+        if schedule:
+            for schedule_item in schedule['schedule_items']:
+                result.update(schedule_item['devices'])
         return result
 
-    # return None if no time slot applies to the given date
-    def __find_timeslot(timeslots_sets, date_:datetime.datetime) -> dict:
-        start_time = None
-        end_time = None
-        found = None
-        for timeslots_set in timeslots_sets:
-            dates = timeslots_set['dates']
-            # Verifying if the given date match the dates in this timeslots_set
-            date_ok = False
-            target_weekday = str(date_.weekday()+1)
-            for d in dates:
-                if d==target_weekday:
-                    date_ok = True
-                    break
-            if date_ok:
-                # if a week filter (A/B) has been set, we need to check the target week of <date_>
-                week_key = 'timeslots'
-                if 'timeslots_A' in timeslots_set:
-                    week_key = 'timeslots_A' if (int(date_.strftime("%V"))%2==0) else 'timeslots_B'
-                timeslots = timeslots_set[week_key]
-                timeslot = None
-                target_time = date_.time()
-                for new_timeslot in timeslots:
-                    if not start_time:
-                        start_time = new_timeslot['start_time']
-                    else:
-                        end_time = new_timeslot['start_time']
-                        if target_time < end_time:
-                            # We have our timeslot
-                            found = timeslot
-                            break
-                    timeslot = new_timeslot
-
-                if (not found):
-                    found = timeslots[len(timeslots)-1]
-                return found
-
-        return None
-
     def __get_setpoints_diff(sp1:dict[str,tuple[float,datetime.datetime]], 
                              sp2:dict[str,tuple[float,datetime.datetime]]) -> dict[str,tuple[float,str]]:
         """find all differencies between the 2 given setpoints dictionaries
@@ -281,33 +362,109 @@ class Scheduler:
             return self.test_date
         return datetime.datetime.now()
 
-    def __get_schedule(self, alias:str) -> dict:
-        if 'schedules' in self.config_scheduler:
-            all_schedules = self.config_scheduler['schedules']
-            for schedule in all_schedules:
-                if schedule['alias'] == alias:
-                    return schedule
-        return None
-    
+    # Track the manual mode of all devices in self.manual_modes
+    def __attach_devices(self):
+        for device in self.devices.values():
+            device.setManualModeHeap(self.manual_modes)
+
+    # Replace the configuration by a frozen version of given one, sharing all unchanged parts with current one
+    def __set_config(self, config_scheduler:dict):
+        self.config_scheduler = freeze(config_scheduler, self.config_scheduler)
+        self.compiler.set_config(self.config_scheduler)
+
+    # Build the timeline of the active schedule (see ScheduleCompiler)
+    def __compile_timeline(self) -> ScheduleTimeline:
+        return self.compiler.compile(self.config_scheduler.get('active_schedule', None))
+
+    # return the timeline of the active schedule, where only the affected devices are compiled again
+    # (all devices if affected is None)
+    def __update_timeline(self, affected:set[str]) -> ScheduleTimeline:
+        if affected is None:
+            return self.__compile_timeline()
+        devices:dict[str,DeviceTimeline] = {name:device_timeline for name, device_timeline in self.timeline.devices.items() if not name in affected}
+        devices.update(self.compiler.compile(self.config_scheduler['active_schedule'], affected).devices)
+        return ScheduleTimeline(self.config_scheduler['active_schedule'], devices)
+
+    # Update current setpoints of affected devices (all devices if affected is None) from the timeline
+    # return the setpoints that have moved, in the callbacks.apply_devices_setpoints() format
+    # note : devices in manual mode are left to the scheduler thread
+    def __update_current_setpoints(self, affected:set[str]) -> dict[str,tuple[float,bool]]:
+        result:dict[str,tuple[float,bool]] = {}
+        if not self.setpoints_initialized:
+            # the scheduler thread will send all setpoints once started
+            return result
+        now:datetime.datetime = self.__get_current_date()
+        devices_in_manual_mode:dict[str, Device] = self.__get_devices_in_manual_mode()
+        if affected is None:
+            affected = set(self.current_setpoints) | set(self.timeline.devices)
+        for name in affected:
+            if not name in devices_in_manual_mode:
+                value:tuple[float,datetime.time] = self.timeline.get_setpoint(name, now)
+                old_value:tuple[float,datetime.time] = self.current_setpoints.get(name, None)
+                if value:
+                    self.current_setpoints[name] = value
+                elif old_value:
+                    self.current_setpoints.pop(name)
+                if (value[0] if value else None) != (old_value[0] if old_value else None):
+                    result[name] = (value[0] if value else None, False)
+        return result
+
+    # Wake up the scheduler thread before the next timeslot or manual mode change
+    def __wake_up(self):
+        if not self.timer_service:
+            self.active_schedule_thread.notify()
+        else:
+            # timer mode : the next evaluation is done as soon as possible (but not during init delay)
+            with self.tick_lock:
+                if self.setpoints_initialized and not self.stopped:
+                    self.tick_timer.cancel()
+                    self.tick_timer = self.timer_service.call_later(0., self.__on_tick)
+
+    # return the delay (sec) until next evaluation of setpoints
+    def __get_next_tick_delay(self) -> float:
+        if self.thread_wait_time:
+            # Used for testing purpose
+            return self.thread_wait_time
+        # Waiting next timeslot boundary or manual mode expiry,
+        # unless something changes in the meantime
+        return self.__get_next_wakeup_delay()
+
+    # return the delay (sec) until the next event the scheduler thread must handle :
+    # the next timeslot boundary of any device or the next manual mode expiry
+    def __get_next_wakeup_delay(self) -> float:
+        now:datetime.datetime = self.__get_current_date()
+        next_date:datetime.datetime = self.timeline.get_next_transition(now)
+        if type(self.manual_mode_reset_event) is int:
+            # The oldest manual setpoint is the first to expire
+            first_date:datetime.datetime = self.manual_modes.get_first_date()
+            if first_date:
+                next_date = min(next_date, first_date + datetime.timedelta(hours = self.manual_mode_reset_event))
+        delay:float = (next_date-now).total_seconds()
+        return min(max(delay, 0.), Scheduler.MAX_WAIT_SEC)
+
     def __get_devices_in_manual_mode(self) -> dict[str, Device]:
         result:dict[str, Device] = {}
-        for name in self.devices:
-            device = self.devices[name]
-            if device.isInManualMode():
-                result[name] = device
+        for device in self.manual_modes.get_devices():
+            if self.devices.get(device.name, None) is device:
+                result[device.name] = device
         return result
-    
-    def __get_setpoint(self, schedule, device_name, timeslot) -> float:
-        temp_sets = []
-        if 'temperature_sets' in schedule:
-            temp_sets = schedule['temperature_sets']
-        if 'temperature_sets' in self.config_scheduler:
-            temp_sets.extend(self.config_scheduler['temperature_sets'])
-
-        # We must get the setpoint for this device in temperature sets
-        temp_set_alias = timeslot['temperature_set']
-        return Scheduler.__get_setpoint_from_tempset(device_name, temp_sets, temp_set_alias)
 
+    # return True if a 'timeslot_change' or 'setpoint_change' manual mode reset event occurred for the device
+    # since last evaluation : either a transition of its timeline, or a change of its scheduled value
+    # (due to a configuration change) compared to the last applied setpoints
+    def __has_manual_mode_reset_event(self, name:str, new_setpoints:dict[str,tuple[float,datetime.datetime]], now:datetime.datetime) -> bool:
+        timeslot_changed:bool = False
+        setpoint_changed:bool = False
+        if self.last_evaluation_date:
+            timeslot_changed, setpoint_changed = self.timeline.get_device_transitions(name, self.last_evaluation_date, now)
+        old_value = self.current_setpoints.get(name, None)
+        new_value = new_setpoints.get(name, None)
+        if self.manual_mode_reset_event == 'timeslot_change':
+            return timeslot_changed or (old_value is None) != (new_value is None) or (old_value is not None and old_value[1] != new_value[1])
+        if self.manual_mode_reset_event == 'setpoint_change':
+            return setpoint_changed or (new_value is not None and (old_value is None or old_value[0] != new_value[0]))
+        return False
+    
     # Converts setpoints from (setpoint, datetime) to (setpoint, isManual) to comply to callbacks.apply_devices_setpoints prototype
     def __get_controller_setpoints(self, setpoints: dict[str,tuple[float, datetime.datetime]], only_new_devices:bool = False) -> dict[str,tuple[float,bool]]:
         result_setpoints:dict[str,tuple[float,bool]] = {}
@@ -337,88 +494,78 @@ class Scheduler:
 
         # Waiting as requested by init_delay
         self.logger.info('Scheduler thread pausing for '+str(self.init_delay)+' sec (init delay)')
-        isAlive:bool = self.active_schedule_thread.wait(self.init_delay)
+        isAlive:bool = self.active_schedule_thread.wait(self.init_delay, notifiable=False)
+        with self.active_schedule_thread.lock:
+            self.setpoints_initialized = True
         
-        result:tuple[bool, str, dict[str,tuple[float,datetime.datetime]]] = None
         while isAlive:
-            result = self.get_setpoints(self.__get_current_date())
-            new_setpoints: dict[str,tuple[float,datetime.datetime]] = result[2]
-            if result[0]:
-                all_setpoints:dict = None
-                with self.active_schedule_thread.lock:
-                    diffs:dict[str,tuple[float,str]] = None
-                    bDiff:bool = False
-                    diffs = Scheduler.__get_setpoints_diff(self.current_setpoints, result[2])
-                    
-                    # Handling of devices manual mode
-                    devices_in_manual_mode:dict[str, Device] = self.__get_devices_in_manual_mode()
-                    manual_time = None
-                    if type(self.manual_mode_reset_event) is int:
-                        manual_time = datetime.timedelta(hours = self.manual_mode_reset_event)
-                    for name in self.devices:
-                        if name in devices_in_manual_mode:
-                            device = self.devices[name]
-                            switch2auto = False
-                            # 1) The manual mode reset setting in set to a integer (nb of hours)
-                            if type(self.manual_mode_reset_event) is int:
-                                if self.__get_current_date()-device.manual_setpoint_date >= manual_time:
-                                    switch2auto = True
-                            # 2) The manual mode reset setting in set to a 'timeslot_change'
-                            elif self.manual_mode_reset_event == 'timeslot_change':
-                                if (name in self.current_setpoints) != (name in new_setpoints):
-                                    switch2auto = True
-                                elif (name in self.current_setpoints) and (name in new_setpoints):
-                                    if self.current_setpoints[name][1] != new_setpoints[name][1]:
-                                        switch2auto = True
-                            # 3) The manual mode reset setting in set to a 'setpoint_change'
-                            elif self.manual_mode_reset_event == 'setpoint_change':
-                                if (not name in self.current_setpoints) and (name in new_setpoints):
-                                    switch2auto = True
-                                elif (name in self.current_setpoints) and (name in new_setpoints):
-                                    if self.current_setpoints[name][0] != new_setpoints[name][0]:
-                                        switch2auto = True
-                            # 4) in all cases, if the current setpoint is identical to the scheduled,
-                            #    or if the device is not in the current shedule, it can go out of manual mode
-                            if (not device.hasScheduledSetpoint()) or (device.scheduled_setpoint == device.setpoint):
-                                switch2auto = True
-                            if switch2auto:
-                                # This device must go back to scheduled setpoint, if any
-                                self.logger.info("Device['"+device.name+"'] is going out of manual setpoint mode")
-                                device.exitManualMode()
-                                bDiff = True
-                                devices_in_manual_mode.pop(name)
-                            else:
-                                # This device must NOT go back to scheduled setpoint
-                                if name in diffs: diffs.pop(name)
-
-                    
-                    # Something has changed since last call ?
-                    if len(diffs)>0 or bDiff:
-                        self.current_setpoints = new_setpoints
-                        self.logger.debug("New setpoints to apply for schedule '"+str(result[1])+"': "+str(self.current_setpoints))
-                        # We must comply to the callbacks.apply_devices_setpoints prototype
-                        all_setpoints = self.__get_controller_setpoints(self.current_setpoints)
-                
-                # At last, we can call the callback !
-                if all_setpoints:
-                    self.callbacks.apply_devices_setpoints(all_setpoints)
+            self.__evaluate_setpoints()
+            isAlive = self.active_schedule_thread.wait(self.__get_next_tick_delay())
 
-            if self.thread_wait_time:
-                # Used for testing purpose
-                isAlive = self.active_schedule_thread.wait(self.thread_wait_time)
-            else:
-                # Waiting next minute
-                waitNextMinuteDelay:int = 60 - self.__get_current_date().time().second
-                delay:int = 0
-                while isAlive and waitNextMinuteDelay>delay:
-                    isAlive = self.active_schedule_thread.wait(2)
-                    delay = delay + 2
-                    if isAlive:
-                        with self.active_schedule_thread.lock:
-                            # let's see if current shedule has changed
-                            if self.active_schedule_changed:
-                                self.active_schedule_changed = False
-                                delay = waitNextMinuteDelay
-                            
         self.logger.info('Scheduler thread has stopped')
-                    
\ No newline at end of file
+
+    # Timer mode : end of init delay
+    def __on_init_delay(self):
+        with self.active_schedule_thread.lock:
+            self.current_setpoints = {}
+            self.setpoints_initialized = True
+        self.__on_tick()
+
+    # Timer mode : evaluation of setpoints, then next evaluation is scheduled
+    def __on_tick(self):
+        self.__evaluate_setpoints()
+        with self.tick_lock:
+            if not self.stopped:
+                self.tick_timer.cancel()
+                self.tick_timer = self.timer_service.call_later(self.__get_next_tick_delay(), self.__on_tick)
+
+    # Evaluation of setpoints at current date : changes are sent to callbacks.apply_devices_setpoints
+    def __evaluate_setpoints(self):
+        now:datetime.datetime = self.__get_current_date()
+        result:tuple[bool, str, dict[str,tuple[float,datetime.datetime]]] = self.get_setpoints(now)
+        new_setpoints: dict[str,tuple[float,datetime.datetime]] = result[2]
+        if result[0]:
+            all_setpoints:dict = None
+            with self.active_schedule_thread.lock:
+                diffs:dict[str,tuple[float,str]] = None
+                bDiff:bool = False
+                diffs = Scheduler.__get_setpoints_diff(self.current_setpoints, result[2])
+                
+                # Handling of devices manual mode : only the devices in manual mode are visited
+                devices_in_manual_mode:dict[str, Device] = self.__get_devices_in_manual_mode()
+                expired:set[str] = set()
+                if type(self.manual_mode_reset_event) is int:
+                    # 1) The manual mode reset setting in set to a integer (nb of hours) :
+                    #    only the devices whose manual mode has expired are popped from the heap
+                    manual_time = datetime.timedelta(hours = self.manual_mode_reset_event)
+                    expired = set(device.name for device in self.manual_modes.pop_until(now-manual_time))
+                for name, device in devices_in_manual_mode.items():
+                    switch2auto = name in expired
+                    # 2) The manual mode reset setting in set to a 'timeslot_change' or a 'setpoint_change' :
+                    #    driven by the transitions of the device timeline since last evaluation
+                    if not switch2auto and type(self.manual_mode_reset_event) is not int:
+                        switch2auto = self.__has_manual_mode_reset_event(name, new_setpoints, now)
+                    # 3) in all cases, if the current setpoint is identical to the scheduled,
+                    #    or if the device is not in the current shedule, it can go out of manual mode
+                    if (not device.hasScheduledSetpoint()) or (device.scheduled_setpoint == device.setpoint):
+                        switch2auto = True
+                    if switch2auto:
+                        # This device must go back to scheduled setpoint, if any
+                        self.logger.info("Device['"+device.name+"'] is going out of manual setpoint mode")
+                        device.exitManualMode()
+                        bDiff = True
+                    else:
+                        # This device must NOT go back to scheduled setpoint
+                        if name in diffs: diffs.pop(name)
+                self.last_evaluation_date = now
+
+                # Something has changed since last call ?
+                if len(diffs)>0 or bDiff:
+                    self.current_setpoints = new_setpoints
+                    self.logger.debug("New setpoints to apply for schedule '"+str(result[1])+"': "+str(self.current_setpoints))
+                    # We must comply to the callbacks.apply_devices_setpoints prototype
+                    all_setpoints = self.__get_controller_setpoints(self.current_setpoints)
+            
+            # At last, we can call the callback !
+            if all_setpoints:
+                self.callbacks.apply_devices_setpoints(all_setpoints)
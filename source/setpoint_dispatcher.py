@@ -0,0 +1,124 @@
+__author__      = "Jérôme Cuq"
+
+import logging
+import threading
+import time
+from timer_service import Timer, TimerService
+
+
+class BrokerQueue:
+    """Setpoints waiting to be sent through a connection client (broker or gateway), and its token bucket
+    """
+    def __init__(self, burst:int):
+        # key is device name, value is the latest setpoint (dict order is the sending order)
+        self.pending:dict[str,float] = {}
+        self.tokens:float = float(burst)
+        self.refill_date:float = time.monotonic()
+        # timer set when the queue waits for a token
+        self.timer:Timer = None
+
+    def refill(self, now:float, interval_sec:float, burst:int):
+        self.tokens = min(float(burst), self.tokens + (now - self.refill_date)/interval_sec)
+        self.refill_date = now
+
+
+class SetpointDispatcher:
+    """Paced sending of setpoints : each connection client has its own token bucket,
+       so that devices behind the same broker (or gateway) get at most one setpoint every interval_sec
+       (after an initial burst of 'burst' setpoints).
+       dispatch() returns immediately : waiting setpoints are sent by timers of the timer service.
+       A setpoint that is still waiting is replaced by any newer setpoint for the same device.
+    """
+    def __init__(self, timer_service:TimerService, callback, interval_sec:float = 0.5, burst:int = 1):
+        """
+        :param timer_service: timer service the waiting setpoints are sent from
+        :type timer_service: TimerService
+        :param callback: called as callback(device_name, setpoint) to send a setpoint
+        :param interval_sec: minimal delay between 2 setpoints sent through the same connection client
+        :type interval_sec: float
+        :param burst: number of setpoints that can be sent at once after an idle period
+        :type burst: int
+        """
+        self.logger: logging.Logger = logging.getLogger('hcs.dispatcher')
+        self.lock = threading.Lock()
+        self.timer_service:TimerService = timer_service
+        self.callback = callback
+        self.interval_sec:float = interval_sec
+        self.burst:int = burst
+        # key is connection client name
+        self.queues:dict[str,BrokerQueue] = {}
+        self.stopped:bool = False
+        self.sent:int = 0
+        self.coalesced:int = 0
+
+    # Waiting setpoints are dropped
+    def stop(self):
+        with self.lock:
+            self.stopped = True
+            for queue in self.queues.values():
+                self.timer_service.cancel(queue.timer)
+                queue.timer = None
+                queue.pending.clear()
+
+    def dispatch(self, client_name:str, setpoints:list[tuple[str,float]]):
+        """Queue the setpoints of devices that use the connection client 'client_name',
+           the first ones are sent right away if the bucket has tokens left
+        """
+        with self.lock:
+            if self.stopped:
+                return
+            queue:BrokerQueue = self.queues.get(client_name, None)
+            if not queue:
+                queue = BrokerQueue(self.burst)
+                self.queues[client_name] = queue
+            for device_name, setpoint in setpoints:
+                if device_name in queue.pending:
+                    self.coalesced += 1
+                queue.pending[device_name] = setpoint
+        self.__send_pending(client_name)
+
+    # Drop the waiting setpoint of a device, if any
+    def cancel(self, device_name:str):
+        with self.lock:
+            for queue in self.queues.values():
+                queue.pending.pop(device_name, None)
+
+    def get_pending_count(self) -> int:
+        with self.lock:
+            return sum(len(queue.pending) for queue in self.queues.values())
+
+    def get_stats(self) -> dict[str,int]:
+        """return the number of sent setpoints, and the number of waiting setpoints replaced by a newer one
+        """
+        with self.lock:
+            return {'sent':self.sent, 'coalesced':self.coalesced}
+
+    ################################################################################
+    # PRIVATE METHODS
+    ################################################################################
+
+    # Send waiting setpoints while the bucket has tokens, then wait for the next token
+    def __send_pending(self, client_name:str):
+        while True:
+            with self.lock:
+                queue:BrokerQueue = self.queues[client_name]
+                if self.stopped or not queue.pending:
+                    return
+                queue.refill(time.monotonic(), self.interval_sec, self.burst)
+                if queue.tokens < 1.:
+                    if not queue.timer:
+                        queue.timer = self.timer_service.call_later((1.-queue.tokens)*self.interval_sec, self.__on_timer, client_name)
+                    return
+                queue.tokens -= 1.
+                device_name:str = next(iter(queue.pending))
+                setpoint:float = queue.pending.pop(device_name)
+                self.sent += 1
+            try:
+                self.callback(device_name, setpoint)
+            except Exception as exc:
+                self.logger.error("Exception while sending setpoint of device '"+device_name+"' : "+str(exc))
+
+    def __on_timer(self, client_name:str):
+        with self.lock:
+            self.queues[client_name].timer = None
+        self.__send_pending(client_name)
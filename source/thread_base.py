@@ -9,34 +9,43 @@ class ThreadBase:
         self.lock: threading.Lock = threading.Lock()
         self.thread: threading.Thread = None
         self.must_stop: bool = False
+        # set by stop() and notify() to wake up the thread waiting in wait()
+        self.event: threading.Event = threading.Event()
     
     def start(self, target):
         if not self.thread:
             self.thread: threading.Thread = threading.Thread(target=target)
             self.must_stop = False
+            self.event.clear()
             self.thread.start()
 
     def stop(self):
         if self.thread and self.thread.is_alive():
+            # must_stop is set before waking up the thread, so that it does not go back to sleep
             self.must_stop = True
+            self.event.set()
             if threading.get_ident() != self.thread.ident:
                 self.thread.join()
         self.thread = None
 
-    ### Wait for delay sec (delai is a multiple of 0.2s)
+    ### Wake up the thread : its current (or next) call to wait() returns immediately
+    def notify(self):
+        self.event.set()
+
+    ### Wait for delay sec, or until stop() is called, or until notify() is called (if notifiable is True)
     ### return False if the thread main loop must end
-    def wait(self, delay:int):
-        count = 0.
-        while delay>count:
-            if not threading.current_thread().is_alive():
-                return False
-            with self.lock:
-                if self.must_stop:
-                    return False
-            time.sleep(0.2)
-            count = count + 0.2
-        return True
+    def wait(self, delay:float, notifiable:bool = True) -> bool:
+        deadline:float = time.monotonic() + delay
+        while not self.must_stop:
+            remaining:float = deadline - time.monotonic()
+            if remaining <= 0.:
+                break
+            if self.event.wait(remaining):
+                self.event.clear()
+                if notifiable:
+                    break
+        return not self.must_stop
     
     def join(self, timeout:float = None):
         if self.thread and self.thread.is_alive():
-            self.thread.join(timeout)
\ No newline at end of file
+            self.thread.join(timeout)
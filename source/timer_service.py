@@ -0,0 +1,175 @@
+__author__      = "Jérôme Cuq"
+
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from thread_base import ThreadBase
+
+
+class Timer:
+    """A callback registered in a TimerService (see TimerService.call_later() and TimerService.call_periodic())
+    """
+    def __init__(self, deadline:float, period:float, callback, args:tuple):
+        # time.monotonic() date of next call
+        self.deadline:float = deadline
+        # None for a one-shot timer
+        self.period:float = period
+        self.callback = callback
+        self.args:tuple = args
+        self.cancelled:bool = False
+
+    # The callback will not be called anymore (it may be running while cancel() is called)
+    def cancel(self):
+        self.cancelled = True
+
+
+class TimerService:
+    """Heap of timer deadlines, with a single dispatcher thread that calls the callbacks of expired timers.
+       Callbacks are called in the dispatcher thread : they must not block, otherwise all other timers are delayed.
+       The lateness of each call (delay between the deadline and the actual call) is measured (see get_stats()).
+    """
+    def __init__(self):
+        self.logger: logging.Logger = logging.getLogger('hcs.timers')
+        # items are (deadline, sequence, timer)
+        self.heap:list[tuple[float,int,Timer]] = []
+        self.sequence = itertools.count()
+        self.dispatcher_thread: ThreadBase = ThreadBase()
+        self.calls:int = 0
+        self.total_lateness:float = 0.
+        self.max_lateness:float = 0.
+
+    def start(self):
+        self.dispatcher_thread.start(self.__dispatcher_thread)
+
+    def stop(self):
+        self.dispatcher_thread.stop()
+
+    def call_later(self, delay:float, callback, *args) -> Timer:
+        """Call callback(*args) once, in delay sec
+        """
+        return self.__add(Timer(time.monotonic()+delay, None, callback, args))
+
+    def call_periodic(self, period:float, callback, *args) -> Timer:
+        """Call callback(*args) every period sec, the first call being in period sec
+        """
+        return self.__add(Timer(time.monotonic()+period, period, callback, args))
+
+    def cancel(self, timer:Timer):
+        if timer:
+            timer.cancel()
+
+    def get_stats(self) -> dict[str,float]:
+        """return the number of callback calls, and the mean and max lateness (sec) of these calls
+        """
+        with self.dispatcher_thread.lock:
+            return {'calls':self.calls,
+                    'mean_lateness':self.total_lateness/self.calls if self.calls else 0.,
+                    'max_lateness':self.max_lateness}
+
+    ################################################################################
+    # PRIVATE METHODS
+    ################################################################################
+
+    def __add(self, timer:Timer) -> Timer:
+        with self.dispatcher_thread.lock:
+            heapq.heappush(self.heap, (timer.deadline, next(self.sequence), timer))
+            is_first:bool = self.heap[0][2] is timer
+        if is_first:
+            # the dispatcher thread must wait for this new deadline
+            self.dispatcher_thread.notify()
+        return timer
+
+    # return the timers whose deadline has passed (cancelled timers are dropped), and the delay until next deadline
+    def __pop_expired(self, now:float) -> tuple[list[Timer],float]:
+        expired:list[Timer] = []
+        with self.dispatcher_thread.lock:
+            while self.heap and (self.heap[0][2].cancelled or self.heap[0][0] <= now):
+                timer:Timer = heapq.heappop(self.heap)[2]
+                if not timer.cancelled:
+                    expired.append(timer)
+                    lateness:float = now - timer.deadline
+                    self.calls += 1
+                    self.total_lateness += lateness
+                    self.max_lateness = max(self.max_lateness, lateness)
+            delay:float = self.heap[0][0] - now if self.heap else 3600.
+        return (expired, delay)
+
+    def __dispatcher_thread(self):
+        self.logger.info('Timer dispatcher thread started')
+        isAlive:bool = True
+        while isAlive:
+            expired, delay = self.__pop_expired(time.monotonic())
+            for timer in expired:
+                try:
+                    timer.callback(*timer.args)
+                except Exception as exc:
+                    self.logger.error("Exception in timer callback : "+str(exc))
+                if timer.period and not timer.cancelled:
+                    # No drift : the next deadline is computed from the previous one, unless a whole period has been missed
+                    timer.deadline = max(timer.deadline + timer.period, time.monotonic())
+                    self.__add(timer)
+            if len(expired) == 0:
+                isAlive = self.dispatcher_thread.wait(delay)
+            else:
+                isAlive = not self.dispatcher_thread.must_stop
+        self.logger.info('Timer dispatcher thread has stopped')
+
+
+class AsyncioTimerService:
+    """Same API as TimerService, but timers are callbacks of an asyncio event loop (no dispatcher thread).
+       Timers may be added or cancelled from any thread, callbacks are always called in the event loop.
+    """
+    def __init__(self, loop:asyncio.AbstractEventLoop):
+        self.logger: logging.Logger = logging.getLogger('hcs.timers')
+        self.loop:asyncio.AbstractEventLoop = loop
+        self.stopped:bool = False
+        self.calls:int = 0
+        self.total_lateness:float = 0.
+        self.max_lateness:float = 0.
+
+    def start(self):
+        self.stopped = False
+
+    def stop(self):
+        # pending loop callbacks are ignored from now on
+        self.stopped = True
+
+    def call_later(self, delay:float, callback, *args) -> Timer:
+        return self.__add(Timer(self.loop.time()+delay, None, callback, args))
+
+    def call_periodic(self, period:float, callback, *args) -> Timer:
+        return self.__add(Timer(self.loop.time()+period, period, callback, args))
+
+    def cancel(self, timer:Timer):
+        if timer:
+            timer.cancel()
+
+    def get_stats(self) -> dict[str,float]:
+        return {'calls':self.calls,
+                'mean_lateness':self.total_lateness/self.calls if self.calls else 0.,
+                'max_lateness':self.max_lateness}
+
+    ################################################################################
+    # PRIVATE METHODS
+    ################################################################################
+
+    def __add(self, timer:Timer) -> Timer:
+        self.loop.call_soon_threadsafe(self.loop.call_at, timer.deadline, self.__on_timer, timer)
+        return timer
+
+    def __on_timer(self, timer:Timer):
+        if timer.cancelled or self.stopped:
+            return
+        lateness:float = self.loop.time() - timer.deadline
+        self.calls += 1
+        self.total_lateness += lateness
+        self.max_lateness = max(self.max_lateness, lateness)
+        try:
+            timer.callback(*timer.args)
+        except Exception as exc:
+            self.logger.error("Exception in timer callback : "+str(exc))
+        if timer.period and not timer.cancelled:
+            timer.deadline = max(timer.deadline + timer.period, self.loop.time())
+            self.loop.call_at(timer.deadline, self.__on_timer, timer)
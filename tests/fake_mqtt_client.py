@@ -25,6 +25,7 @@ class FakeMQTTClient:
         target_class.__init__ = source_class.__init__
         target_class.delete = source_class.delete
         target_class.set_callbacks = source_class.set_callbacks
+        target_class.set_event_loop = source_class.set_event_loop
         target_class.connect = source_class.connect
         target_class.disconnect = source_class.disconnect
         target_class.is_connected = source_class.is_connected
@@ -49,7 +50,7 @@ class FakeMQTTClient:
 
     instance = None
 
-    def __init__(self, clientid, broker, port, user, pwd, transport = "websockets", userdata = None, clean_session=True, ssl = True):
+    def __init__(self, clientid, broker, port, user, pwd, transport = "websockets", userdata = None, clean_session=True, ssl = True, mqtt_version = '3'):
         self.clientid = clientid
         self.user = user
         self.pwd = pwd
@@ -64,6 +65,8 @@ class FakeMQTTClient:
         self.bconnected = False
         self.published_messages = {}
         self.published_messages_json = {}
+        # (un)subscribe calls : ('subscribe' or 'unsubscribe', topic or list of topics)
+        self.subscriptions = []
         self.deleted = False
         FakeMQTTClient.instance = self
 
@@ -78,6 +81,9 @@ class FakeMQTTClient:
         self.on_message = on_message
         self.on_publish = on_publish
 
+    def set_event_loop(self, loop):
+        self.loop = loop
+
     def connect(self):
         self.bconnected = True
         reasoncode:ReasonCode = ReasonCode(PacketTypes.CONNACK)
@@ -92,12 +98,14 @@ class FakeMQTTClient:
         return self.bconnected
 
     def subscribe(self, topic, qos=1):
-        pass
+        self.subscriptions.append(('subscribe', topic))
 
     def unsubscribe(self, topic, qos=1):
-        pass
+        self.subscriptions.append(('unsubscribe', topic))
 
-    def publish(self, data, topic:str, retain:bool=False, qos=1) -> bool:
+    def publish(self, data, topic:str, retain:bool=False, qos=1, response_topic:str=None, correlation_data:bytes=None) -> bool:
+        if isinstance(data, bytes):
+            data = data.decode('utf-8')
         self.published_messages[topic] = data
         try:
             self.published_messages_json[topic] = json.loads(data)
@@ -0,0 +1,127 @@
+import pytest
+from tests.helpers import *
+
+from ack_matcher import AckMatcher, CorrelationAckMatcher
+from command_repeater import CommandRepeater, PendingCommand
+from errors import CfgError
+from timer_service import TimerService
+import logging
+import time
+
+
+# The goal here is to test the repeats of unacknowledged commands (backoff, max attempts, abandon)
+class TestCommandRepeater:
+    def __send(self, device:str, value):
+        self.sent.append((device, value, time.monotonic()))
+
+    def __gave_up(self, cmd:PendingCommand):
+        self.abandoned.append(cmd.device)
+
+    def test_backoff_and_abandon(self, caplog):
+        self.sent:list = []
+        self.abandoned:list = []
+        timers = TimerService()
+        timers.start()
+        try:
+            repeater = CommandRepeater(0.05, timers, max_attempts=3, backoff_factor=2., max_delay_sec=10, jitter=0., on_gave_up=self.__gave_up)
+            start = time.monotonic()
+            repeater.addCommand('device_1', 'setpoint', self.__send, 'device_1', 20.0)
+            repeater.addCommand('device_2', 'setpoint', self.__send, 'device_2', 21.0)
+            # acknowledged command is not repeated
+            repeater.removeCommand('device_2', 'setpoint')
+            # repeats after 0.05, 0.15 and 0.35 sec, then abandon at 0.75 sec
+            time.sleep(0.5)
+            assert [item[:2] for item in self.sent] == [('device_1', 20.0)]*3
+            delays = [item[2]-start for item in self.sent]
+            assert delays[0] >= 0.05 and delays[1] >= 0.15 and delays[2] >= 0.35
+            assert self.abandoned == []
+            assert repeater.get_stats() == {'outstanding':1, 'retried':3, 'abandoned':0}
+            time.sleep(0.4)
+            assert self.abandoned == ['device_1']
+            assert repeater.getCommand('device_1', 'setpoint') is None
+            assert repeater.get_stats() == {'outstanding':0, 'retried':3, 'abandoned':1}
+            repeater.stop()
+        finally:
+            timers.stop()
+
+    def test_single_wakeup_per_round(self, caplog):
+        self.sent:list = []
+        self.abandoned:list = []
+        timers = TimerService()
+        timers.start()
+        try:
+            repeater = CommandRepeater(0.05, timers, max_attempts=1, jitter=0., on_gave_up=self.__gave_up)
+            repeater.addCommand('device_1', 'setpoint', self.__send, 'device_1', 20.0)
+            repeater.addCommand('device_2', 'setpoint', self.__send, 'device_2', 21.0)
+            # one repeat round at 0.05 sec, one abandon round at 0.15 sec : no other timer call
+            time.sleep(0.3)
+            assert len(self.sent) == 2 and sorted(self.abandoned) == ['device_1', 'device_2']
+            assert timers.get_stats()['calls'] == 2
+            repeater.stop()
+        finally:
+            timers.stop()
+        check_no_error(caplog, False)
+
+    def test_replace_and_rename(self, caplog):
+        self.sent:list = []
+        self.abandoned:list = []
+        repeater = CommandRepeater(0.05, None, max_attempts=1, jitter=0., on_gave_up=self.__gave_up)
+        try:
+            repeater.addCommand('device_1', 'setpoint', self.__send, 'device_1', 20.0)
+            # new command replaces the pending one, and restarts its backoff
+            repeater.addCommand('device_1', 'setpoint', self.__send, 'device_1', 22.0)
+            repeater.set_device_name('device_1', 'device_A')
+            assert repeater.getCommand('device_A', 'setpoint').args == ('device_1', 22.0)
+            time.sleep(0.08)
+            assert [item[:2] for item in self.sent] == [('device_1', 22.0)]
+            repeater.remove_device_commands('device_A')
+            time.sleep(0.15)
+            assert self.abandoned == []
+            assert repeater.get_stats() == {'outstanding':0, 'retried':1, 'abandoned':0}
+        finally:
+            repeater.stop()
+        check_no_error(caplog, False)
+
+    def test_ack_matchers(self, caplog):
+        self.sent:list = []
+        logger = logging.getLogger('test')
+        repeater = CommandRepeater(10, None)
+        try:
+            matchers = {'any':AckMatcher.create({'type':'any'}, '/any', logger),
+                        'exact':AckMatcher.create({'type':'exact'}, '/exact', logger),
+                        'tolerance':AckMatcher.create({'type':'tolerance', 'tolerance':0.05}, '/tolerance', logger),
+                        'step':AckMatcher.create({'type':'step', 'step':0.5}, '/step', logger)}
+            for name, matcher in matchers.items():
+                repeater.addCommand(name, 'setpoint', self.__send, name, 20.4, value=20.4, ack_matcher=matcher)
+            # each matcher only accepts some of the reported values
+            assert [name for name in matchers if repeater.acknowledge(name, 'setpoint', 21.0)] == ['any']
+            assert [name for name in matchers if repeater.acknowledge(name, 'setpoint', 20.5)] == ['step']
+            assert [name for name in matchers if repeater.acknowledge(name, 'setpoint', 20.43)] == ['tolerance']
+            assert [name for name in matchers if repeater.acknowledge(name, 'setpoint', 20.4)] == ['exact']
+            assert repeater.get_stats()['outstanding'] == 0
+            assert sorted(repeater.get_ack_stats()) == sorted(matchers)
+            assert repeater.get_ack_stats()['step']['count'] == 1
+
+            # values sent on a midpoint between 2 steps are rounded half up by devices
+            step = matchers['step']
+            assert step.matches(20.25, 20.5) and step.matches(20.75, 21.0)
+            assert not step.matches(20.25, 20.0) and not step.matches(20.75, 20.5)
+
+            # with correlation data, only the response acknowledges the command
+            matcher = AckMatcher.create({'type':'correlation'}, '/correlation', logger)
+            correlation = matcher.new_correlation()
+            repeater.addCommand('dev', 'setpoint', self.__send, 'dev', 20.0, value=20.0, ack_matcher=matcher, correlation=correlation)
+            assert repeater.acknowledge('dev', 'setpoint', 20.0) == False
+            assert repeater.acknowledge('dev', 'setpoint', correlation=CorrelationAckMatcher().new_correlation()) == False
+            assert repeater.acknowledge('dev', 'setpoint', correlation=correlation) == True
+            assert repeater.acknowledge('dev', 'setpoint', correlation=correlation) == False
+        finally:
+            repeater.stop()
+        check_no_error(caplog, False)
+
+    def test_bad_ack_matcher(self, caplog):
+        logger = logging.getLogger('test')
+        with pytest.raises(CfgError):
+            AckMatcher.create({'type':'unknown'}, '/settings/message_repeater/ack_matcher', logger)
+        with pytest.raises(CfgError):
+            AckMatcher.create({'type':'step', 'step':0}, '/settings/message_repeater/ack_matcher', logger)
@@ -0,0 +1,115 @@
+import pytest
+from tests.helpers import *
+
+from config_writer import ConfigWriter
+from configuration import Configuration
+from timer_service import AsyncioTimerService, TimerService
+import os
+import asyncio
+import shutil
+import threading
+import time
+import yaml
+
+
+# The goal here is to test the debounced writes of the configuration file
+class TestConfigWriter:
+    def __write(self):
+        self.writes.append(time.monotonic())
+        self.threads.append(threading.current_thread())
+
+    def test_debounce(self, caplog):
+        self.writes:list = []
+        self.threads:list = []
+        timers = TimerService()
+        timers.start()
+        try:
+            writer = ConfigWriter(self.__write, timers, 0.1, 0.3)
+            writer.start()
+            # a burst of changes ends in a single write, a quiet period after the last change
+            for _ in range(50):
+                writer.mark_dirty()
+            time.sleep(0.05)
+            assert self.writes == []
+            time.sleep(0.1)
+            assert len(self.writes) == 1
+            # the file is written by the writer thread, not by the timers thread
+            assert self.threads[0] is writer.writer_thread.thread
+            # continuous changes are written at least every max_delay_sec
+            start = time.monotonic()
+            while time.monotonic() - start < 0.45:
+                writer.mark_dirty()
+                time.sleep(0.02)
+            assert len(self.writes) == 2
+            # unsaved changes are written on stop
+            writer.stop()
+            assert len(self.writes) == 3
+            assert writer.get_stats()['writes'] == 3
+            assert writer.flush() == False
+        finally:
+            timers.stop()
+        check_no_error(caplog, False)
+
+    def test_asyncio_mode(self, caplog):
+        self.writes:list = []
+        self.threads:list = []
+        async def run():
+            timers = AsyncioTimerService(asyncio.get_running_loop())
+            timers.start()
+            writer = ConfigWriter(self.__write, timers, 0.05, 0.2, asyncio.get_running_loop())
+            writer.start()
+            writer.mark_dirty()
+            await asyncio.sleep(0.15)
+            writer.stop()
+            timers.stop()
+        asyncio.run(run())
+        # the file is written once, in the loop executor (not in the loop thread)
+        assert len(self.writes) == 1
+        assert self.threads[0] is not threading.main_thread()
+        check_no_error(caplog, False)
+
+    def test_configuration_writer(self, caplog, tmp_path):
+        shutil.copy(os.path.join(config_path, 'minimal_configuration.yaml'), os.path.join(tmp_path, 'test_default_configuration.yaml'))
+        config_filename = os.path.join(tmp_path, 'test_configuration.yaml')
+        timers = TimerService()
+        timers.start()
+        try:
+            config = Configuration(str(tmp_path), 'test_')
+            assert os.path.exists(config_filename)
+            config.start_writer(timers)
+            for idx in range(50):
+                assert not config.add_device('Dev'+str(idx), 'climate_'+str(idx), 'mqtt_ha', {})
+            writer = config.writer
+            assert writer.get_stats() == {'changes':50, 'writes':0}
+            config.stop_writer()
+            assert writer.get_stats() == {'changes':50, 'writes':1}
+            # the file has been replaced in a single write, without leaving the temporary file
+            with open(config_filename, 'r', encoding='utf-8') as config_file:
+                assert len(yaml.safe_load(config_file)['devices']) == 50
+            assert sorted(os.listdir(tmp_path)) == ['test_configuration.yaml', 'test_default_configuration.yaml']
+            # without writer, changes are saved at once
+            assert not config.delete_device('Dev0')
+            with open(config_filename, 'r', encoding='utf-8') as config_file:
+                assert len(yaml.safe_load(config_file)['devices']) == 49
+        finally:
+            timers.stop()
+        check_no_error(caplog, False)
+
+    def test_rejected_change_keeps_unsaved_changes(self, caplog, tmp_path):
+        shutil.copy(os.path.join(config_path, 'minimal_configuration.yaml'), os.path.join(tmp_path, 'test_default_configuration.yaml'))
+        config_filename = os.path.join(tmp_path, 'test_configuration.yaml')
+        timers = TimerService()
+        timers.start()
+        try:
+            config = Configuration(str(tmp_path), 'test_')
+            config.start_writer(timers)
+            assert not config.add_device('DevX', 'climate_x', 'mqtt_ha', {})
+            # the rejected change is undone in memory, not by reloading the file (DevX is not written yet)
+            assert config.set_scheduler_manual_mode_reset_event('bad value')
+            assert config.get_scheduler_manual_mode_reset_event() == 'setpoint_change'
+            assert config.get_device('DevX') is not None
+            config.stop_writer()
+            with open(config_filename, 'r', encoding='utf-8') as config_file:
+                assert list(yaml.safe_load(config_file)['devices'][0]) == ['DevX']
+        finally:
+            timers.stop()
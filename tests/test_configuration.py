@@ -82,4 +82,113 @@ class TestConfiguration:
         assert 'value' in excinfo.value.params and excinfo.value.params['value']==25
         assert find_first_error(caplog)
         assert "scheduler.settings.manual_mode_reset_event" in caplog.text
-        assert "25" in caplog.text
\ No newline at end of file
+        assert "25" in caplog.text
+
+    def test_snapshot(self):
+        config:Configuration = Configuration(config_path, 'realistic1_', auto_save=False)
+        snapshot = config.get_snapshot()
+        # No change : same snapshot
+        assert config.get_snapshot() is snapshot
+        # A snapshot is immutable
+        with pytest.raises(TypeError):
+            snapshot.scheduler['active_schedule'] = None
+        assert isinstance(snapshot.scheduler['schedules'][0]['schedule_items'][0]['devices'], tuple)
+
+        # After a change, only the changed parts are new objects
+        alias = snapshot.scheduler['schedules'][-1]['alias']
+        assert not config.set_temperature_sets([{'alias':'Local', 'devices':[{'device_name':'Boiler', 'setpoint':10.0}]}], alias)
+        new_snapshot = config.get_snapshot()
+        assert new_snapshot.version > snapshot.version
+        assert new_snapshot.scheduler['temperature_sets'] is snapshot.scheduler['temperature_sets']
+        for schedule, old_schedule in zip(new_snapshot.scheduler['schedules'], snapshot.scheduler['schedules']):
+            assert (schedule is old_schedule) == (schedule['alias'] != alias)
+        # A failed change does not change the snapshot
+        assert config.set_active_schedule('unknown')
+        assert config.get_snapshot() is new_snapshot
+
+    def test_save_keeps_dates(self):
+        config:Configuration = Configuration(config_path, 'realistic1_', auto_save=False)
+        config.config_filename = os.path.join(config_path, 'test_save_configuration.yaml')
+        try:
+            config.save()
+            # In memory dates are not converted by saving
+            start_time = config.get_schedules()[0]['schedule_items'][0]['timeslots_sets'][0]
+            assert all(isinstance(timeslot['start_time'], datetime.time)
+                       for key in ('timeslots', 'timeslots_A', 'timeslots_B') for timeslot in start_time.get(key, []))
+            saved:Configuration = Configuration(config_path, 'test_save_', auto_save=False)
+            assert saved.get_scheduler() == config.get_scheduler()
+        finally:
+            remove_file(config.config_filename)
+
+    def test_indexes(self):
+        # The goal here is to test that lookups by name stay in sync with configuration changes
+        config:Configuration = Configuration(config_path, 'minimal_', auto_save=False)
+        assert not config.add_device('Dev1', 'climate_1', 'mqtt_ha', {})
+        assert not config.add_device('Dev2', 'climate_2', 'mqtt_ha', {})
+        assert not config.change_device_name('Dev2', 'Dev3')
+        assert config.get_device('Dev2') is None and config.get_device('Dev3')['entity'] == 'climate_2'
+        assert not config.set_devices_order(['Dev3', 'Dev1'])
+        assert list(config.get_devices()) == ['Dev3', 'Dev1']
+        assert not config.delete_device('Dev3')
+        assert config.get_device('Dev3') is None
+
+        assert not config.set_temperature_sets([{'alias': 'TSet1', 'devices':[{'device_name':'Dev1','setpoint':10.0}]}])
+        items = [{'devices':['Dev1'],
+                  'timeslots_sets':[{'dates':['1','2','3','4','5','6','7'],'timeslots':[{'start_time':'00:00:00', 'temperature_set':'TSet2'}]}]}]
+        # a rejected schedule is not indexed
+        assert config.set_schedule({'alias':'sched', 'schedule_items':items}).id == ECfgError.BAD_REFERENCE
+        assert config.get_schedule('sched') is None
+        schedule = {'alias':'sched', 'schedule_items':items,
+                    'temperature_sets':[{'alias': 'TSet2', 'devices':[{'device_name':'Dev1','setpoint':12.0}]}]}
+        assert not config.set_schedule(schedule)
+        assert config.get_temperature_set('TSet2', 'sched')['devices'][0]['setpoint'] == 12.0
+        assert not config.change_schedule_name('sched', 'sched2')
+        assert config.get_schedule('sched') is None and config.get_schedule('sched2') is schedule
+        assert config.get_temperature_set('TSet2', 'sched2') is not None
+        assert not config.change_temperature_set_name('TSet1', 'TSet3')
+        assert config.get_temperature_set('TSet1') is None and config.get_temperature_set('TSet3') is not None
+        assert not config.change_temperature_set_name('TSet2', 'TSet4', 'sched2')
+        assert config.get_temperature_set('TSet4', 'sched2') is not None
+        assert not config.delete_schedule('sched2')
+        assert config.get_schedule('sched2') is None and config.get_temperature_set('TSet4', 'sched2') is None
+
+    def test_rejected_tempset_name(self, caplog):
+        # The goal here is to test that a rejected temperature set rename is undone in place
+        config:Configuration = Configuration(config_path, 'minimal_', auto_save=False)
+        assert not config.add_device('Dev1', 'climate_1', 'mqtt_ha', {})
+        items = [{'devices':['Dev1'],
+                  'timeslots_sets':[{'dates':['1','2','3','4','5','6','7'],'timeslots':[{'start_time':'00:00:00', 'temperature_set':'A'}]}]}]
+        schedule = {'alias':'sched', 'schedule_items':items,
+                    'temperature_sets':[{'alias':'A', 'devices':[{'device_name':'Dev1','setpoint':12.0}]},
+                                        {'alias':'B', 'parent':'A', 'devices':[]}]}
+        assert not config.set_schedule(schedule)
+        scheduler = config.get_scheduler()
+        # the parent of local temperature set B is not renamed : 'A' is not found anymore
+        assert config.change_temperature_set_name('A', 'C', 'sched').id == ECfgError.BAD_REFERENCE
+        assert config.get_scheduler() is scheduler and config.get_schedule('sched') is schedule
+        assert schedule['temperature_sets'][0]['alias'] == 'A'
+        assert items[0]['timeslots_sets'][0]['timeslots'][0]['temperature_set'] == 'A'
+        assert config.get_temperature_set('A', 'sched') is schedule['temperature_sets'][0]
+        assert config.get_temperature_set('C', 'sched') is None
+
+    def test_device_ack_matchers(self, caplog):
+        # The goal here is to test that device acknowledge matchers are checked when devices are added
+        config:Configuration = Configuration(config_path, 'f1_', auto_save=False)
+        params:dict = dict(config.get_device('Dev1')['protocol']['params'])
+        params['ack_matcher'] = {'type':'step', 'step':-1}
+        assert config.add_device('Dev4', 'climate_4', 'mqtt_ha', params).id == ECfgError.BAD_VALUE
+        # a 'correlation' matcher needs a response topic...
+        params['ack_matcher'] = {'type':'correlation'}
+        assert config.add_device('Dev4', 'climate_4', 'mqtt_ha', params).id == ECfgError.MISSING_NODES
+        # ... and a MQTT v5 client
+        params['on_setpoint_response_subtopic'] = 'new_setpoint/response'
+        assert config.add_device('Dev4', 'climate_4', 'mqtt_ha', params).id == ECfgError.BAD_VALUE
+        assert config.get_device('Dev4') is None
+        config.get_protocols()['mqtt'][0]['mqtt_version'] = '5'
+        assert not config.add_device('Dev4', 'climate_4', 'mqtt_ha', params)
+        config.get_protocols()['mqtt'][0]['mqtt_version'] = '3'
+        assert config.change_device_entity('Dev4', 'climate_5', params).id == ECfgError.BAD_VALUE
+        assert config.get_device('Dev4')['entity'] == 'climate_4'
+        # the default matcher applies to devices that do not override it
+        config.settings['message_repeater']['ack_matcher'] = {'type':'correlation'}
+        assert config.change_device_entity('Dev1', 'frisquet_boiler', {}).id == ECfgError.MISSING_NODES
@@ -0,0 +1,98 @@
+import pytest
+from tests.helpers import *
+
+from protocols.ingress_queue import IngressQueue
+from protocols.mqtt_protocol_handler import MQTTProtocolHandler
+from protocols.protocol_handler_callbacks import ProtocolHandlerCallbacks
+from protocols import mqttclient
+from tests.fake_mqtt_client import FakeMQTTClient
+import threading
+import time
+
+
+class RecordingCallbacks(ProtocolHandlerCallbacks):
+    def __init__(self):
+        self.messages:list = []
+        self.threads:set = set()
+        self.release:threading.Event = threading.Event()
+
+    def on_protocol_message(self, protocol_type: str, client_name: str, message):
+        self.release.wait(2)
+        self.messages.append(message.payload)
+        self.threads.add(threading.get_ident())
+
+    def is_droppable_message(self, protocol_type: str, client_name: str, message) -> bool:
+        return message.topic == 'device/temperature'
+
+
+# The goal here is to test the bounded queue between network threads and the server logic :
+# the oldest telemetry messages are dropped when the queue is full, commands are never dropped
+class TestIngressQueue:
+    def __call(self, name:str):
+        self.release.wait(2)
+        self.calls.append(name)
+
+    def test_overflow_policy(self, caplog):
+        self.calls:list = []
+        self.release = threading.Event()
+        queue = IngressQueue('test', 3)
+        queue.start()
+        try:
+            # the worker is blocked by the first item
+            queue.put(True, self.__call, 'T0')
+            time.sleep(0.05)
+            for name in ['T1', 'C1', 'T2', 'T3', 'C2', 'T4', 'C3', 'C4']:
+                queue.put(name[0]=='T', self.__call, name)
+            assert queue.get_metrics()['depth'] == 4
+            time.sleep(0.05)
+            self.release.set()
+            time.sleep(0.1)
+        finally:
+            queue.stop()
+        # T1 to T4 are dropped to make room for newer messages, C4 is added even if the queue is full
+        assert self.calls == ['T0', 'C1', 'C2', 'C3', 'C4']
+        metrics = queue.get_metrics()
+        assert metrics['depth'] == 0 and metrics['max_depth'] == 4
+        assert metrics['processed'] == 5 and metrics['dropped'] == 4
+        assert metrics['max_wait'] >= 0.05 and 0. < metrics['mean_wait'] <= metrics['max_wait']
+        check_no_error(caplog, False)
+
+    def test_callback_exception(self, caplog):
+        self.calls:list = []
+        self.release = threading.Event()
+        self.release.set()
+        queue = IngressQueue('test', 10)
+        queue.start()
+        try:
+            queue.put(False, lambda: 1/0)
+            queue.put(False, self.__call, 'after')
+            time.sleep(0.1)
+        finally:
+            queue.stop()
+        assert self.calls == ['after']
+        assert 'exception while handling a message' in find_first_error(caplog).getMessage()
+
+    def test_protocol_handler(self, caplog):
+        FakeMQTTClient.replace_methods(mqttclient.MQTTClient)
+        try:
+            callbacks = RecordingCallbacks()
+            config = [{'name':'mqtt_ha', 'user':'mqtt', 'pwd':'pwd', 'broker':'127.0.0.1', 'port':1884, 'ssl':False, 'clean_session':True}]
+            handler = MQTTProtocolHandler(config, callbacks, None, {'max_size':2})
+            try:
+                FakeMQTTClient.send_fake_message_raw('t0', 'device/temperature')
+                time.sleep(0.05)
+                # network thread is not blocked by the server logic
+                for idx in range(1, 5):
+                    FakeMQTTClient.send_fake_message_raw('t'+str(idx), 'device/temperature')
+                FakeMQTTClient.send_fake_message_raw('cmd', 'remote/command')
+                callbacks.release.set()
+                time.sleep(0.1)
+                metrics = handler.get_ingress_metrics()
+            finally:
+                handler.stop()
+        finally:
+            FakeMQTTClient.restore_methods(mqttclient.MQTTClient)
+        assert callbacks.messages == ['t0', 't4', 'cmd']
+        assert callbacks.threads != {threading.get_ident()}
+        assert metrics['dropped'] == 3 and metrics['processed'] == 3
+        check_no_error(caplog, False)
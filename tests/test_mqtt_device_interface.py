@@ -0,0 +1,158 @@
+import pytest
+from tests.helpers import *
+
+from device import Device
+from device_interfaces.device_interface_callbacks import DeviceInterfaceCallbacks
+from device_interfaces.mqtt_device_interface import MQTTDeviceInterface
+import paho.mqtt.client as mqtt
+from paho.mqtt.properties import Properties
+from paho.mqtt.packettypes import PacketTypes
+
+
+def create_device(name:str, entity:str) -> Device:
+    return Device(name, entity, 'mqtt', 'mqtt_ha', {'device_base_topic':'homeassistant/climate/'+entity+'/',
+                                                    'on_current_temp_subtopic':'current_temperature',
+                                                    'on_setpoint_subtopic':'/temperature',
+                                                    'on_state_subtopic':'state',
+                                                    'on_min_temp_subtopic':'min_temp',
+                                                    'on_max_temp_subtopic':'max_temp',
+                                                    'set_setpoint_subtopic':'new_setpoint'})
+
+def create_message(topic:str, payload:str) -> mqtt.MQTTMessage:
+    message:mqtt.MQTTMessage = mqtt.MQTTMessage(topic=topic.encode('utf-8'))
+    message.payload = payload
+    return message
+
+
+class RecordingCallbacks(DeviceInterfaceCallbacks):
+    def __init__(self):
+        self.temperatures:list = []
+        self.setpoints:list = []
+        self.messages:list = []
+        self.acks:list = []
+        self.device_messages:list = []
+
+    def on_device_current_temperature(self, device:Device, value:float):
+        self.temperatures.append((device.name, value))
+
+    def on_device_setpoint(self, device:Device, previousValue:float):
+        self.setpoints.append((device.name, device.setpoint))
+
+    def on_device_ack(self, device:Device, param_name:str, correlation_data:bytes):
+        self.acks.append((device.name, param_name, correlation_data))
+
+    def send_message_to_device(self, device:Device, protocol_msg_params:dict):
+        self.device_messages.append(protocol_msg_params)
+
+    def send_message_to_client(self, protocol_type:str, client_name:str, protocol_msg_params:dict):
+        self.messages.append((client_name, protocol_msg_params['type'], protocol_msg_params['topic']))
+
+
+# The goal here is to test the dispatch of device messages through the topics index
+class TestMQTTDeviceInterface:
+    def test_topics_index(self, caplog):
+        callbacks = RecordingCallbacks()
+        devices = {'dev1':create_device('dev1', 'climate_1'), 'dev2':create_device('dev2', 'climate_2')}
+        interface = MQTTDeviceInterface(devices, [], callbacks)
+        assert interface.topics_index['homeassistant/climate/climate_1/temperature'] == [(devices['dev1'], 'on_setpoint_subtopic', True)]
+        # topics of messages that are not handled are not indexed
+        assert not 'homeassistant/climate/climate_1/new_setpoint' in interface.topics_index
+
+        # an available device with the same topics as a configured device gets the messages too, without notification
+        available = {'climate_1':create_device('Living room', 'climate_1'), 'climate_3':create_device('Kitchen', 'climate_3')}
+        interface.on_available_devices(available)
+        interface.on_client_message('mqtt_ha', create_message('homeassistant/climate/climate_1/current_temperature', '19.5'))
+        interface.on_client_message('mqtt_ha', create_message('homeassistant/climate/climate_3/current_temperature', '17.0'))
+        interface.on_client_message('mqtt_ha', create_message('homeassistant/climate/climate_9/current_temperature', '17.0'))
+        assert callbacks.temperatures == [('dev1', 19.5)]
+        assert devices['dev1'].current_temperature == 19.5
+        assert available['climate_1'].current_temperature == 19.5
+        assert available['climate_3'].current_temperature == 17.0
+
+        # the index follows the configured devices
+        interface.on_devices({'dev2':devices['dev2']})
+        interface.on_client_message('mqtt_ha', create_message('homeassistant/climate/climate_1/temperature', '21.0'))
+        interface.on_client_message('mqtt_ha', create_message('homeassistant/climate/climate_2/temperature', '20.0'))
+        assert callbacks.setpoints == [('dev2', 20.0)]
+        assert available['climate_1'].setpoint == 21.0
+
+        # deleting the last device
+        interface.on_devices({})
+        interface.on_client_message('mqtt_ha', create_message('homeassistant/climate/climate_2/current_temperature', '18.0'))
+        assert callbacks.temperatures == [('dev1', 19.5)]
+        assert callbacks.messages[-1] == ('mqtt_ha', 'unsubscribe', ['homeassistant/climate/climate_2/current_temperature',
+                                                                     'homeassistant/climate/climate_2/temperature',
+                                                                     'homeassistant/climate/climate_2/state',
+                                                                     'homeassistant/climate/climate_2/min_temp',
+                                                                     'homeassistant/climate/climate_2/max_temp'])
+        check_no_error(caplog, False)
+
+    def test_droppable_messages(self, caplog):
+        interface = MQTTDeviceInterface({'dev1':create_device('dev1', 'climate_1')}, [], RecordingCallbacks())
+        # only current temperatures are telemetry : states and setpoints must never be dropped
+        assert interface.is_droppable_message('mqtt_ha', create_message('homeassistant/climate/climate_1/current_temperature', '19.5'))
+        assert not interface.is_droppable_message('mqtt_ha', create_message('homeassistant/climate/climate_1/temperature', '20.0'))
+        assert not interface.is_droppable_message('mqtt_ha', create_message('homeassistant/climate/climate_1/state', 'heat'))
+        assert not interface.is_droppable_message('mqtt_ha', create_message('remote/command', '{}'))
+        check_no_error(caplog, False)
+
+    def test_batched_subscriptions(self, caplog):
+        callbacks = RecordingCallbacks()
+        devices = {'dev1':create_device('dev1', 'climate_1'), 'dev2':create_device('dev2', 'climate_2')}
+        interface = MQTTDeviceInterface(devices, [], callbacks)
+        # a single subscribe message for all devices on connection
+        interface.on_client_connect('mqtt_ha')
+        assert len(callbacks.messages) == 1
+        assert callbacks.messages[0][0:2] == ('mqtt_ha', 'subscribe')
+        assert len(callbacks.messages[0][2]) == 10
+        assert 'homeassistant/climate/climate_2/max_temp' in callbacks.messages[0][2]
+
+        # dev2 is renamed (same topics) and dev1 is replaced by dev3
+        callbacks.messages.clear()
+        interface.on_devices({'dev2 renamed':create_device('dev2 renamed', 'climate_2'), 'dev3':create_device('dev3', 'climate_3')})
+        assert [message[0:2] for message in callbacks.messages] == [('mqtt_ha', 'subscribe'), ('mqtt_ha', 'unsubscribe')]
+        # topics of the renamed device are neither subscribed again nor unsubscribed
+        assert len(callbacks.messages[0][2]) == 5 and all('climate_3' in topic for topic in callbacks.messages[0][2])
+        assert len(callbacks.messages[1][2]) == 5 and all('climate_1' in topic for topic in callbacks.messages[1][2])
+        check_no_error(caplog, False)
+
+    def test_wildcard_subscriptions(self, caplog):
+        callbacks = RecordingCallbacks()
+        devices = {'dev1':create_device('dev1', 'climate_1'), 'dev2':create_device('dev2', 'climate_2')}
+        interface = MQTTDeviceInterface(devices, [], callbacks, True)
+        interface.on_client_connect('mqtt_ha')
+        assert callbacks.messages == [('mqtt_ha', 'subscribe', ['homeassistant/climate/+/+'])]
+
+        # adding or removing a device under the same prefix does not need any subscription
+        callbacks.messages.clear()
+        interface.on_devices({'dev2':devices['dev2'], 'dev3':create_device('dev3', 'climate_3')})
+        assert callbacks.messages == []
+        # messages of other entities are filtered locally
+        interface.on_client_message('mqtt_ha', create_message('homeassistant/climate/climate_1/current_temperature', '19.5'))
+        interface.on_client_message('mqtt_ha', create_message('homeassistant/climate/climate_3/current_temperature', '18.0'))
+        assert callbacks.temperatures == [('dev3', 18.0)]
+
+        # the wildcard topic is unsubscribed with the last device under its prefix
+        other = create_device('dev4', 'climate_4')
+        other.protocol_params['device_base_topic'] = 'zigbee2mqtt/climate_4'
+        interface.on_devices({'dev4':other})
+        assert callbacks.messages == [('mqtt_ha', 'subscribe', ['zigbee2mqtt/+/+']), ('mqtt_ha', 'unsubscribe', ['homeassistant/climate/+/+'])]
+        check_no_error(caplog, False)
+
+    def test_setpoint_response(self, caplog):
+        callbacks = RecordingCallbacks()
+        device = create_device('dev1', 'climate_1')
+        device.protocol_params['on_setpoint_response_subtopic'] = 'new_setpoint/response'
+        interface = MQTTDeviceInterface({'dev1':device}, [], callbacks)
+        # the response topic is only sent with correlation data
+        interface.set_device_parameter(device, 'setpoint', 20.5)
+        interface.set_device_parameter(device, 'setpoint', 21.0, b'1234')
+        assert callbacks.device_messages == [{'type':'publish', 'topic':'homeassistant/climate/climate_1/new_setpoint', 'payload':'20.5'},
+                                             {'type':'publish', 'topic':'homeassistant/climate/climate_1/new_setpoint', 'payload':'21.0',
+                                              'response_topic':'homeassistant/climate/climate_1/new_setpoint/response', 'correlation_data':b'1234'}]
+        message = create_message('homeassistant/climate/climate_1/new_setpoint/response', 'ok')
+        message.properties = Properties(PacketTypes.PUBLISH)
+        message.properties.CorrelationData = b'1234'
+        interface.on_client_message('mqtt_ha', message)
+        assert callbacks.acks == [('dev1', 'setpoint', b'1234')]
+        check_no_error(caplog, False)
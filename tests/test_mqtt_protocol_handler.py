@@ -0,0 +1,41 @@
+import pytest
+from tests.helpers import *
+
+from protocols.mqtt_protocol_handler import MQTTProtocolHandler
+from protocols.protocol_handler_callbacks import ProtocolHandlerCallbacks
+from protocols import mqttclient
+from tests.fake_mqtt_client import FakeMQTTClient
+
+
+# The goal here is to test the batched subscriptions of the MQTT protocol handler
+class TestMQTTProtocolHandler:
+    def test_subscribe_chunks(self, caplog):
+        FakeMQTTClient.replace_methods(mqttclient.MQTTClient)
+        try:
+            config = [{'name':'mqtt_ha', 'user':'mqtt', 'pwd':'pwd', 'broker':'127.0.0.1', 'port':1884, 'ssl':False, 'clean_session':True,
+                       'subscribe_chunk_size':4}]
+            handler = MQTTProtocolHandler(config, ProtocolHandlerCallbacks())
+            handler.connect()
+            topics = ['homeassistant/climate/climate_'+str(idx)+'/temperature' for idx in range(10)]
+            handler.send_message('mqtt_ha', {'type':'subscribe', 'topic':topics})
+            handler.send_message('mqtt_ha', {'type':'unsubscribe', 'topic':topics[:3]})
+            handler.send_message('mqtt_ha', {'type':'subscribe', 'topic':'homeassistant/status'})
+            assert FakeMQTTClient.instance.subscriptions == [('subscribe', topics[0:4]), ('subscribe', topics[4:8]), ('subscribe', topics[8:10]),
+                                                             ('unsubscribe', topics[0:3]),
+                                                             ('subscribe', 'homeassistant/status')]
+            handler.stop()
+        finally:
+            FakeMQTTClient.restore_methods(mqttclient.MQTTClient)
+        check_no_error(caplog, False)
+
+    def test_bad_chunk_size(self, caplog):
+        FakeMQTTClient.replace_methods(mqttclient.MQTTClient)
+        try:
+            config = [{'name':'mqtt_ha', 'user':'mqtt', 'pwd':'pwd', 'broker':'127.0.0.1', 'port':1884, 'ssl':False, 'clean_session':True,
+                       'subscribe_chunk_size':0}]
+            handler = MQTTProtocolHandler(config, ProtocolHandlerCallbacks())
+            assert config[0]['subscribe_chunk_size'] == 100
+            handler.stop()
+        finally:
+            FakeMQTTClient.restore_methods(mqttclient.MQTTClient)
+        assert 'subscribe_chunk_size' in find_first_error(caplog).getMessage()
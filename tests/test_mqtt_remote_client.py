@@ -0,0 +1,86 @@
+import pytest
+from tests.helpers import *
+
+from device import Device
+from protocols import mqttclient
+from remote.mqtt_remote_client import MQTTRemoteClient
+from remote.remote_control_callbacks import RemoteControlCallbacks
+from timer_service import TimerService
+from tests.fake_mqtt_client import FakeMQTTClient
+from errors import CfgError
+import json
+import time
+
+
+STATES_TOPIC = 'heatingcontrol/serverdata/devices/device_1'
+
+def create_remote_config(coalescing:dict) -> dict:
+    return {'name':'flutter',
+            'protocol':{'name':'mqtt_ha',
+                        'params':{'is_alive_period':5,
+                                  'receive_topic':'heatingcontrol/command',
+                                  'send_command_response_topic':'heatingcontrol/on_cmd_response',
+                                  'send_device_states_base_topic':'heatingcontrol/serverdata/devices',
+                                  'send_devices_topic':'heatingcontrol/serverdata/on_devices',
+                                  'send_entities_topic':'heatingcontrol/serverdata/on_entities',
+                                  'send_is_alive_topic':'heatingcontrol/serverdata/is_alive',
+                                  'send_scheduler_topic':'heatingcontrol/serverdata/on_scheduler',
+                                  'telemetry_coalescing':coalescing}}}
+
+
+# The goal here is to test the coalescing of device states publishes caused by current temperature changes
+class TestMQTTRemoteClient:
+    def __set_temperature(self, remote:MQTTRemoteClient, device:Device, value:float):
+        device.current_temperature = value
+        remote.on_device_current_temperature(device, value)
+
+    def __publish(self, data, topic:str, retain:bool=False, qos=1) -> bool:
+        if topic == STATES_TOPIC:
+            self.published.append(json.loads(data)['current_temp'])
+        return True
+
+    def test_telemetry_coalescing(self, caplog):
+        self.published:list = []
+        FakeMQTTClient.replace_methods(mqttclient.MQTTClient)
+        timers = TimerService()
+        timers.start()
+        try:
+            client = mqttclient.MQTTClient('id', '127.0.0.1', 1884, 'user', 'pwd')
+            client.publish = self.__publish
+            device = Device('device#1', 'climate_1', 'mqtt', 'mqtt_ha', {})
+            remote = MQTTRemoteClient('flutter', create_remote_config({'min_interval_sec':0.1, 'max_staleness_sec':0.3, 'deadband':0.2}),
+                                      client, {'device#1':device}, {}, '1.0', RemoteControlCallbacks(), timers)
+            # first value is published at once, next ones are merged until min_interval_sec
+            self.__set_temperature(remote, device, 19.0)
+            self.__set_temperature(remote, device, 19.5)
+            self.__set_temperature(remote, device, 19.6)
+            assert self.published == [19.0]
+            time.sleep(0.15)
+            assert self.published == [19.0, 19.6]
+            # a change within the deadband waits for max_staleness_sec
+            self.__set_temperature(remote, device, 19.7)
+            time.sleep(0.15)
+            assert self.published == [19.0, 19.6]
+            time.sleep(0.25)
+            assert self.published == [19.0, 19.6, 19.7]
+            # other changes are published at once, with the pending temperature
+            self.__set_temperature(remote, device, 21.0)
+            self.__set_temperature(remote, device, 22.0)
+            device.setpoint = 20.0
+            remote.on_device_setpoint(device)
+            time.sleep(0.15)
+            assert self.published == [19.0, 19.6, 19.7, 21.0, 22.0]
+            remote.stop()
+        finally:
+            timers.stop()
+            FakeMQTTClient.restore_methods(mqttclient.MQTTClient)
+        check_no_error(caplog, False)
+
+    def test_bad_coalescing_settings(self, caplog):
+        FakeMQTTClient.replace_methods(mqttclient.MQTTClient)
+        try:
+            client = mqttclient.MQTTClient('id', '127.0.0.1', 1884, 'user', 'pwd')
+            with pytest.raises(CfgError):
+                MQTTRemoteClient('flutter', create_remote_config({'deadband':'bad'}), client, {}, {}, '1.0', RemoteControlCallbacks())
+        finally:
+            FakeMQTTClient.restore_methods(mqttclient.MQTTClient)
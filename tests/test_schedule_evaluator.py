@@ -0,0 +1,92 @@
+import pytest
+from tests.helpers import *
+
+# numpy is an optional dependency of the server
+np = pytest.importorskip('numpy')
+
+from schedule_evaluator import ScheduleEvaluator
+from schedule_compiler import ScheduleCompiler
+from configuration import Configuration
+from errors import *
+import datetime
+
+
+class TestScheduleEvaluator:
+    def test_stats(self, caplog):
+        config:Configuration = Configuration(config_path, 'f1_', auto_save=False)
+        evaluator = ScheduleEvaluator(config, 2025)
+        cfgErr, stats = evaluator.evaluate([config.get_schedule('S1'), config.get_schedule('S2')])
+        assert not cfgErr
+        assert len(stats) == 2
+        # S1 : Dev2 is always at 17.0
+        assert stats[0]['Dev2'] == {'heating_hours':8760., 'mean_setpoint':17.0, 'min_setpoint':17.0, 'max_setpoint':17.0}
+        # S1 : Dev1 is at 16.0 on wednesday afternoons (53 wednesdays in 2025), 18.0 otherwise
+        assert stats[0]['Dev1']['heating_hours'] == 8760.
+        assert stats[0]['Dev1']['min_setpoint'] == 16.0 and stats[0]['Dev1']['max_setpoint'] == 18.0
+        assert stats[0]['Dev1']['mean_setpoint'] == pytest.approx(18.0 - 2.0*53*720/525600)
+        # S2 : only Dev1
+        assert list(stats[1].keys()) == ['Dev1']
+        # heating threshold : only the minutes above 17.0 are counted
+        stats = evaluator.evaluate([config.get_schedule('S1')], 17.0)[1]
+        assert stats[0]['Dev1']['heating_hours'] == pytest.approx(8760. - 53*12)
+        assert stats[0]['Dev2']['heating_hours'] == 0.
+        check_no_error(caplog, False)
+
+    def test_consistency_with_timeline(self, caplog):
+        # Weeks A/B and inheritance : the vectorized setpoints must match the timeline evaluation
+        config:Configuration = Configuration(config_path, 'realistic1_', auto_save=False)
+        config_scheduler = config.get_scheduler()
+        for year in (2025, 2026, 2027):
+            evaluator = ScheduleEvaluator(config, year)
+            compiler = ScheduleCompiler(config_scheduler)
+            for schedule in config_scheduler['schedules']:
+                timeline = compiler.compile(schedule['alias'])
+                cfgErr, device_names, setpoints = evaluator.get_setpoints_array(schedule)
+                assert not cfgErr
+                assert setpoints.shape[1] == (366 if year%4==0 else 365)*1440
+                for minute in range(0, setpoints.shape[1], 97):
+                    date = datetime.datetime(year, 1, 1) + datetime.timedelta(minutes=minute)
+                    for idx, name in enumerate(device_names):
+                        value = timeline.get_setpoint(name, date)
+                        if value:
+                            assert setpoints[idx][minute] == value[0]
+                        else:
+                            assert np.isnan(setpoints[idx][minute])
+        check_no_error(caplog, False)
+
+    def test_candidate_replaces_schedule(self, caplog):
+        config:Configuration = Configuration(config_path, 'f1_', auto_save=False)
+        config_scheduler = config.get_scheduler()
+        schedule = config.get_schedule('S2')
+        candidate = {'alias':'S2', 'schedule_items':[{'devices':['Dev3'], 'timeslots_sets':schedule['schedule_items'][0]['timeslots_sets']}]}
+        cfgErr, stats = ScheduleEvaluator(config, 2025).evaluate([candidate])
+        assert not cfgErr
+        assert list(stats[0].keys()) == ['Dev3']
+        assert stats[0]['Dev3']['mean_setpoint'] == 19.0
+        # configuration must be left untouched
+        assert config.get_schedule('S2') is schedule
+        check_no_error(caplog, False)
+
+    def test_candidate_checks(self, caplog):
+        config:Configuration = Configuration(config_path, 'f1_', auto_save=False)
+        evaluator = ScheduleEvaluator(config, 2025)
+        # start times are given as strings, as received from remote controls
+        timeslots = [{'start_time':'00:00', 'temperature_set':'TSet1'}, {'start_time':'12:00', 'temperature_set':'TSet2'}]
+        candidate = {'alias':'New', 'schedule_items':[{'devices':['Dev3'], 'timeslots_sets':[{'dates':['1','2','3','4','5','6','7'], 'timeslots':timeslots}]}]}
+        cfgErr, stats = evaluator.evaluate([candidate])
+        assert not cfgErr
+        assert stats[0]['Dev3']['heating_hours'] == 8760.
+        # the candidate and the configuration are left untouched
+        assert timeslots[1]['start_time'] == '12:00'
+        assert config.get_schedule('New') is None
+        check_no_error(caplog, False)
+
+        # invalid candidates are rejected with the error set_schedule() would return
+        timeslots[1]['start_time'] = '25:00'
+        cfgErr, stats = evaluator.evaluate([config.get_schedule('S1'), candidate])
+        assert cfgErr.id == ECfgError.BAD_VALUE and stats is None
+        timeslots[1]['start_time'] = '12:00'
+        timeslots[1]['temperature_set'] = 'Unknown'
+        cfgErr = evaluator.get_setpoints_array(candidate)[0]
+        assert cfgErr.id == ECfgError.BAD_REFERENCE
+        assert config.get_schedule('New') is None
@@ -0,0 +1,124 @@
+from time import sleep
+import pytest
+from tests.helpers import *
+
+from scheduler import Scheduler, SchedulerCallbacks, ESchedulerChange
+from configuration import Configuration
+from device import Device
+import copy
+import datetime
+import threading
+
+
+# The goal here is to test the incremental handling of typed configuration changes :
+# only the devices whose setpoint actually moved must be sent to the controller
+class TestSchedulerChanges:
+    def apply_devices_setpoints(self, setpoints: dict[str,tuple[float,bool]]):
+        self.published.append(setpoints)
+        self.published_event.set()
+
+    def __start_scheduler(self, config:Configuration) -> Scheduler:
+        self.published:list[dict[str,tuple[float,bool]]] = []
+        self.published_event = threading.Event()
+        devices: dict[str, Device] = {}
+        config_devices = config.get_devices()
+        for devname in config_devices:
+            prot = config_devices[devname]['protocol']
+            devices[devname] = Device(devname, config_devices[devname]['entity'], "", prot['name'], prot['params'])
+        scheduler = Scheduler(config.get_scheduler(), self, devices, 0, 'setpoint_change')
+        # Waiting for all setpoints to be sent by the scheduler thread
+        assert self.published_event.wait(5)
+        assert set(self.published[0].keys()) == set(devices.keys())
+        self.published.clear()
+        return scheduler
+
+    def __check_published(self, expected:list[dict[str,tuple[float,bool]]]):
+        # The scheduler thread must not send anything else after the change
+        sleep(0.3)
+        assert self.published == expected
+        self.published.clear()
+
+    def test_changes(self, caplog):
+        config:Configuration = Configuration(config_path, 'f1_', auto_save=False)
+        # S1 is active : Dev1 and Dev2 use global TSet1 (except on wednesday afternoon for Dev1)
+        scheduler = self.__start_scheduler(config)
+        try:
+            dev1_setpoint = scheduler.timeline.get_setpoint('Dev1', datetime.datetime.now())[0]
+
+            # 1) Only Dev2 setpoint moves in global temperature sets
+            temperature_sets = copy.deepcopy(config.get_temperature_sets())
+            for temperature_set in temperature_sets:
+                for device in temperature_set['devices']:
+                    if device['device_name'] == 'Dev2':
+                        device['setpoint'] = 21.0
+            assert not config.set_temperature_sets(temperature_sets)
+            scheduler.on_change(ESchedulerChange.TEMPERATURE_SETS, {'schedule_name':''}, config.get_scheduler())
+            self.__check_published([{'Dev2':(21.0, False)}])
+
+            # 2) Renaming a temperature set or the active schedule does not move any setpoint
+            assert not config.change_temperature_set_name('TSet1', 'Comfort')
+            scheduler.on_change(ESchedulerChange.TEMPERATURE_SET_NAME, {'schedule_name':''}, config.get_scheduler())
+            assert not config.change_schedule_name('S1', 'Week')
+            scheduler.on_change(ESchedulerChange.SCHEDULE_NAME, {'old_name':'S1', 'new_name':'Week'}, config.get_scheduler())
+            self.__check_published([])
+            result = scheduler.get_setpoints(datetime.datetime.now())
+            assert result[1] == 'Week'
+            assert result[2]['Dev1'][0] == dev1_setpoint and result[2]['Dev2'][0] == 21.0
+
+            # 3) A local temperature set overrides Dev1 setpoint in the active schedule
+            local_sets = [{'alias':'Comfort', 'parent':'Comfort', 'devices':[{'device_name':'Dev1', 'setpoint':22.0}]},
+                          {'alias':'TSet2', 'parent':'TSet2', 'devices':[{'device_name':'Dev1', 'setpoint':22.0}]}]
+            assert not config.set_temperature_sets(local_sets, 'Week')
+            scheduler.on_change(ESchedulerChange.TEMPERATURE_SETS, {'schedule_name':'Week'}, config.get_scheduler())
+            self.__check_published([{'Dev1':(22.0, False)}])
+
+            # 4) A change in a schedule that is not in the active tree has no effect
+            assert not config.set_temperature_sets(copy.deepcopy(local_sets), 'S2')
+            scheduler.on_change(ESchedulerChange.TEMPERATURE_SETS, {'schedule_name':'S2'}, config.get_scheduler())
+            self.__check_published([])
+
+            # 5) Deleting the active schedule : all devices lose their setpoint
+            assert not config.delete_schedule('Week')
+            scheduler.on_change(ESchedulerChange.SCHEDULE_DELETED, {'schedule_name':'Week'}, config.get_scheduler())
+            sleep(0.3)
+            assert len(self.published) == 1
+            assert self.published[0]['Dev1'] == (None, False) and self.published[0]['Dev2'] == (None, False)
+            assert scheduler.get_setpoints(datetime.datetime.now()) == (True, None, {})
+        finally:
+            scheduler.stop()
+        check_no_error(caplog, False)
+
+    def test_partial_copy(self, caplog):
+        config:Configuration = Configuration(config_path, 'realistic1_', auto_save=False)
+        scheduler = self.__start_scheduler(config)
+        try:
+            schedules = {schedule['alias']:schedule for schedule in scheduler.config_scheduler['schedules']}
+            alias = config.get_schedules()[-1]['alias']
+            # a new temperature set, not referenced yet
+            local_sets = [{'alias':'Local', 'devices':[{'device_name':'Boiler', 'setpoint':10.0}]}]
+            assert not config.set_temperature_sets(local_sets, alias)
+            scheduler.on_change(ESchedulerChange.TEMPERATURE_SETS, {'schedule_name':alias}, config.get_scheduler())
+            # Only the changed schedule has been copied
+            for schedule in scheduler.config_scheduler['schedules']:
+                assert (schedule is schedules[schedule['alias']]) == (schedule['alias'] != alias)
+            self.__check_published([])
+        finally:
+            scheduler.stop()
+        check_no_error(caplog, False)
+
+    def test_device_deleted(self, caplog):
+        config:Configuration = Configuration(config_path, 'f1_', auto_save=False)
+        scheduler = self.__start_scheduler(config)
+        try:
+            # The controller replaced its devices dictionary (devices order change) : the scheduler keeps its own one
+            dev2:Device = scheduler.devices['Dev2']
+            dev2.enterManualMode()
+            scheduler.on_change(ESchedulerChange.DEVICE_DELETED, {'device_name':'Dev2'}, config.get_scheduler())
+            assert 'Dev2' not in scheduler.devices and 'Dev2' not in scheduler.current_setpoints
+            assert dev2.manual_mode_heap is None
+            # The deleted device does not receive any setpoint anymore
+            scheduler.on_devices_connect(['Dev1', 'Dev2'])
+            assert len(self.published) == 1 and set(self.published[0].keys()) == {'Dev1'}
+        finally:
+            scheduler.stop()
+        check_no_error(caplog, False)
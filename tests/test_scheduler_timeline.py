@@ -0,0 +1,256 @@
+from time import sleep
+import pytest
+from tests.helpers import *
+
+from scheduler import Scheduler, SchedulerCallbacks
+from configuration import Configuration
+from device import Device
+import copy
+import datetime
+
+
+def create_devices(config:Configuration) -> dict[str, Device]:
+    devices: dict[str, Device] = {}
+    config_devices = config.get_devices()
+    for devname in config_devices:
+        devparams = config_devices[devname]
+        prot = devparams['protocol']
+        devices[devname] = Device(devname, devparams['entity'], "", prot['name'], prot['params'])
+    return devices
+
+def create_schedule(alias:str, devices:list, tempset:str, parent:str=None) -> dict:
+    schedule = {'alias':alias,
+                'schedule_items':[
+                    {'devices':devices,
+                     'timeslots_sets':[
+                         {'dates':['1', '2', '3', '4', '5', '6', '7'],
+                          'timeslots':[
+                              {'start_time':datetime.time.fromisoformat('00:00:00'),
+                               'temperature_set':tempset}
+                          ]}
+                     ]}]}
+    if parent:
+        schedule['parent_schedule'] = parent
+    return schedule
+
+scheduler: Scheduler = None
+
+# The goal here is to test the setpoints computed from the compiled timeline of the active schedule,
+# most tests do not run the scheduler thread (a long init delay is used)
+class TestSchedulerTimeline:
+    def apply_devices_setpoints(self, setpoints: dict[str,tuple[float,bool]]):
+        global scheduler
+        if self.step == 1:
+            sleep(0.2) # To be sure that the scheduler variable has been set
+            assert setpoints['Dev1'] == (18.0, False)
+            self.step = 2
+            # The scheduler thread must wake up on its own at next timeslot start
+        elif self.step == 2:
+            assert setpoints['Dev1'] == (16.0, False)
+            self.step = -1
+            scheduler.stop()
+        else:
+            assert False
+
+    def __create_scheduler(self, prefix:str, active_schedule:str, extra_schedules:list=[]) -> Scheduler:
+        config:Configuration = Configuration(config_path, prefix, auto_save=False)
+        config_scheduler = config.get_scheduler()
+        config_scheduler['schedules'].extend(extra_schedules)
+        config_scheduler['active_schedule'] = active_schedule
+        return Scheduler(config_scheduler, self, create_devices(config), 3600, 'setpoint_change', 0.2)
+
+    def __get_setpoints(self, scheduler:Scheduler, date:str) -> dict[str,float]:
+        result = scheduler.get_setpoints(datetime.datetime.fromisoformat(date))
+        assert result[0]
+        return {name:value[0] for name, value in result[2].items()}
+
+    def test_week_days(self, caplog):
+        scheduler = self.__create_scheduler('f1_', 'S1')
+        try:
+            # Tuesday : only one timeslot
+            assert self.__get_setpoints(scheduler, "2025-01-21T13:00:00") == {'Dev1':18.0, 'Dev2':17.0}
+            # Wednesday : a second timeslot starts at 12:00 for Dev1
+            assert self.__get_setpoints(scheduler, "2025-01-22T11:59:59") == {'Dev1':18.0, 'Dev2':17.0}
+            assert self.__get_setpoints(scheduler, "2025-01-22T12:00:00") == {'Dev1':16.0, 'Dev2':17.0}
+            result = scheduler.get_setpoints(datetime.datetime.fromisoformat("2025-01-22T23:59:59"))
+            assert result[1] == 'S1'
+            assert result[2]['Dev1'] == (16.0, datetime.time.fromisoformat('12:00:00'))
+            assert self.__get_setpoints(scheduler, "2025-01-23T00:00:00") == {'Dev1':18.0, 'Dev2':17.0}
+        finally:
+            scheduler.stop()
+        check_no_error(caplog, False)
+
+    def test_weeks_A_B(self, caplog):
+        scheduler = self.__create_scheduler('realistic1_', 'Normal')
+        try:
+            # 2025-01-20 is in an even week (A), 2025-01-27 is in an odd week (B)
+            assert self.__get_setpoints(scheduler, "2025-01-20T14:20:00")['Boiler'] == 17.5
+            assert self.__get_setpoints(scheduler, "2025-01-27T14:20:00")['Boiler'] == 15.5
+            assert self.__get_setpoints(scheduler, "2025-01-27T16:50:00")['Boiler'] == 17.5
+        finally:
+            scheduler.stop()
+        check_no_error(caplog, False)
+
+    def test_inheritance_depth(self, caplog):
+        # 'C' inherits from 'B' that inherits from 'A' : each level brings its own device
+        schedules = [create_schedule('A', ['Dev1', 'Dev2', 'Dev3'], 'TSet1'),
+                     create_schedule('B', ['Dev1', 'Dev2'], 'TSet2', 'A'),
+                     create_schedule('C', ['Dev1'], 'TSet3', 'B')]
+        scheduler = self.__create_scheduler('f1_', 'C', schedules)
+        try:
+            assert self.__get_setpoints(scheduler, "2025-01-20T10:00:00") == {'Dev1':16.0, 'Dev2':19.0, 'Dev3':19.0}
+            # changing a parent schedule must be taken into account
+            scheduler.set_schedule(create_schedule('A', ['Dev3'], 'TSet2'))
+            assert self.__get_setpoints(scheduler, "2025-01-20T10:00:00") == {'Dev1':16.0, 'Dev2':19.0, 'Dev3':20.0}
+            scheduler.on_active_schedule_changed('A')
+            assert self.__get_setpoints(scheduler, "2025-01-20T10:00:00") == {'Dev3':20.0}
+            scheduler.on_active_schedule_changed(None)
+            assert scheduler.get_setpoints(datetime.datetime.now()) == (True, None, {})
+        finally:
+            scheduler.stop()
+        check_no_error(caplog, False)
+
+    def test_next_transition(self, caplog):
+        scheduler = self.__create_scheduler('f1_', 'S1')
+        try:
+            next_date = scheduler.timeline.get_next_transition(datetime.datetime.fromisoformat("2025-01-22T10:00:00"))
+            assert next_date == datetime.datetime.fromisoformat("2025-01-22T12:00:00")
+            next_date = scheduler.timeline.get_next_transition(datetime.datetime.fromisoformat("2025-01-22T12:00:00"))
+            assert next_date == datetime.datetime.fromisoformat("2025-01-23T00:00:00")
+            # Monday is identical to sunday : the only breakpoint left is the end of the week
+            next_date = scheduler.timeline.get_next_transition(datetime.datetime.fromisoformat("2025-01-26T10:00:00"))
+            assert next_date == datetime.datetime.fromisoformat("2025-01-27T00:00:00")
+        finally:
+            scheduler.stop()
+        check_no_error(caplog, False)
+
+    def test_next_transition_wakeup(self, caplog):
+        # No thread_wait_time : the scheduler thread sleeps until the next timeslot boundary
+        config:Configuration = Configuration(config_path, 'f1_', auto_save=False)
+        config_scheduler = config.get_scheduler()
+        schedule = create_schedule('test', ['Dev1'], 'TSet1')
+        schedule['schedule_items'][0]['timeslots_sets'][0]['timeslots'].append(
+            {'start_time':(datetime.datetime.now()+datetime.timedelta(seconds=1)).time(), 'temperature_set':'TSet2'})
+        config_scheduler['schedules'].append(schedule)
+        config_scheduler['active_schedule'] = 'test'
+
+        self.step = 1
+        global scheduler
+        scheduler = Scheduler(config_scheduler, self, create_devices(config), 0, 'setpoint_change')
+        scheduler.active_schedule_thread.join(10)
+        scheduler.stop()
+        scheduler = None
+        assert self.step == -1
+        check_no_error(caplog, False)
+
+    def test_forecast(self, caplog):
+        scheduler = self.__create_scheduler('realistic1_', 'Normal')
+        try:
+            start = datetime.datetime.fromisoformat("2025-01-20T14:20:00")
+            end = datetime.datetime.fromisoformat("2025-02-03T14:20:00")
+            forecast = scheduler.forecast(start, end)
+            # Each list starts with the setpoint at start date, then only contains actual setpoint changes
+            for name, changes in forecast.items():
+                assert changes[0] == (start, self.__get_setpoints(scheduler, "2025-01-20T14:20:00").get(name))
+                for idx in range(1, len(changes)):
+                    assert start < changes[idx][0] < end
+                    assert changes[idx][0] > changes[idx-1][0]
+                    assert changes[idx][1] != changes[idx-1][1]
+            # Forecast must be consistent with setpoints computed at any date (weeks A and B)
+            date = start
+            while date < end:
+                changes = forecast['Boiler']
+                expected = [change[1] for change in changes if change[0] <= date][-1]
+                assert self.__get_setpoints(scheduler, date.isoformat()).get('Boiler') == expected
+                date += datetime.timedelta(minutes=10)
+        finally:
+            scheduler.stop()
+        check_no_error(caplog, False)
+
+    def test_device_transitions(self, caplog):
+        scheduler = self.__create_scheduler('f1_', 'S1')
+        try:
+            timeline = scheduler.timeline
+            def transitions(name:str, start:str, end:str) -> tuple[bool,bool]:
+                return timeline.get_device_transitions(name, datetime.datetime.fromisoformat(start), datetime.datetime.fromisoformat(end))
+            # Dev1 : 16.0 on wednesday afternoon, start date is excluded and end date is included
+            assert transitions('Dev1', "2025-01-22T10:00:00", "2025-01-22T11:59:59") == (False, False)
+            assert transitions('Dev1', "2025-01-22T10:00:00", "2025-01-22T12:00:00") == (True, True)
+            assert transitions('Dev1', "2025-01-22T12:00:00", "2025-01-22T13:00:00") == (False, False)
+            # Several weeks : monday is identical to sunday, wednesday breakpoints are found
+            assert transitions('Dev1', "2025-01-24T10:00:00", "2025-01-28T10:00:00") == (False, False)
+            assert transitions('Dev1', "2025-01-24T10:00:00", "2025-03-28T10:00:00") == (True, True)
+            # Dev2 : always at 17.0, unknown device, and dates in wrong order
+            assert transitions('Dev2', "2025-01-20T10:00:00", "2025-03-28T10:00:00") == (False, False)
+            assert transitions('Dev9', "2025-01-20T10:00:00", "2025-03-28T10:00:00") == (False, False)
+            assert transitions('Dev1', "2025-01-22T13:00:00", "2025-01-22T10:00:00") == (False, False)
+        finally:
+            scheduler.stop()
+        check_no_error(caplog, False)
+
+    def test_manual_mode_heap(self, caplog):
+        scheduler = self.__create_scheduler('f1_', 'S1')
+        try:
+            devices = scheduler.devices
+            now = datetime.datetime.now()
+            devices['Dev2'].manual_setpoint_date = now - datetime.timedelta(hours=1)
+            devices['Dev1'].manual_setpoint_date = now - datetime.timedelta(hours=3)
+            assert scheduler.manual_modes.get_first_date() == devices['Dev1'].manual_setpoint_date
+            # A device that leaves manual mode is no longer in the heap
+            devices['Dev1'].exitManualMode()
+            assert scheduler.manual_modes.get_first_date() == devices['Dev2'].manual_setpoint_date
+            # A device that enters manual mode again is only present once, with its new date
+            devices['Dev1'].manual_setpoint_date = now - datetime.timedelta(hours=2)
+            devices['Dev1'].enterManualMode()
+            assert set(device.name for device in scheduler.manual_modes.get_devices()) == {'Dev1', 'Dev2'}
+            # Only expired devices are popped
+            assert [device.name for device in scheduler.manual_modes.pop_until(now - datetime.timedelta(minutes=30))] == ['Dev2']
+            assert scheduler.manual_modes.pop_until(now - datetime.timedelta(minutes=30)) == []
+            assert scheduler.manual_modes.get_first_date() == devices['Dev1'].manual_setpoint_date
+            # A copy of a device shares the heap
+            assert copy.deepcopy(devices['Dev1']).manual_mode_heap is scheduler.manual_modes
+        finally:
+            scheduler.stop()
+        check_no_error(caplog, False)
+
+    def test_tempset_inheritance(self, caplog):
+        schedule = create_schedule('test', ['Dev1', 'Dev2', 'Dev3'], 'Local')
+        # 'Local' only defines Dev1 and inherits the other setpoints from global 'TSet2'
+        # local 'TSet1' overrides Dev1 setpoint and inherits from global 'TSet1' with the same name
+        schedule['temperature_sets'] = [{'alias':'Local', 'parent':'TSet2', 'devices':[{'device_name':'Dev1', 'setpoint':21.0}]},
+                                        {'alias':'TSet1', 'parent':'TSet1', 'devices':[{'device_name':'Dev1', 'setpoint':22.0}]}]
+        scheduler = self.__create_scheduler('f1_', 'test', [schedule])
+        try:
+            assert self.__get_setpoints(scheduler, "2025-01-20T10:00:00") == {'Dev1':21.0, 'Dev2':19.0, 'Dev3':20.0}
+            schedule['schedule_items'][0]['timeslots_sets'][0]['timeslots'][0]['temperature_set'] = 'TSet1'
+            scheduler.set_schedule(schedule)
+            assert self.__get_setpoints(scheduler, "2025-01-20T10:00:00") == {'Dev1':22.0, 'Dev2':17.0, 'Dev3':19.0}
+        finally:
+            scheduler.stop()
+        check_no_error(caplog, False)
+
+    def test_no_config_growth(self, caplog):
+        # Regression test : evaluating setpoints must never modify the scheduler configuration
+        def get_sizes(config_scheduler:dict) -> list[int]:
+            sizes = [len(config_scheduler['temperature_sets']), len(config_scheduler['schedules'])]
+            for schedule in config_scheduler['schedules']:
+                sizes.append(len(schedule.get('temperature_sets', [])))
+            return sizes
+
+        schedule = create_schedule('test', ['Dev1', 'Dev2'], 'Local')
+        schedule['temperature_sets'] = [{'alias':'Local', 'parent':'TSet2', 'devices':[{'device_name':'Dev1', 'setpoint':21.0}]}]
+        scheduler = self.__create_scheduler('f1_', 'test', [schedule])
+        try:
+            config_scheduler = copy.deepcopy(scheduler.config_scheduler)
+            sizes = get_sizes(scheduler.config_scheduler)
+            table_size = len(scheduler.compiler.tempsets_table)
+            date = datetime.datetime.fromisoformat("2025-01-20T00:00:00")
+            for tick in range(5000):
+                scheduler.get_setpoints(date + datetime.timedelta(minutes=tick))
+                if tick%500 == 0:
+                    scheduler.set_scheduler(config_scheduler)
+            assert get_sizes(scheduler.config_scheduler) == sizes
+            assert len(scheduler.compiler.tempsets_table) == table_size
+        finally:
+            scheduler.stop()
+        check_no_error(caplog, False)
@@ -67,7 +67,7 @@ class TestServer:
 
         cmdlist = ["set_setpoint","set_device_name","add_device","set_device_entity",
                    "delete_device","set_active_schedule","delete_schedule","set_schedule_name","set_schedule_properties",
-                   "set_schedule","set_scheduler_settings","set_tempset_name","set_tempsets"]
+                   "set_schedule","set_scheduler_settings","set_tempset_name","set_tempsets","get_forecast","evaluate_schedules"]
 
         params = {}
         for cmdname in cmdlist:
@@ -110,6 +110,14 @@ class TestServer:
                    ("set_schedules_order", ""),
                    ("set_tempset_name", {"old_name":"tset#1", "new_name":"", "schedule_name":""}),
                    ("set_tempsets", {"temperature_sets":"", "schedule_name":""}),
+                   ("get_forecast", {"start":"", "end":"2025-01-27T00:00:00"}),
+                   ("get_forecast", {"start":"2025-01-27T00:00:00", "end":"2025-01-20T00:00:00"}),
+                   ("get_forecast", {"start":"2025-01-01T00:00:00", "end":"2025-03-01T00:00:00"}),
+                   ("get_stats", ""),
+                   ("evaluate_schedules", {"schedules":[]}),
+                   ("evaluate_schedules", {"schedules":"schedule#1"}),
+                   ("evaluate_schedules", {"schedules":[{}], "year":"never"}),
+                   ("evaluate_schedules", {"schedules":[{}], "heating_threshold":"high"}),
                    ]
 
         for cmd in cmdlist:
@@ -352,6 +360,116 @@ class TestServer:
 
         self.__stop_env()
 
+    def test_get_forecast(self, caplog):
+        caplog.set_level(logging.INFO)
+        self.__start_env()
+
+        TSHelpers.change_active_schedule("schedule#1", caplog)
+
+        # schedule#1 : device#1 setpoint is 15.0 from monday to friday, nothing on weekends
+        cmdname = "get_forecast"
+        params = {"start": "2025-01-20T00:00:00", "end": "2025-01-27T12:00:00"}
+        FakeMQTTClient.send_fake_message(cmdname, params, cmd_topic)
+        response = json.loads(FakeMQTTClient.instance.published_messages[response_topic])
+        assert response['cmd'] == cmdname
+        assert response['status'] == 'success'
+        assert response['data'] == {'device#1': [['2025-01-20T00:00:00', 15.0],
+                                                 ['2025-01-25T00:00:00', None],
+                                                 ['2025-01-27T00:00:00', 15.0]]}
+        check_no_error(caplog, True)
+
+        # No active schedule : no forecast
+        TSHelpers.change_active_schedule("", caplog)
+        FakeMQTTClient.send_fake_message(cmdname, params, cmd_topic)
+        response = json.loads(FakeMQTTClient.instance.published_messages[response_topic])
+        assert response['status'] == 'success'
+        assert response['data'] == {}
+
+        self.__stop_env()
+
+    def test_get_stats(self, caplog):
+        caplog.set_level(logging.INFO)
+        self.__start_env()
+
+        cmdname = "get_stats"
+        FakeMQTTClient.send_fake_message(cmdname, {}, cmd_topic)
+        response = json.loads(FakeMQTTClient.instance.published_messages[response_topic])
+        assert response['cmd'] == cmdname and response['status'] == 'success'
+        assert not 'device#2' in response['data']['acknowledge']
+        assert set(response['data']['repeater']) == {'outstanding', 'retried', 'abandoned'}
+
+        # the device acknowledges a setpoint change by reporting its new setpoint
+        FakeMQTTClient.send_fake_message("set_setpoint", {"device_name": "device#2", "setpoint":20.0}, cmd_topic)
+        FakeMQTTClient.send_fake_message_raw('20.0', 'homeassistant/climate/test-dev-entity#2/temperature')
+        FakeMQTTClient.send_fake_message(cmdname, {}, cmd_topic)
+        response = json.loads(FakeMQTTClient.instance.published_messages[response_topic])
+        assert response['status'] == 'success'
+        stats = response['data']['acknowledge']['device#2']
+        assert stats['count'] == 1 and 0. <= stats['mean'] <= stats['max']
+        assert response['data']['repeater']['outstanding'] == 0 and response['data']['repeater']['abandoned'] == 0
+        check_no_error(caplog, True)
+
+        self.__stop_env()
+
+    def test_evaluate_schedules(self, caplog):
+        # numpy is an optional dependency of the server
+        pytest.importorskip('numpy')
+        caplog.set_level(logging.INFO)
+        self.__start_env()
+
+        # device#1 is at 15.0 (tset#1) from monday to friday in schedule#1, and every day in the candidate
+        candidate = {"alias": "candidate",
+                     "schedule_items": [{"devices": ["device#1"],
+                                         "timeslots_sets": [{"dates": ['1','2','3','4','5','6','7'],
+                                                             "timeslots": [{"start_time": "00:00:00", "temperature_set": "tset#1"}]}]}]}
+        schedule1 = FakeMQTTClient.instance.published_messages_json[on_scheduler_topic]['schedules'][0]
+        assert schedule1['alias'] == 'schedule#1'
+        cmdname = "evaluate_schedules"
+        FakeMQTTClient.send_fake_message(cmdname, {"schedules": [schedule1, candidate], "year": 2025}, cmd_topic)
+        response = json.loads(FakeMQTTClient.instance.published_messages[response_topic])
+        assert response['cmd'] == cmdname and response['status'] == 'success'
+        assert len(response['data']) == 2
+        # 261 week days in 2025
+        assert response['data'][0]['device#1'] == {'heating_hours':261*24., 'mean_setpoint':15.0, 'min_setpoint':15.0, 'max_setpoint':15.0}
+        assert response['data'][1]['device#1']['heating_hours'] == 8760.
+        FakeMQTTClient.send_fake_message(cmdname, {"schedules": [candidate], "year": 2025, "heating_threshold": 15.0}, cmd_topic)
+        response = json.loads(FakeMQTTClient.instance.published_messages[response_topic])
+        assert response['status'] == 'success' and response['data'][0]['device#1']['heating_hours'] == 0.
+        # the candidate is not added to the configuration
+        assert not TSHelpers.find_schedule("candidate")
+        check_no_error(caplog, True)
+
+        # an invalid candidate is rejected as set_schedule would do
+        candidate['schedule_items'][0]['timeslots_sets'][0]['timeslots'][0]['temperature_set'] = "unknown"
+        FakeMQTTClient.send_fake_message(cmdname, {"schedules": [candidate]}, cmd_topic)
+        response = json.loads(FakeMQTTClient.instance.published_messages[response_topic])
+        assert response['status'] == 'failure' and response['error']['id'] == 'BAD_REFERENCE'
+
+        self.__stop_env()
+
+    def test_reconnect_with_queued_setpoints(self, caplog):
+        caplog.set_level(logging.INFO)
+        self.__start_env()
+        base_topic = 'homeassistant/climate/test-dev-entity#'
+
+        # the 3 devices use the same broker : the first setpoint is sent right away, the other ones are queued
+        self.controller.apply_devices_setpoints({'device#1':(17.0,False), 'device#2':(18.0,False), 'device#3':(19.0,False)})
+        assert FakeMQTTClient.instance.published_messages[base_topic+'1/new_setpoint'] == '17.0'
+        assert not base_topic+'3/new_setpoint' in FakeMQTTClient.instance.published_messages
+        assert self.controller.setpoint_dispatcher.get_pending_count() == 2
+        # queued setpoints are already the scheduled ones
+        assert self.controller.devices['device#2'].scheduled_setpoint == 18.0
+        assert self.controller.devices['device#3'].scheduled_setpoint == 19.0
+
+        # device#3 reconnects before its setpoint is sent : it gets its latest scheduled setpoint at once, and only once
+        FakeMQTTClient.send_fake_message_raw('unavailable', base_topic+'3/state')
+        FakeMQTTClient.send_fake_message_raw('heat', base_topic+'3/state')
+        assert FakeMQTTClient.instance.published_messages[base_topic+'3/new_setpoint'] == '19.0'
+        assert self.controller.setpoint_dispatcher.get_pending_count() == 1
+        check_no_error(caplog, True)
+
+        self.__stop_env()
+
     def test_delete_schedule(self, caplog):
         caplog.set_level(logging.INFO)
         self.__start_env()
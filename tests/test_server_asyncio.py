@@ -0,0 +1,53 @@
+import asyncio
+import datetime
+import logging
+from os import path
+import threading
+import pytest
+from tests.helpers import *
+
+from controller import Controller
+from protocols import mqttclient
+from timer_service import AsyncioTimerService
+from tests.fake_mqtt_client import FakeMQTTClient
+from tests.test_server_helpers import *
+
+
+# The goal here is to test the asyncio mode of the controller :
+# the whole server runs in the event loop, without any thread of its own
+class TestServerAsyncio:
+    async def __run_server(self, caplog):
+        threads_count = threading.active_count()
+        controller = Controller(config_path, 'global_', asyncio.get_running_loop())
+        controller.start()
+        try:
+            assert isinstance(controller.timer_service, AsyncioTimerService)
+            assert FakeMQTTClient.instance.loop is asyncio.get_running_loop()
+            assert is_alive_topic in FakeMQTTClient.instance.published_messages
+            # The scheduler is driven by loop timers
+            assert controller.scheduler.active_schedule_thread.thread is None
+            assert threading.active_count() == threads_count
+
+            # schedule#1 : device#1 setpoint is 15.0 from monday to friday
+            controller.scheduler.set_test_date(datetime.datetime.fromisoformat("2025-01-20T10:00:00"))
+            TSHelpers.change_active_schedule("schedule#1", caplog)
+            # Waiting for the scheduler init delay (1 sec)
+            await asyncio.sleep(1.5)
+            assert controller.devices['device#1'].scheduled_setpoint == 15.0
+            assert controller.timer_service.get_stats()['calls'] > 0
+        finally:
+            controller.stop()
+        assert FakeMQTTClient.instance.bconnected == False
+
+    def test_asyncio_mode(self, caplog):
+        caplog.set_level(logging.INFO)
+        remove_file(path.join(config_path,'global_configuration.yaml'))
+        FakeMQTTClient.replace_methods(mqttclient.MQTTClient)
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(self.__run_server(caplog))
+        finally:
+            loop.close()
+            FakeMQTTClient.restore_methods(mqttclient.MQTTClient)
+            remove_file(path.join(config_path,'global_configuration.yaml'))
+        check_no_error(caplog, True)
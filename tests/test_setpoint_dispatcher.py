@@ -0,0 +1,56 @@
+import pytest
+from tests.helpers import *
+
+from setpoint_dispatcher import SetpointDispatcher
+from timer_service import TimerService
+import time
+
+
+# The goal here is to test the paced sending of setpoints : one token bucket per connection client,
+# dispatch() never blocks, and waiting setpoints are replaced by newer ones
+class TestSetpointDispatcher:
+    def __send(self, device_name:str, setpoint:float):
+        self.sent.append((device_name, setpoint, time.monotonic()))
+
+    def test_pacing(self, caplog):
+        self.sent:list = []
+        timers = TimerService()
+        timers.start()
+        dispatcher = SetpointDispatcher(timers, self.__send, 0.1)
+        try:
+            start = time.monotonic()
+            dispatcher.dispatch('broker1', [('dev1', 20.), ('dev2', 20.), ('dev3', 20.)])
+            dispatcher.dispatch('broker2', [('dev4', 18.), ('dev5', 18.)])
+            # the first setpoint of each client is sent right away, the call does not wait for the others
+            assert time.monotonic() - start < 0.05
+            assert [item[0] for item in self.sent] == ['dev1', 'dev4']
+            assert dispatcher.get_pending_count() == 3
+            # newer setpoints replace waiting ones, without changing the sending order
+            dispatcher.dispatch('broker1', [('dev3', 21.), ('dev2', 19.)])
+            dispatcher.cancel('dev5')
+            time.sleep(0.35)
+        finally:
+            dispatcher.stop()
+            timers.stop()
+        broker1 = [item for item in self.sent if item[0] in ('dev1', 'dev2', 'dev3')]
+        assert [(item[0], item[1]) for item in broker1] == [('dev1', 20.), ('dev2', 19.), ('dev3', 21.)]
+        assert broker1[1][2] - broker1[0][2] == pytest.approx(0.1, abs=0.04)
+        assert broker1[2][2] - broker1[1][2] == pytest.approx(0.1, abs=0.04)
+        assert not 'dev5' in [item[0] for item in self.sent]
+        assert dispatcher.get_stats() == {'sent':4, 'coalesced':2}
+        check_no_error(caplog, False)
+
+    def test_stop(self, caplog):
+        self.sent:list = []
+        timers = TimerService()
+        timers.start()
+        dispatcher = SetpointDispatcher(timers, self.__send, 0.05)
+        try:
+            dispatcher.dispatch('broker1', [('dev1', 20.), ('dev2', 20.)])
+            dispatcher.stop()
+            dispatcher.dispatch('broker1', [('dev3', 20.)])
+            time.sleep(0.1)
+        finally:
+            timers.stop()
+        assert [item[0] for item in self.sent] == ['dev1']
+        check_no_error(caplog, False)
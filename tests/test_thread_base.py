@@ -0,0 +1,59 @@
+import pytest
+from tests.helpers import *
+
+from thread_base import ThreadBase
+import threading
+import time
+
+
+# The goal here is to test that threads waiting in ThreadBase.wait() are woken up
+# immediately by stop() and notify(), and that timeouts are exact
+class TestThreadBase:
+    def __thread(self):
+        self.started.set()
+        while self.thread.wait(self.delay, self.notifiable):
+            self.wakeups.append(time.monotonic())
+        self.stopped = time.monotonic()
+
+    def __start(self, delay:float, notifiable:bool = True):
+        self.delay = delay
+        self.notifiable = notifiable
+        self.wakeups:list[float] = []
+        self.stopped:float = None
+        self.started = threading.Event()
+        self.thread = ThreadBase()
+        self.thread.start(self.__thread)
+        assert self.started.wait(5)
+
+    def test_stop(self):
+        self.__start(3600)
+        start = time.monotonic()
+        self.thread.stop()
+        assert self.stopped - start < 0.1
+        assert self.wakeups == []
+
+    def test_timeout(self):
+        self.__start(0.15)
+        start = time.monotonic()
+        time.sleep(0.5)
+        self.thread.stop()
+        assert len(self.wakeups) == 3
+        assert self.wakeups[0] - start == pytest.approx(0.15, abs=0.05)
+
+    def test_notify(self):
+        self.__start(3600)
+        start = time.monotonic()
+        self.thread.notify()
+        time.sleep(0.1)
+        assert len(self.wakeups) == 1 and self.wakeups[0] - start < 0.1
+        self.thread.stop()
+
+    def test_not_notifiable(self):
+        self.__start(0.3, False)
+        start = time.monotonic()
+        self.thread.notify()
+        time.sleep(0.1)
+        assert self.wakeups == []
+        time.sleep(0.3)
+        assert len(self.wakeups) == 1 and self.wakeups[0] - start >= 0.3
+        self.thread.stop()
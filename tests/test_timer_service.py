@@ -0,0 +1,54 @@
+import pytest
+from tests.helpers import *
+
+from timer_service import TimerService
+import threading
+import time
+
+
+# The goal here is to test the shared timer service : one-shot and periodic timers
+# registered by several components are called by a single dispatcher thread
+class TestTimerService:
+    def __callback(self, name:str):
+        self.calls.append((name, time.monotonic(), threading.get_ident()))
+
+    def test_timers(self, caplog):
+        self.calls:list = []
+        timers = TimerService()
+        timers.start()
+        try:
+            start = time.monotonic()
+            periodic = timers.call_periodic(0.1, self.__callback, 'periodic')
+            timers.call_later(0.25, self.__callback, 'later')
+            timers.call_later(0.05, self.__callback, 'first')
+            cancelled = timers.call_later(0.15, self.__callback, 'cancelled')
+            timers.cancel(cancelled)
+            time.sleep(0.37)
+            periodic.cancel()
+            time.sleep(0.2)
+        finally:
+            timers.stop()
+        names = [call[0] for call in self.calls]
+        assert names == ['first', 'periodic', 'periodic', 'later', 'periodic']
+        # deadlines are met, and all callbacks are called from the same thread
+        for name, date, _ in self.calls:
+            if name == 'later':
+                assert date - start == pytest.approx(0.25, abs=0.05)
+        assert len(set(call[2] for call in self.calls)) == 1
+        stats = timers.get_stats()
+        assert stats['calls'] == 5 and 0. <= stats['mean_lateness'] <= stats['max_lateness'] < 0.05
+        check_no_error(caplog, False)
+
+    def test_callback_exception(self, caplog):
+        self.calls:list = []
+        timers = TimerService()
+        timers.start()
+        try:
+            timers.call_later(0.01, lambda: 1/0)
+            timers.call_later(0.02, self.__callback, 'after')
+            time.sleep(0.1)
+        finally:
+            timers.stop()
+        # An exception in a callback is logged, and does not stop the dispatcher
+        assert [call[0] for call in self.calls] == ['after']
+        assert find_first_error(caplog) is not None
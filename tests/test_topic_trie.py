@@ -0,0 +1,38 @@
+import pytest
+from tests.helpers import *
+
+from protocols.topic_trie import TopicTrie
+
+
+# The goal here is to test the matching of topics against MQTT filters with '+' and '#' wildcards
+class TestTopicTrie:
+    def test_match(self):
+        trie = TopicTrie()
+        trie.add('homeassistant/climate/+/+/#', 'discovery')
+        trie.add('homeassistant/status', 'status')
+        trie.add('homeassistant/#', 'all')
+        trie.add('+/status', 'any status')
+        trie.add('homeassistant/status', 'status2')
+
+        assert trie.match('homeassistant/status') == [('status', []), ('all', ['status']), ('any status', ['homeassistant']), ('status2', [])]
+        assert trie.match('homeassistant/climate/climate_1/temperature') == [('discovery', ['climate_1', 'temperature', '']),
+                                                                             ('all', ['climate/climate_1/temperature'])]
+        assert trie.match('homeassistant/climate/climate_1/attr/friendly_name') == [('discovery', ['climate_1', 'attr', 'friendly_name']),
+                                                                                    ('all', ['climate/climate_1/attr/friendly_name'])]
+        # '#' matches its parent level, '+' matches a single level
+        assert trie.match('homeassistant') == [('all', [''])]
+        assert trie.match('homeassistant/climate/climate_1') == [('all', ['climate/climate_1'])]
+        assert trie.match('other/topic') == []
+        # wildcards at first level do not match '$' topics
+        assert trie.match('$SYS/status') == []
+
+    def test_remove(self):
+        trie = TopicTrie()
+        trie.add('homeassistant/status', 'client1')
+        trie.add('homeassistant/status', 'client2')
+        assert trie.remove('homeassistant/status', 'client1') == True
+        assert trie.remove('homeassistant/status', 'client1') == False
+        assert trie.remove('homeassistant/unknown', 'client2') == False
+        assert trie.match('homeassistant/status') == [('client2', [])]
+        trie.clear()
+        assert trie.match('homeassistant/status') == []